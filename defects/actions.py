@@ -1,9 +1,28 @@
+"""
+User actions shown on the home page.
+
+Every rule is a condition on an annotated queryset, so all the rules of a role are
+evaluated by the database in one query over the user's open incidents (or pending
+approvals), regardless of how many incidents the user has.
+
+The actions of a user are cached until an incident, approval or solution of theirs
+changes (see `defects.signals`). Urgency depends on the time and is calculated from the
+cached deadlines when the actions are read.
+"""
+
 import enum
-from typing import List
-from .models import Incident, Approval
-from dataclasses import dataclass
+from typing import List, Callable, Optional
+from .models import Incident, Approval, Solution
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
-from django.utils.timezone import now
+from django.core.cache import cache
+from django.db.models import Q, Exists, OuterRef, Subquery, Count, Value, ExpressionWrapper, BooleanField
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now, localdate
+from .versions import get_version, bump_version
+
+# the cached actions also expire every day, as solutions become due for verification by date
+INBOX_TIMEOUT = 60 * 60 * 24
 
 
 class Urgency(enum.Enum):
@@ -28,116 +47,225 @@ class UserAction:
     message: str
     incident: Incident
     time_required: datetime
+    deadline: Optional[datetime] = None
+    warning_period: timedelta = timedelta(0)
+    due: Optional[datetime] = None
 
+    def at(self, current_time) -> "UserAction":
+        """
+        The action as of `current_time`: with its urgency based on the time left until the deadline,
+        required by its due date, or required now.
+        """
+        if self.deadline is not None:
+            return replace(self, time_required=self.deadline, urgency=_urgency(self.deadline, self.warning_period, current_time))
+        return replace(self, time_required=self.due or current_time)
+
+
+@dataclass
+class Rule:
+    message: str
+    condition: Q
+    # urgency is DANGER once the deadline has passed and WARNING within the warning period of it,
+    # rules without a deadline have a fixed urgency and are required by their due date, or now
+    deadline: Optional[Callable[[Incident], datetime]] = None
+    warning_period: timedelta = timedelta(0)
+    urgency: Urgency = Urgency.INFO
+    due: Optional[Callable[[Incident], datetime]] = None
+
+
+def _urgency(time_required, warning_period, current_time) -> Urgency:
+    time_remaining = time_required - current_time
+    if time_remaining < timedelta(hours=0):
+        return Urgency.DANGER
+    if time_remaining < warning_period:
+        return Urgency.WARNING
+    return Urgency.INFO
+
+
+def _evaluate(queryset, rules: List[Rule], get_incident=lambda obj: obj) -> List[UserAction]:
+    """
+    Annotates every rule as a boolean on `queryset` and returns the actions of the matching rows.
+    """
+    current_time = now()
+    flags = {f"rule_{ix}": ExpressionWrapper(rule.condition, output_field=BooleanField()) for ix, rule in enumerate(rules)}
+
+    any_rule = Q()
+    for rule in rules:
+        any_rule |= rule.condition
+
+    rows = list(queryset.annotate(**flags).filter(any_rule))
 
-def reliability_engineer_actions(user_id) -> List[UserAction]:
     actions = []
+    for ix, rule in enumerate(rules):
+        for row in rows:
+            if not getattr(row, f"rule_{ix}"):
+                continue
+            incident = get_incident(row)
+            deadline = rule.deadline(incident) if rule.deadline else None
+            due = rule.due(incident) if rule.due else None
+            action = UserAction(
+                message=rule.message,
+                time_required=current_time,
+                urgency=rule.urgency,
+                incident=incident,
+                deadline=deadline,
+                warning_period=rule.warning_period,
+                due=due,
+            )
+            actions.append(action.at(current_time))
+    return actions
+
+
+def pending_approval_condition():
+    # RCA and notification approvals are pending until an outcome is chosen, close-out approvals until scored
+    return Q(outcome="", type__in=[Approval.RCA, Approval.NOTIFICATION]) | Q(score=0, type=Approval.CLOSE_OUT)
+
+
+def _approvals(**filters):
+    return Approval.objects.filter(incident=OuterRef("pk"), **filters)
+
+
+def _latest_outcome(approval_type, role):
+    return Subquery(_approvals(type=approval_type, role=role).order_by("-time_modified").values("outcome")[:1])
+
 
-    # load into list here and then iterate over
-    incidents = list(
-        Incident.objects.filter(
-            created_by_id=user_id,
+def open_incidents():
+    """
+    Incidents that still require work, annotated with the approval and solution state the rules depend on.
+    """
+    return (
+        Incident.objects.filter(time_anniversary_reviewed__isnull=True)
+        .annotate(
+            notification_pending=Exists(_approvals(type=Approval.NOTIFICATION, outcome="")),
+            notification_decided=Exists(_approvals(type=Approval.NOTIFICATION).exclude(outcome="")),
+            notification_accepted=Exists(_approvals(type=Approval.NOTIFICATION, outcome=Approval.ACCEPTED)),
+            rca_pending=Exists(_approvals(type=Approval.RCA, outcome="")),
+            rca_sam_accepted=Exists(_approvals(type=Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER, outcome=Approval.ACCEPTED)),
+            rca_sem_requested=Exists(_approvals(type=Approval.RCA, role=Approval.SECTION_ENGINEERING_MANAGER)),
+            rca_sam_outcome=_latest_outcome(Approval.RCA, Approval.SENIOR_ASSET_MANAGER),
+            rca_sem_outcome=_latest_outcome(Approval.RCA, Approval.SECTION_ENGINEERING_MANAGER),
+            close_out_pending=Exists(_approvals(type=Approval.CLOSE_OUT, score=0)),
+            close_out_scored_count=Coalesce(
+                Subquery(_approvals(type=Approval.CLOSE_OUT).exclude(score=0).values("incident").annotate(count=Count("*")).values("count")),
+                Value(0),
+            ),
+            has_solutions=Exists(Solution.objects.filter(incident=OuterRef("pk"))),
+            has_unverified_solutions=Exists(
+                Solution.objects.filter(incident=OuterRef("pk"), planned_completion_date__lte=localdate(), date_verified__isnull=True)
+            ),
         )
-        .prefetch_related("approvals", "solutions")
     )
-    # might need to add another filter to only consider
-    # incidents that are "recent"
-
-    # 1  check for notification creation
-    message = "Create 48H Notification"
-    for i in incidents:
-        if i.notification_time_published:
-            continue
-        time_required = i.time_end + timedelta(hours=48)
-        time_remaining = time_required - now()
-        if time_remaining < timedelta(hours=0):
-            urgency = Urgency.DANGER
-        elif timedelta(hours=0) < time_remaining < timedelta(hours=24):
-            urgency = Urgency.WARNING
-        else:
-            urgency = Urgency.INFO
-        actions.append(UserAction(message=message, time_required=time_required, urgency=urgency, incident=i))
-
-    # 2 - text changed from SRS document
-    message = "Resubmit Rejected 48H Notification"
-    for i in incidents:
-        if i.notification_rejected and not i.has_pending_approval(Approval.NOTIFICATION):
-            actions.append(UserAction(message=message, time_required=now(), urgency=Urgency.DANGER, incident=i))
-
-    # 3
-    message = "Upload RCA Report"
-    for i in incidents:
-        if not i.significant:
-            continue
-        if i.report_file != "":
-            continue
-        if i.notification_time_approved is None:
-            continue
-        time_required = i.notification_time_published + timedelta(days=14)
-        time_remaining = time_required - now()
-        if time_remaining < timedelta(hours=0):
-            urgency = Urgency.DANGER
-        elif time_remaining < timedelta(days=7):
-            urgency = Urgency.WARNING
-        else:
-            urgency = Urgency.INFO
-        actions.append(UserAction(message=message, urgency=urgency, incident=i, time_required=time_required))
-
-    message = "Submit RCA Report to SnrAM"
-    # todo: implement
-
-    message = "Submit RCA Report to SEM"
-    for i in incidents:
-        if i.significant and Approval.objects.filter(incident=i, type=Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER).exists() and not i.has_pending_approval(Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER) and not i.has_pending_approval(Approval.RCA, role=Approval.SECTION_ENGINEERING_MANAGER) :
-            actions.append(UserAction(message=message, time_required=now(), urgency=Urgency.INFO, incident=i))
-
-    message = "Resubmit Rejected RCA Report"
-    for i in incidents:
-        if i.rca_report_rejected and not i.has_pending_approval(Approval.RCA):
-            actions.append(UserAction(message=message, time_required=now(), urgency=Urgency.DANGER, incident=i))
-
-    message = "Publish Close-Out Slide"
-    for i in incidents:
-        if i.close_out_time_published is not None:
-            continue
-        if i.close_out_time_approved:
-            continue
-        if (i.significant and i.rca_report_time_approved) or (not i.significant):
-            time_required = i.notification_time_published + timedelta(days=14)
-            time_remaining = time_required - now()
-            if time_remaining < timedelta(hours=0):
-                urgency = Urgency.DANGER
-            elif time_remaining < timedelta(days=7):
-                urgency = Urgency.WARNING
-            else:
-                urgency = Urgency.INFO
-
-            actions.append(UserAction(message=message, incident=i, urgency=urgency, time_required=time_required))
-
-    message = "Resubmit Rejected Close-Out Slide"
-    for i in incidents:
-        if i.close_out_rejected and not i.has_pending_approval(Approval.CLOSE_OUT):
-            actions.append(UserAction(message=message, time_required=now(), urgency=Urgency.DANGER, incident=i))
-
-    message = "Add Solutions"
-    for i in incidents:
-        if i.close_out_time_approved and len(i.solutions.all()) == 0:
-            actions.append(UserAction(message=message, time_required=i.close_out_time_approved + timedelta(days=14), urgency=Urgency.INFO, incident=i))
-
-    message = "Verify Completion Date"
-    for i in incidents:
-        if not i.close_out_time_approved:
-            continue
-        for s in i.solutions.all():
-            if s.planned_completion_date and s.planned_completion_date <= now().date() and not s.date_verified:
-                actions.append(UserAction(message=message, time_required=now(), urgency=Urgency.INFO, incident=i))
 
-    return actions
 
-def get_user_actions(user) -> List[UserAction]:
+# conditions on `open_incidents()`
+
+NOTIFICATION_REQUIRED = Q(notification_time_published__isnull=True, time_end__isnull=False)
+
+NOTIFICATION_REJECTED = Q(notification_time_published__isnull=False, notification_decided=True, notification_accepted=False)
+
+RCA_REPORT_REQUIRED = Q(significant=True, report_file="", notification_time_approved__isnull=False, notification_time_published__isnull=False)
+
+RCA_REPORT_REJECTED = Q(significant=True, rca_report_time_approved__isnull=True, rca_report_time_published__isnull=False) & (
+    Q(rca_sam_outcome=Approval.REJECTED) | Q(rca_sem_outcome=Approval.REJECTED)
+)
+
+CLOSE_OUT_REQUIRED = Q(close_out_time_published__isnull=True, close_out_time_approved__isnull=True, notification_time_published__isnull=False) & (
+    Q(significant=True, rca_report_time_approved__isnull=False) | Q(significant=False)
+)
+
+CLOSE_OUT_REJECTED = Q(close_out_time_published__isnull=False, close_out_scored_count__gt=1, close_out_time_approved__isnull=True)
+
+
+def _notification_deadline(incident):
+    return incident.time_end + Incident.NOTIFICATION_DEADLINE
+
+
+def _rca_report_deadline(incident):
+    return incident.notification_time_published + Incident.RCA_REPORT_DEADLINE
+
+
+RELIABILITY_ENGINEER_RULES = [
+    Rule("Create 48H Notification", NOTIFICATION_REQUIRED, deadline=_notification_deadline, warning_period=timedelta(hours=24)),
+    # text changed from SRS document
+    Rule("Resubmit Rejected 48H Notification", NOTIFICATION_REJECTED & Q(notification_pending=False), urgency=Urgency.DANGER),
+    Rule("Upload RCA Report", RCA_REPORT_REQUIRED, deadline=_rca_report_deadline, warning_period=timedelta(days=7)),
+    # todo: "Submit RCA Report to SnrAM"
+    Rule("Submit RCA Report to SEM", Q(significant=True, rca_sam_accepted=True, rca_sem_requested=False)),
+    Rule("Resubmit Rejected RCA Report", RCA_REPORT_REJECTED & Q(rca_pending=False), urgency=Urgency.DANGER),
+    Rule("Publish Close-Out Slide", CLOSE_OUT_REQUIRED, deadline=_rca_report_deadline, warning_period=timedelta(days=7)),
+    Rule("Resubmit Rejected Close-Out Slide", CLOSE_OUT_REJECTED & Q(close_out_pending=False), urgency=Urgency.DANGER),
+    Rule(
+        "Add Solutions",
+        Q(close_out_time_approved__isnull=False, has_solutions=False),
+        due=lambda incident: incident.close_out_time_approved + timedelta(days=14),
+    ),
+    Rule("Verify Completion Date", Q(close_out_time_approved__isnull=False, has_unverified_solutions=True)),
+]
+
+SECTION_ENGINEER_RULES = [
+    Rule("Assist with 48H Notification", NOTIFICATION_REQUIRED, deadline=_notification_deadline, warning_period=timedelta(hours=24)),
+    Rule("Assist with RCA Report", RCA_REPORT_REQUIRED, deadline=_rca_report_deadline, warning_period=timedelta(days=7)),
+]
+
+# conditions on pending approvals
+APPROVAL_RULES = [
+    Rule("Review 48H Notification", Q(type=Approval.NOTIFICATION), urgency=Urgency.WARNING),
+    Rule("Review RCA Report", Q(type=Approval.RCA), urgency=Urgency.WARNING),
+    Rule("Review Close-Out Slide", Q(type=Approval.CLOSE_OUT), urgency=Urgency.WARNING),
+]
+
+
+def reliability_engineer_actions(user_id) -> List[UserAction]:
+    return _evaluate(open_incidents().filter(created_by_id=user_id), RELIABILITY_ENGINEER_RULES)
+
+
+def section_engineer_actions(user_id) -> List[UserAction]:
+    return _evaluate(open_incidents().filter(section_engineer_id=user_id), SECTION_ENGINEER_RULES)
+
+
+def approval_actions(user_id, role) -> List[UserAction]:
+    approvals = Approval.objects.filter(pending_approval_condition(), user_id=user_id, role=role, incident__isnull=False).select_related("incident")
+    return _evaluate(approvals, APPROVAL_RULES, get_incident=lambda approval: approval.incident)
+
+
+def compute_user_actions(user) -> List[UserAction]:
     groups = list([g.name for g in user.groups.all()])
     actions = []
     if "reliability_engineer" in groups:
         actions += reliability_engineer_actions(user.id)
+    if "section_engineer" in groups:
+        actions += section_engineer_actions(user.id)
+
+    for group, role in [
+        ("section_engineer", Approval.SECTION_ENGINEER),
+        ("section_engineering_manager", Approval.SECTION_ENGINEERING_MANAGER),
+        ("senior_asset_manager", Approval.SENIOR_ASSET_MANAGER),
+    ]:
+        if group in groups:
+            actions += approval_actions(user.id, role)
+
+    return actions
+
+
+def _inbox_version_name(user_id):
+    return f"inbox:{user_id}"
+
+
+def invalidate_user_actions(user_ids):
+    for user_id in set(user_ids):
+        if user_id is not None:
+            bump_version(_inbox_version_name(user_id))
+
+
+def get_user_actions(user) -> List[UserAction]:
+    version = get_version(_inbox_version_name(user.id))
+    key = f"user_actions:{user.id}:{version}:{localdate().isoformat()}"
+
+    actions = cache.get(key)
+    if actions is None:
+        actions = compute_user_actions(user)
+        cache.set(key, actions, INBOX_TIMEOUT)
 
+    current_time = now()
+    actions = [action.at(current_time) for action in actions]
     return sorted(actions, key=lambda x: _urgency_value(x.urgency))
@@ -1,6 +1,14 @@
-from django.contrib import admin
+import io
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from import_export.admin import ImportExportModelAdmin
 from import_export.resources import ModelResource
+from .equipment_import import import_equipment, read_rows
+from .forms import EquipmentImportForm
 from .models import Solution, Incident, Equipment, Section, Area, Operation, Feedback, ResourcePrice
 
 admin.site.site_header = "DE Tool Admin"
@@ -15,7 +23,38 @@ class ReliabilityIncidentAdmin(ImportExportModelAdmin):
 
 @admin.register(Equipment)
 class EquipmentAdmin(ImportExportModelAdmin):
-    pass
+    change_list_template = "admin/defects/equipment/change_list.html"
+
+    def get_urls(self):
+        urls = [path("bulk-import/", self.admin_site.admin_view(self.bulk_import_view), name="defects_equipment_bulk_import")]
+        return urls + super().get_urls()
+
+    def bulk_import_view(self, request):
+        """
+        Imports a SAP functional location extract with `import_equipment`, which is much faster
+        than the row by row import of django-import-export for large files.
+        """
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+
+        form = EquipmentImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            fp = io.TextIOWrapper(form.cleaned_data["file"].file, encoding="utf-8-sig", newline="")
+            try:
+                result = import_equipment(read_rows(fp), dry_run=form.cleaned_data["dry_run"])
+            except (ValueError, UnicodeDecodeError) as e:
+                form.add_error("file", str(e))
+            else:
+                self.message_user(request, f"{'Dry run: ' if form.cleaned_data['dry_run'] else ''}{result}", messages.SUCCESS)
+                return HttpResponseRedirect(reverse("admin:defects_equipment_changelist"))
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Bulk import functional locations",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/defects/equipment/bulk_import.html", context)
 
 
 class SolutionResource(ModelResource):
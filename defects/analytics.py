@@ -0,0 +1,122 @@
+"""
+Columnar (Parquet or Arrow IPC) exports of the incident, solution and approval history
+for analysis, e.g. with `pandas.read_parquet(path, columns=[...])`.
+
+Every concrete field of the model is a column with a matching Arrow type (foreign keys as
+their id), followed by the names of related objects. Rows are read from the database in
+chunks and written as one record batch (a row group in Parquet) per chunk.
+
+Requires pyarrow, which is an optional dependency (`pip install .[analytics]`).
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+from .models import Incident, Solution, Approval
+
+FORMATS = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+BATCH_SIZE = 20000
+
+
+@dataclass
+class Dataset:
+    model: type
+    # additional columns: name -> lookup of a related object's field
+    related: Dict[str, str] = field(default_factory=dict)
+
+    def columns(self):
+        """
+        Returns [(column name, lookup, model field)].
+        """
+        columns = [(f.attname, f.attname, f) for f in self.model._meta.concrete_fields]
+        for name, lookup in self.related.items():
+            columns.append((name, lookup, _resolve_field(self.model, lookup)))
+        return columns
+
+
+def _resolve_field(model, lookup):
+    *path, name = lookup.split("__")
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(name)
+
+
+DATASETS = {
+    "incidents": Dataset(
+        Incident,
+        related={
+            "operation_name": "operation__name",
+            "area_name": "area__name",
+            "section_name": "section__name",
+            "equipment_code": "equipment__code",
+            "equipment_name": "equipment__name",
+        },
+    ),
+    "solutions": Dataset(Solution, related={"incident_code": "incident__code"}),
+    "approvals": Dataset(Approval, related={"incident_code": "incident__code"}),
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured("Analytics exports require pyarrow, install the `analytics` extra.")
+    return pyarrow
+
+
+def _arrow_type(pa, f):
+    if isinstance(f, models.ForeignKey):
+        return _arrow_type(pa, f.target_field)
+    if isinstance(f, models.DateTimeField):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(f, models.DateField):
+        return pa.date32()
+    if isinstance(f, models.DecimalField):
+        return pa.decimal128(f.max_digits, f.decimal_places)
+    if isinstance(f, models.BooleanField):
+        return pa.bool_()
+    if isinstance(f, (models.IntegerField, models.AutoField)):
+        return pa.int64()
+    if isinstance(f, models.FloatField):
+        return pa.float64()
+    # char, text and file fields
+    return pa.string()
+
+
+def write_dataset(fp, name, file_format="parquet", batch_size=BATCH_SIZE):
+    """
+    Writes the dataset `name` to the binary file `fp`, returns the number of rows written.
+    """
+    pa = _pyarrow()
+    dataset = DATASETS[name]
+    columns = dataset.columns()
+    schema = pa.schema([pa.field(column_name, _arrow_type(pa, f), nullable=True) for column_name, _, f in columns])
+
+    if file_format == "parquet":
+        writer = pa.parquet.ParquetWriter(fp, schema, compression="zstd")
+    elif file_format == "arrow":
+        writer = pa.ipc.new_file(fp, schema)
+    else:
+        raise ValueError(f"Unknown format: {file_format}")
+
+    rows = dataset.model.objects.order_by("pk").values_list(*[lookup for _, lookup, _ in columns]).iterator(chunk_size=min(batch_size, 2000))
+    count = 0
+    with writer:
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            arrays = [pa.array(values, type=schema.field(ix).type) for ix, values in enumerate(zip(*batch))]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            count += len(batch)
+    return count
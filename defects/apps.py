@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DefectsxxxConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "defects"
+
+    def ready(self):
+        from . import signals  # noqa: F401
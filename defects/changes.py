@@ -0,0 +1,93 @@
+"""
+Change feed of incidents and solutions, for systems that keep a copy of them.
+
+Rows are returned in (time_modified, id) order after a watermark, so a sync only reads the
+rows that changed since the previous one. Every page ends with the watermark to pass to the
+next call. Deleted incidents are read from the audit log (their solutions are deleted with
+them); solutions are not audited, so deleting a single solution is not part of the feed.
+
+Rows saved in the last SETTLE_TIME are left for the next call: a transaction may commit a
+row with a modification time before the time of a query that did not see it yet.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from auditlog.models import LogEntry
+from auditlog.registry import auditlog
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import Incident, Solution
+from .analytics import DATASETS
+
+SETTLE_TIME = timedelta(seconds=60)
+PAGE_SIZE = 1000
+
+FEEDS = {"incidents": Incident, "solutions": Solution}
+
+_WATERMARK_FORMAT = "%Y%m%dT%H%M%S%f"
+
+
+@dataclass(frozen=True)
+class Watermark:
+    time: datetime
+    id: int = 0
+
+    def __str__(self):
+        return f"{self.time.astimezone(timezone.utc).strftime(_WATERMARK_FORMAT)}-{self.id}"
+
+    @classmethod
+    def parse(cls, value: str) -> "Watermark":
+        """
+        Raises ValueError if `value` is not a watermark returned by the feed.
+        """
+        time, _, pk = value.partition("-")
+        return cls(datetime.strptime(time, _WATERMARK_FORMAT).replace(tzinfo=timezone.utc), int(pk or 0))
+
+
+@dataclass
+class ChangePage:
+    rows: list
+    deleted: list
+    watermark: Watermark
+    has_more: bool
+
+
+def _deleted_ids(model, since: Optional[Watermark], until: datetime):
+    if not auditlog.contains(model):
+        return []
+    entries = LogEntry.objects.filter(content_type=ContentType.objects.get_for_model(model), action=LogEntry.Action.DELETE, timestamp__lt=until)
+    if since is not None:
+        entries = entries.filter(timestamp__gte=since.time)
+    return sorted({int(x) for x in entries.values_list("object_pk", flat=True)})
+
+
+def changes(name, since: Optional[Watermark] = None, limit=PAGE_SIZE, current_time: datetime = None) -> ChangePage:
+    """
+    The rows of feed `name` created or modified after `since` (all rows if it is None), and the
+    ids of rows deleted since then.
+    """
+    model = FEEDS[name]
+    # the columns of the analytics export of the same name
+    columns = DATASETS[name].columns()
+    until = (current_time or now()) - SETTLE_TIME
+
+    rows = model.objects.filter(time_modified__lt=until)
+    if since is not None:
+        rows = rows.filter(Q(time_modified__gt=since.time) | Q(time_modified=since.time, pk__gt=since.id))
+    rows = list(rows.order_by("time_modified", "pk").values_list(*[lookup for _, lookup, _ in columns])[: limit + 1])
+
+    has_more = len(rows) > limit
+    rows = [dict(zip([column_name for column_name, _, _ in columns], row)) for row in rows[:limit]]
+
+    if has_more:
+        # the next page continues after the last row, deletions up to that time are on this page
+        watermark = Watermark(rows[-1]["time_modified"], rows[-1]["id"])
+    else:
+        # every change before `until` has been returned
+        watermark = Watermark(until)
+
+    return ChangePage(rows=rows, deleted=_deleted_ids(model, since, watermark.time), watermark=watermark, has_more=has_more)
@@ -0,0 +1,116 @@
+"""
+Bulk import of SAP functional locations into Equipment.
+
+The file is read row by row and compared to the existing codes, which are loaded in one
+query. New and renamed equipment is then written with `bulk_create` and `bulk_update` in
+batches, in a single transaction. Equipment missing from the file is kept, as incidents
+refer to it.
+"""
+
+import csv
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Tuple
+
+from django.db import transaction
+
+from .models import Equipment, Incident
+from .search import index_incident
+from .versions import bump_version
+
+BATCH_SIZE = 1000
+
+# accepted column headers, compared case-insensitively; the SAP extract uses the longer names
+CODE_HEADERS = {"code", "functional location", "functional_location", "funcloc"}
+NAME_HEADERS = {"name", "description", "functional location description", "funcloc description"}
+
+CODE_MAX_LENGTH = Equipment._meta.get_field("code").max_length
+NAME_MAX_LENGTH = Equipment._meta.get_field("name").max_length
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    # seconds spent per step
+    timings: dict = field(default_factory=dict)
+
+    def __str__(self):
+        timings = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self.timings.items())
+        return f"{self.created} created, {self.updated} updated, {self.unchanged} unchanged, {self.skipped} skipped ({timings})"
+
+
+def read_rows(fp) -> Iterable[Tuple[str, str]]:
+    """
+    Yields (code, name) for every row of the CSV text file `fp`, which has a header row.
+    Rows without a code are yielded with an empty code.
+    """
+    reader = csv.reader(fp)
+    header = [x.strip().lower() for x in next(reader, [])]
+    code_ix = next((ix for ix, x in enumerate(header) if x in CODE_HEADERS), None)
+    name_ix = next((ix for ix, x in enumerate(header) if x in NAME_HEADERS), None)
+    if code_ix is None or name_ix is None:
+        raise ValueError(f"The file needs a code ({', '.join(sorted(CODE_HEADERS))}) and a name ({', '.join(sorted(NAME_HEADERS))}) column.")
+
+    for row in reader:
+        if len(row) <= max(code_ix, name_ix):
+            yield "", ""
+            continue
+        yield row[code_ix].strip(), row[name_ix].strip()
+
+
+def import_equipment(rows: Iterable[Tuple[str, str]], batch_size=BATCH_SIZE, dry_run=False) -> ImportResult:
+    result = ImportResult()
+
+    t0 = time.perf_counter()
+    existing = {code: (pk, name) for pk, code, name in Equipment.objects.values_list("pk", "code", "name").iterator(chunk_size=5000)}
+    result.timings["load"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    created = {}
+    updated = {}
+    seen = set()
+    for code, name in rows:
+        if not code or len(code) > CODE_MAX_LENGTH:
+            result.skipped += 1
+            continue
+        name = name[:NAME_MAX_LENGTH]
+        if code in existing:
+            seen.add(code)
+            pk, current_name = existing[code]
+            if current_name != name:
+                updated[code] = Equipment(pk=pk, code=code, name=name)
+            else:
+                # a later row of the same code may have reverted a rename
+                updated.pop(code, None)
+        else:
+            # the last row of a code wins
+            created[code] = Equipment(code=code, name=name)
+    result.created = len(created)
+    result.updated = len(updated)
+    result.unchanged = len(seen) - len(updated)
+    result.timings["diff"] = time.perf_counter() - t0
+
+    if dry_run:
+        return result
+
+    t0 = time.perf_counter()
+    with transaction.atomic():
+        Equipment.objects.bulk_create(created.values(), batch_size=batch_size)
+        Equipment.objects.bulk_update(updated.values(), ["name"], batch_size=batch_size)
+        _reindex_incidents([x.pk for x in updated.values()])
+    result.timings["write"] = time.perf_counter() - t0
+
+    # bulk operations do not send the signals that refresh the equipment typeahead
+    if created or updated:
+        bump_version("equipment")
+    return result
+
+
+def _reindex_incidents(equipment_ids, batch_size=BATCH_SIZE):
+    # the equipment name is part of the search document of an incident
+    for ix in range(0, len(equipment_ids), batch_size):
+        for incident in Incident.objects.filter(equipment_id__in=equipment_ids[ix : ix + batch_size]).select_related("equipment"):
+            index_incident(incident)
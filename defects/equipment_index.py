@@ -0,0 +1,120 @@
+"""
+In-memory lookup index for the equipment (functional location) typeahead.
+
+Codes are kept in a sorted list, so all codes with a given prefix form a contiguous
+range found with two binary searches. Names are indexed by their trigrams; a query is
+answered by intersecting the posting lists of its trigrams and confirming the substring.
+Queries shorter than a trigram only match codes, as they would match most names.
+"""
+
+import heapq
+from bisect import bisect_left
+from dataclasses import dataclass
+
+from .models import Equipment
+from .versions import VersionedCache
+
+MAX_RESULTS = 50
+
+# rank of a match, lower is better
+EXACT_CODE = 0
+CODE_PREFIX = 1
+NAME_PREFIX = 2
+NAME_WORD_PREFIX = 3
+NAME_SUBSTRING = 4
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[ix : ix + 3] for ix in range(len(text) - 2)}
+
+
+@dataclass(frozen=True)
+class EquipmentEntry:
+    id: int
+    code: str
+    name: str
+
+    @property
+    def label(self):
+        # same as Equipment.__str__
+        return f"{self.code} – {self.name}"
+
+
+class EquipmentIndex:
+    def __init__(self, rows):
+        # entries are stored in tie-break order (shortest code first), so an entry's position doubles as its sort key
+        self.entries = sorted((EquipmentEntry(id=pk, code=code, name=name) for pk, code, name in rows), key=lambda e: (len(e.code), e.code))
+        self._names = [e.name.lower() for e in self.entries]
+
+        # (lowercase code, entry index) sorted by code
+        codes = sorted((e.code.lower(), ix) for ix, e in enumerate(self.entries))
+        self._codes = [c for c, _ in codes]
+        self._code_entries = [ix for _, ix in codes]
+
+        postings = {}
+        for ix, name in enumerate(self._names):
+            for trigram in trigrams(name):
+                postings.setdefault(trigram, []).append(ix)
+        self._trigrams = postings
+
+    def _code_matches(self, query):
+        start = bisect_left(self._codes, query)
+        end = bisect_left(self._codes, query + "\uffff", lo=start)
+        for pos in range(start, end):
+            ix = self._code_entries[pos]
+            yield ix, EXACT_CODE if self._codes[pos] == query else CODE_PREFIX
+
+    def _name_candidates(self, query):
+        grams = trigrams(query)
+        if not grams:
+            # too short for trigrams
+            return []
+
+        lists = []
+        for gram in grams:
+            posting = self._trigrams.get(gram)
+            if posting is None:
+                return []
+            lists.append(posting)
+        lists.sort(key=len)
+
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query: str, limit=MAX_RESULTS) -> list[EquipmentEntry]:
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        ranks = dict(self._code_matches(query))
+
+        for ix in self._name_candidates(query):
+            name = self._names[ix]
+            pos = name.find(query)
+            if pos == -1:
+                continue
+            if pos == 0:
+                rank = NAME_PREFIX
+            elif not name[pos - 1].isalnum():
+                rank = NAME_WORD_PREFIX
+            else:
+                rank = NAME_SUBSTRING
+            ranks[ix] = min(rank, ranks.get(ix, rank))
+
+        best = heapq.nsmallest(limit, ((rank, ix) for ix, rank in ranks.items()))
+        return [self.entries[ix] for _, ix in best]
+
+
+def _build_index():
+    return EquipmentIndex(Equipment.objects.values_list("id", "code", "name").iterator(chunk_size=5000))
+
+
+_index = VersionedCache("equipment", _build_index)
+
+
+def search_equipment(query: str, limit=MAX_RESULTS) -> list[EquipmentEntry]:
+    return _index.get().search(query, limit=limit)
@@ -1,19 +1,211 @@
+"""
+CSV and Excel exports of the registers.
+
+Rows are read in chunks from a server-side cursor (where the database supports it) and
+written to the response as they are read, so memory use does not grow with the table size
+and the download starts immediately.
+
+Register exports are a projection of `Column`s, with the names of related objects joined
+in the same query, over the queryset filtered like the register page. Workbooks can only be
+sent once complete, so they are written to a temporary file first.
+"""
+
 import csv
-from django.db import connection, connections
+import tempfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import List, Union
+
+import xlsxwriter
+
+from django.db.models import F, Value, CharField
+from django.db.models.expressions import Combinable
+from django.db.models.functions import Coalesce, Concat, NullIf, Trim
+from django.utils.timezone import localtime
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File-like object that returns what is written to it, so `csv.writer` can be used to produce lines.
+    """
+
+    def write(self, value):
+        return value
+
+
+@dataclass
+class Column:
+    name: str
+    header: str
+    # a lookup of the exported model or an expression
+    expression: Union[str, Combinable]
+
+
+def _user_name(lookup):
+    full_name = Trim(Concat(f"{lookup}__first_name", Value(" "), f"{lookup}__last_name", output_field=CharField()))
+    return Coalesce(NullIf(full_name, Value("")), f"{lookup}__username", output_field=CharField())
+
+
+# all columns are exported in this order, unless a subset is selected with `?columns=`
+
+INCIDENT_COLUMNS = [
+    Column("code", "RI No.", "code"),
+    Column("status", "Status", "status"),
+    Column("time_start", "Start", "time_start"),
+    Column("time_end", "End", "time_end"),
+    Column("operation", "Operation", "operation__name"),
+    Column("area", "Area", "area__name"),
+    Column("section", "Section", "section__name"),
+    Column("equipment_code", "Functional Location", "equipment__code"),
+    Column("equipment", "Equipment", "equipment__name"),
+    Column("short_description", "Description", "short_description"),
+    Column("created_by", "Reliability Engineer", _user_name("created_by")),
+    Column("section_engineer", "Section Engineer", _user_name("section_engineer")),
+    Column("significant", "Significant", "significant"),
+    Column("trigger", "Trigger", "trigger"),
+    Column("long_description", "Long Description", "long_description"),
+    Column("immediate_action_taken", "Immediate Action Taken", "immediate_action_taken"),
+    Column("remaining_risk", "Remaining Risk", "remaining_risk"),
+    Column("production_value_loss", "Production Value Loss", "production_value_loss"),
+    Column("rand_value_loss", "Rand Value Loss", "rand_value_loss"),
+    Column("repair_cost", "Repair Cost", "repair_cost"),
+    Column("notification_time_published", "48H Notification Published", "notification_time_published"),
+    Column("notification_time_approved", "48H Notification Approved", "notification_time_approved"),
+    Column("rca_report_time_published", "RCA Report Published", "rca_report_time_published"),
+    Column("rca_report_time_approved", "RCA Report Approved", "rca_report_time_approved"),
+    Column("close_out_time_published", "Close-Out Published", "close_out_time_published"),
+    Column("close_out_time_approved", "Close-Out Approved", "close_out_time_approved"),
+    Column("close_out_confidence", "Close-Out Confidence", "close_out_confidence"),
+    Column("close_out_rating", "Close-Out Rating", "close_out_rating"),
+    Column("time_anniversary_reviewed", "Anniversary Reviewed", "time_anniversary_reviewed"),
+    Column("anniversary_success", "Anniversary Success", "anniversary_success"),
+    Column("time_created", "Created", "time_created"),
+]
+
+SOLUTION_COLUMNS = [
+    Column("incident", "RI No.", "incident__code"),
+    Column("status", "Status", "status"),
+    Column("description", "Solution Description", "description"),
+    Column("timeframe", "Timeframe", "timeframe"),
+    Column("priority", "Priority", "priority"),
+    Column("person_responsible", "Person Responsible", "person_responsible"),
+    Column("planned_completion_date", "Planned Completion Date", "planned_completion_date"),
+    Column("actual_completion_date", "Actual Completion Date", "actual_completion_date"),
+    Column("date_verified", "Date Verified", "date_verified"),
+    Column("dr_number", "DR No.", "dr_number"),
+    Column("remarks", "Remarks", "remarks"),
+    Column("verification_comment", "Verification Comment", "verification_comment"),
+    Column("operation", "Operation", "incident__operation__name"),
+    Column("area", "Area", "incident__area__name"),
+    Column("section", "Section", "incident__section__name"),
+    Column("equipment_code", "Functional Location", "incident__equipment__code"),
+    Column("created_by", "Created By", _user_name("created_by")),
+    Column("time_created", "Created", "time_created"),
+]
+
+
+def select_columns(columns, names=None) -> List[Column]:
+    """
+    The columns named in the comma separated `names`, in that order, or all columns if no names are given.
+    Raises ValueError for unknown names.
+    """
+    if not names:
+        return list(columns)
+    by_name = {x.name: x for x in columns}
+    selected = []
+    for name in names.split(","):
+        name = name.strip()
+        if name not in by_name:
+            raise ValueError(f"Unknown column: {name}")
+        selected.append(by_name[name])
+    return selected
+
+
+def export_rows(queryset, columns: List[Column], chunk_size=CHUNK_SIZE):
+    """
+    Yields the values of `columns` for every row of `queryset`, with the related names joined in the same query.
+    """
+    # aliased as the column names may clash with the model fields
+    aliases = {f"export_{x.name}": F(x.expression) if isinstance(x.expression, str) else x.expression for x in columns}
+    return queryset.annotate(**aliases).values_list(*aliases).iterator(chunk_size=chunk_size)
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return localtime(value).strftime("%Y-%m-%d %H:%M")
+    return value
+
+
+def stream_rows_csv(queryset, columns: List[Column], chunk_size=CHUNK_SIZE):
+    """
+    Yields the CSV lines of `queryset`, with a header row of the column headers.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([x.header for x in columns])
+    chunk = []
+    for row in export_rows(queryset, columns, chunk_size=chunk_size):
+        chunk.append(writer.writerow([_csv_value(x) for x in row]))
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def _excel_datetime(value):
+    # Excel has no time zones, times are shown as local times
+    return localtime(value).replace(tzinfo=None)
+
 
-def export_table_csv(fp, table_name, connection_name=None):
+def write_rows_xlsx(fp, queryset, columns: List[Column], sheet_name="Sheet1", chunk_size=CHUNK_SIZE):
+    """
+    Writes `queryset` as a workbook with a typed cell for every value to the binary file `fp`.
 
-    conn = connection
-    if connection_name is not None:
-        conn = connections[connection_name]
+    Rows are written to disk as they are read (constant memory mode of XlsxWriter), so memory
+    use does not grow with the number of rows.
+    """
+    workbook = xlsxwriter.Workbook(
+        fp,
+        {
+            "constant_memory": True,
+            "tmpdir": tempfile.gettempdir(),
+            # descriptions are text, even if they look like a formula or a link
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        },
+    )
+    header_format = workbook.add_format({"bold": True})
+    datetime_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+    decimal_format = workbook.add_format({"num_format": "#,##0.00"})
 
-    writer = csv.writer(fp)
+    sheet = workbook.add_worksheet(sheet_name)
+    sheet.freeze_panes(1, 0)
+    for ix, column in enumerate(columns):
+        sheet.set_column(ix, ix, max(12, len(column.header) + 2))
+        sheet.write_string(0, ix, column.header, header_format)
 
-    with conn.cursor() as c:
-        c.execute(f"SELECT * FROM {table_name};")
-        headers = [col[0] for col in c.description]
-        writer.writerow(headers)
-        for row in c.fetchall():
-            writer.writerow(row)
+    row_ix = 0
+    for row_ix, row in enumerate(export_rows(queryset, columns, chunk_size=chunk_size), start=1):
+        for ix, value in enumerate(row):
+            if value is None:
+                continue
+            elif isinstance(value, bool):
+                sheet.write_boolean(row_ix, ix, value)
+            elif isinstance(value, datetime):
+                sheet.write_datetime(row_ix, ix, _excel_datetime(value), datetime_format)
+            elif isinstance(value, date):
+                sheet.write_datetime(row_ix, ix, value, date_format)
+            elif isinstance(value, Decimal):
+                sheet.write_number(row_ix, ix, value, decimal_format)
+            elif isinstance(value, (int, float)):
+                sheet.write_number(row_ix, ix, value)
+            else:
+                sheet.write_string(row_ix, ix, str(value))
 
+    sheet.autofilter(0, 0, row_ix, len(columns) - 1)
+    workbook.close()
     return fp
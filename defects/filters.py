@@ -0,0 +1,83 @@
+"""
+Search and filter parameters of the RI register and the solution tracker, shared by the
+lists, their exports and the report packs.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+
+from .search import search_incidents
+
+
+def _date_param(params, name):
+    try:
+        return parse_date(params.get(name) or "")
+    except ValueError:
+        return None
+
+
+def filter_incidents(incidents, params):
+    """
+    Applies the RI register search and filter parameters to an incident queryset.
+    When a search query is given, incidents are annotated with `search_rank`.
+    """
+    query = params.get("query", "")
+
+    if query:
+        incidents = search_incidents(incidents, query)
+
+    area_id = params.get("area")
+    if area_id:
+        incidents = incidents.filter(area_id=area_id)
+
+    section_id = params.get("section")
+    if section_id:
+        incidents = incidents.filter(section_id=section_id)
+
+    operation_id = params.get("operation")
+    if operation_id:
+        incidents = incidents.filter(operation_id=operation_id)
+
+    status = params.get("status")
+    if status:
+        incidents = incidents.filter(status=status)
+
+    # dates of occurrence, both inclusive; compared as a range so the index on time_start is used
+    start = _date_param(params, "start")
+    if start:
+        incidents = incidents.filter(time_start__gte=make_aware(datetime.combine(start, time.min)))
+
+    end = _date_param(params, "end")
+    if end:
+        incidents = incidents.filter(time_start__lt=make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+    return incidents
+
+
+def filter_solutions(solutions, params):
+    """
+    Applies the solution tracker search and filter parameters to a solution queryset.
+    """
+    query = params.get("query", "")
+
+    if query:
+        search_filters = Q(description__icontains=query) | Q(remarks__icontains=query) | Q(person_responsible__icontains=query)
+        solutions = solutions.filter(search_filters)
+
+    # todo: this filter needs to be fixed since the db column was removed
+    # status = params.get("status")
+    # if status:
+    #     solutions = solutions.filter(status=status)
+
+    timeframe = params.get("timeframe")
+    if timeframe:
+        solutions = solutions.filter(timeframe=timeframe)
+
+    incident_id = params.get("incident_id")
+    if incident_id:
+        solutions = solutions.filter(incident_id=incident_id)
+
+    return solutions
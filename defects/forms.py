@@ -6,7 +6,18 @@ from .models import Incident, Approval, Area, Operation, Section, Solution, Reso
 from django.contrib.auth.models import User
 from django.db.models.query_utils import Q
 from decimal import Decimal
-from collections import defaultdict
+
+from .taxonomy import get_taxonomy
+
+def set_taxonomy_choices(form):
+    """
+    Serves the operation, area and section options from the cached taxonomy instead of querying them.
+    """
+    taxonomy = get_taxonomy()
+    for name, nodes in [("operation", taxonomy.operations), ("area", taxonomy.areas), ("section", taxonomy.sections)]:
+        if name in form.fields:
+            form.fields[name].choices = taxonomy.choices(nodes)
+
 
 EFFECT_CHOICES = (
     ("repair", "Estimated cost of Repair > R 250K"),
@@ -58,6 +69,7 @@ class IncidentCreateForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields["equipment"].choices = []  # load options with ajax
         self.fields["section_engineer"].queryset = User.objects.filter(groups__name__in=["section_engineer"]).distinct()
+        set_taxonomy_choices(self)
 
         self.fields["time_start"].widget.attrs.update({"historic": ""})
         self.fields["time_end"].widget.attrs.update({"historic": ""})
@@ -139,12 +151,13 @@ class IncidentUpdateForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         choices = [] if not self.instance else [(self.instance.equipment_id, str(self.instance.equipment))]
         self.fields["equipment"].choices = choices  # load options with ajax
+        set_taxonomy_choices(self)
         conditions = Q(groups__name__in=["section_engineer"])
         if self.instance:
             conditions = conditions | Q(id=self.instance.section_engineer_id)
         self.fields["section_engineer"].queryset = User.objects.filter(conditions)
 
-        rp = ResourcePrice.objects.order_by("-time_created").select_related("created_by").first()
+        rp = ResourcePrice.current()
         rp_date = rp.time_created.strftime("%Y-%m-%d")
         self.fields["resource_price"].help_text = mark_safe(
             f"Resource price was last updated on <strong>{rp_date}</strong> "
@@ -167,7 +180,12 @@ class IncidentUpdateForm(forms.ModelForm):
             self.add_error("time_end", msg)
 
     def clean_rand_value_loss(self):
-        return (self.cleaned_data["production_value_loss"] * self.cleaned_data["resource_price"]).quantize(Decimal("1.00"))
+        ounces = self.cleaned_data["production_value_loss"]
+        resource_price = self.cleaned_data["resource_price"]
+        if resource_price == self.initial["resource_price"]:
+            # not changed, the loss is valued at the price in effect when the incident started
+            return ResourcePrice.rand_cost(ounces, when=self.cleaned_data.get("time_start"))
+        return (ounces * resource_price).quantize(Decimal("1.00"))
 
 
 class IncidentNotificationApprovalSendForm(forms.Form):
@@ -267,6 +285,12 @@ class IncidentFilterForm(forms.Form):
         + list(Incident.STATUS_CHOICES),
         required=False,
     )
+    start = forms.DateField(required=False, label="Occurred from", help_text="Format: YYYY-MM-DD")
+    end = forms.DateField(required=False, label="Occurred until", help_text="Format: YYYY-MM-DD")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        set_taxonomy_choices(self)
 
 
 class SolutionFilterForm(forms.Form):
@@ -290,6 +314,11 @@ class SolutionFilterForm(forms.Form):
     )
 
 
+class EquipmentImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV extract of SAP functional locations with a 'Functional Location' and a 'Description' column.")
+    dry_run = forms.BooleanField(required=False, help_text="Only report the changes.")
+
+
 class IncidentSignificanceUpdateForm(forms.ModelForm):
     class Meta:
         model = Incident
@@ -350,21 +379,4 @@ def conditional_forms_payload():
     All keys and values are cast to string as it will be used in a browser HTML context
     """
 
-    sections_qs = Section.objects.all().only("id", "area_id")
-    areas_qs = Area.objects.all().only("id", "operation_id")
-
-    sections = defaultdict(list)
-    areas = defaultdict(list)
-
-    for section in sections_qs:
-        key = "" if section.area_id is None else str(section.area_id)
-        sections[key].append(str(section.id))
-
-    for area in areas_qs:
-        key = "" if area.operation_id is None else str(area.operation_id)
-        areas[key].append(str(area.id))
-
-    return {
-        "areas": dict(areas),
-        "sections": dict(sections)
-    }
+    return get_taxonomy().conditionals
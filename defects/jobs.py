@@ -0,0 +1,155 @@
+"""
+Database-backed queue of PDF reports and packs of reports, so rendering does not hold up a
+web worker.
+
+Views add jobs with `enqueue` when PDF_JOBS is enabled, and the `run_pdf_worker` command
+renders them. A job is claimed with a conditional UPDATE, so any number of workers can
+poll the same table without a broker or database specific locking. Jobs left running
+by a worker that died are picked up again after STALE_TIMEOUT; packs move their start time
+on after every report, and a worker only saves a job it still owns.
+"""
+
+import logging
+import tempfile
+from datetime import timedelta
+from typing import Optional
+
+from django.core.files import File
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import PdfJob
+from .packs import pack_file_name, pack_incidents, write_pack
+from .reports import build_report, render_pdf
+
+logger = logging.getLogger(__name__)
+
+STALE_TIMEOUT = timedelta(minutes=10)
+
+# finished jobs and their files are deleted after this time, the PDFs are still in the render cache
+RETENTION = timedelta(days=1)
+
+
+def enqueue(kind, incident, user) -> PdfJob:
+    """
+    Adds a job, or returns the unfinished job for the same report.
+    """
+    job = PdfJob.objects.filter(kind=kind, incident=incident, status__in=[PdfJob.PENDING, PdfJob.RUNNING]).first()
+    if job is None:
+        job = PdfJob.objects.create(kind=kind, incident=incident, created_by=user)
+    return job
+
+
+def enqueue_pack(kind, pack_format, filters: str, total, user) -> PdfJob:
+    """
+    Adds a job for a pack of reports of the incidents matching the RI register `filters`.
+    """
+    job = PdfJob.objects.filter(kind=kind, incident=None, pack=pack_format, filters=filters, status__in=[PdfJob.PENDING, PdfJob.RUNNING]).first()
+    if job is None:
+        job = PdfJob.objects.create(kind=kind, pack=pack_format, filters=filters, total=total, created_by=user)
+    return job
+
+
+def claim_next() -> Optional[PdfJob]:
+    """
+    Marks the oldest claimable job as running and returns it, or returns None if there is none.
+    """
+    stale = Q(status=PdfJob.RUNNING, time_started__lt=now() - STALE_TIMEOUT)
+    for job in PdfJob.objects.filter(Q(status=PdfJob.PENDING) | stale).order_by("time_created")[:10]:
+        time_started = now()
+        # only one worker's update matches the status it read
+        if PdfJob.objects.filter(pk=job.pk, status=job.status, time_started=job.time_started).update(status=PdfJob.RUNNING, time_started=time_started):
+            job.status = PdfJob.RUNNING
+            job.time_started = time_started
+            return job
+    return None
+
+
+class JobLost(Exception):
+    """
+    The job was claimed by another worker, as this one did not update it within STALE_TIMEOUT.
+    """
+
+
+def _update_claimed(job: PdfJob, **values):
+    """
+    Updates the job if this worker still owns it, i.e. its start time is the one set when it was claimed.
+    """
+    if not PdfJob.objects.filter(pk=job.pk, status=PdfJob.RUNNING, time_started=job.time_started).update(**values):
+        raise JobLost(f"PDF job {job.pk} was claimed by another worker.")
+
+
+def _heartbeat(job: PdfJob, **values):
+    # a running job is claimable again when its start time is older than STALE_TIMEOUT, so it is moved on
+    time_started = now()
+    _update_claimed(job, time_started=time_started, **values)
+    job.time_started = time_started
+
+
+def _run_pack(job: PdfJob):
+    incidents = pack_incidents(job.kind, job.filters)
+    job.total = incidents.count()
+    job.progress = 0
+    _heartbeat(job, total=job.total, progress=0)
+
+    def progress(count):
+        _heartbeat(job, progress=count)
+
+    with tempfile.TemporaryFile() as fp:
+        write_pack(fp, job.kind, job.pack, incidents, progress)
+        fp.seek(0)
+        job.file.save(f"{job.pk}.{job.pack}", File(fp), save=False)
+    job.file_name = pack_file_name(job.kind, job.pack)
+    job.progress = job.total
+
+
+def run_job(job: PdfJob):
+    try:
+        if job.pack:
+            _run_pack(job)
+        else:
+            markup, file_name = build_report(job.kind, job.incident_id)
+            with render_pdf(markup) as fp:
+                job.file.save(f"{job.pk}.pdf", File(fp), save=False)
+            job.file_name = file_name
+        job.status = PdfJob.DONE
+    except JobLost:
+        logger.warning("PDF job %s was claimed by another worker, stopped", job.pk)
+        return
+    except Exception as e:
+        logger.exception("PDF job %s failed", job.pk)
+        job.status = PdfJob.FAILED
+        job.error = str(e)
+    job.time_finished = now()
+
+    # the result of a worker that lost the job is discarded, the other worker saves its own
+    try:
+        _update_claimed(
+            job, file=job.file.name, file_name=job.file_name, status=job.status, error=job.error, progress=job.progress, time_finished=job.time_finished
+        )
+    except JobLost:
+        logger.warning("PDF job %s was claimed by another worker, result discarded", job.pk)
+        if job.file:
+            job.file.delete(save=False)
+
+
+def delete_old_jobs(current_time=None) -> int:
+    jobs = PdfJob.objects.filter(status__in=[PdfJob.DONE, PdfJob.FAILED], time_finished__lt=(current_time or now()) - RETENTION)
+    count = 0
+    for job in jobs:
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        count += 1
+    return count
+
+
+def run_pending() -> int:
+    """
+    Runs jobs until none are left, returns the number of jobs run.
+    """
+    count = 0
+    while (job := claim_next()) is not None:
+        run_job(job)
+        count += 1
+    return count
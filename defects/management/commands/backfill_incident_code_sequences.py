@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from defects.models import Incident, IncidentCodeSequence
+
+
+class Command(BaseCommand):
+    help = "Sets the incident code sequences to the highest number used by existing incident codes."
+
+    def handle(self, *args, **options):
+        highest = {}
+        skipped = 0
+        for code in Incident.objects.values_list("code", flat=True).iterator(chunk_size=5000):
+            parsed = IncidentCodeSequence.parse_code(code)
+            if parsed is None:
+                skipped += 1
+                continue
+            key, value = parsed[:3], parsed[3]
+            highest[key] = max(value, highest.get(key, 0))
+
+        with transaction.atomic():
+            for (area_code, incident_type, year), value in highest.items():
+                sequence, created = IncidentCodeSequence.objects.select_for_update().get_or_create(
+                    area_code=area_code, incident_type=incident_type, year=year, defaults={"last_value": value}
+                )
+                if not created and sequence.last_value < value:
+                    sequence.last_value = value
+                    sequence.save(update_fields=["last_value"])
+
+        self.stdout.write(f"Updated {len(highest)} sequences, skipped {skipped} codes not in the <area>_<type>_<year>_<number> format.")
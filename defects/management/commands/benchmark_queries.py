@@ -0,0 +1,184 @@
+"""
+Times the hot queries of the application and prints their query plans, e.g. to compare
+before and after a schema change:
+
+> python manage.py benchmark_queries --seed 200000 --scratch
+> python manage.py benchmark_queries --drop-indexes --scratch
+
+The second run drops the indexes of migration 0057 (the hot-path indexes) first, without
+unapplying it, so later migrations stay in place. Seeding writes synthetic incidents, users
+and taxonomy into the configured database and there is no command to remove them, so both
+are only allowed with DEBUG and `--scratch`, i.e. against a copy of the database that can
+be thrown away.
+"""
+
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F
+from django.utils.timezone import now
+
+from defects.actions import reliability_engineer_actions, section_engineer_actions, pending_approval_condition
+from defects.models import Incident, Approval, Solution, Area, Section, Operation
+from defects.pagination import KeysetPaginator
+from defects.rollups import rebuild_rollup
+from defects.search import rebuild_index
+
+
+def _seed(count, stdout, batch_size=5000):
+    operation, _ = Operation.objects.get_or_create(name="Benchmark")
+    areas = [Area.objects.get_or_create(name=f"Benchmark {ix}", defaults={"operation": operation})[0] for ix in range(5)]
+    sections = [Section.objects.get_or_create(name=f"Benchmark {ix}", defaults={"area": areas[ix % 5]})[0] for ix in range(50)]
+    users = [User.objects.get_or_create(username=f"benchmark_{ix}")[0] for ix in range(20)]
+
+    start = Incident.objects.count()
+    current_time = now()
+    statuses = [Incident.ACTIVE, Incident.OVERDUE, Incident.SCHEDULED, Incident.COMPLETE]
+
+    for offset in range(0, count, batch_size):
+        incidents = []
+        for ix in range(start + offset, start + min(offset + batch_size, count)):
+            time_start = current_time - timedelta(minutes=random.randint(0, 5 * 365 * 24 * 60))
+            section = random.choice(sections)
+            published = random.random() < 0.8
+            incidents.append(
+                Incident(
+                    code=f"BENCH_RI_{ix}",
+                    created_by=random.choice(users),
+                    section_engineer=random.choice(users),
+                    operation=operation,
+                    area_id=section.area_id,
+                    section=section,
+                    status=random.choice(statuses),
+                    time_start=time_start,
+                    time_end=time_start + timedelta(hours=random.randint(1, 40)),
+                    notification_time_published=time_start + timedelta(hours=30) if published else None,
+                    time_anniversary_reviewed=time_start + timedelta(days=366) if time_start < current_time - timedelta(days=400) else None,
+                    rand_value_loss=random.randint(1000, 1_000_000),
+                )
+            )
+
+        with transaction.atomic():
+            incidents = Incident.objects.bulk_create(incidents)
+            approvals = []
+            solutions = []
+            for incident in incidents:
+                if incident.notification_time_published:
+                    approvals.append(
+                        Approval(
+                            incident=incident,
+                            user=random.choice(users),
+                            role=Approval.SECTION_ENGINEERING_MANAGER,
+                            type=Approval.NOTIFICATION,
+                            outcome=random.choice([Approval.ACCEPTED, Approval.ACCEPTED, Approval.REJECTED, ""]),
+                        )
+                    )
+                for _ in range(random.randint(0, 2)):
+                    solutions.append(
+                        Solution(
+                            incident=incident,
+                            description="Benchmark solution",
+                            planned_completion_date=(incident.time_start + timedelta(days=random.randint(30, 365))).date(),
+                        )
+                    )
+            Approval.objects.bulk_create(approvals)
+            Solution.objects.bulk_create(solutions)
+
+        stdout.write(f"Created {start + min(offset + batch_size, count)} incidents.")
+
+    # bulk_create skips the signals and `Incident.save`, which maintain these
+    stdout.write("Rebuilding the incident rollup and the search index.")
+    rebuild_rollup()
+    rebuild_index()
+
+
+def _drop_hot_path_indexes(stdout):
+    migration = MigrationLoader(connection).get_migration("defects", "0057_hot_path_indexes")
+    with connection.schema_editor() as schema_editor:
+        for operation in migration.operations:
+            schema_editor.remove_index(apps.get_model("defects", operation.model_name), operation.index)
+            stdout.write(f"Dropped {operation.index.name}.")
+
+
+def _queries():
+    """
+    Returns {name: (queryset to explain or None, function running the query)}.
+    """
+    user = User.objects.filter(username__startswith="benchmark_").first() or User.objects.first()
+    section = Section.objects.filter(incidents__isnull=False).first()
+    current_time = now()
+
+    def register(queryset):
+        ordered = queryset.order_by(F("time_start").desc(nulls_last=True), F("pk").desc())[:101]
+        return ordered, lambda: KeysetPaginator(queryset, field="time_start", per_page=100).page(None).items
+
+    def select(queryset):
+        return queryset, lambda: list(queryset.all())
+
+    return {
+        "register first page": register(Incident.objects.all()),
+        "register by status": register(Incident.objects.filter(status=Incident.OVERDUE)),
+        "register by section": register(Incident.objects.filter(section=section)),
+        "overdue anniversaries": select(
+            Incident.objects.filter(time_start__lt=current_time - timedelta(days=365), time_anniversary_reviewed=None).order_by("time_start")
+        ),
+        "pending approvals of user": select(Approval.objects.filter(pending_approval_condition(), user=user)),
+        "solutions due for verification": select(
+            Solution.objects.filter(planned_completion_date__lte=current_time.date(), date_verified__isnull=True)[:100]
+        ),
+        "reliability engineer actions": (None, lambda: reliability_engineer_actions(user.id)),
+        "section engineer actions": (None, lambda: section_engineer_actions(user.id)),
+    }
+
+
+class Command(BaseCommand):
+    help = "Times the hot queries and prints their query plans."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Create SEED synthetic incidents (with users, areas and sections) first. They are never deleted, "
+            "so this requires DEBUG and --scratch.",
+        )
+        parser.add_argument(
+            "--drop-indexes",
+            action="store_true",
+            help="Drop the hot-path indexes of migration 0057 first, to time the queries without them. This requires DEBUG and --scratch.",
+        )
+        parser.add_argument("--scratch", action="store_true", help="Confirm that the configured database is a scratch copy that may be filled with synthetic data.")
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--explain", action="store_true", help="Print query plans.")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            if not settings.DEBUG or not options["scratch"]:
+                raise CommandError("Seeding writes synthetic data that is never deleted, it requires DEBUG and --scratch (a database that can be thrown away).")
+            _seed(options["seed"], self.stdout)
+        if options["drop_indexes"]:
+            if not settings.DEBUG or not options["scratch"]:
+                raise CommandError("Dropping indexes leaves the database without them, it requires DEBUG and --scratch (a database that can be thrown away).")
+            _drop_hot_path_indexes(self.stdout)
+
+        self.stdout.write(f"{Incident.objects.count()} incidents, {Approval.objects.count()} approvals, {Solution.objects.count()} solutions")
+
+        for name, (queryset, run) in _queries().items():
+            run()  # warm up
+            timings = []
+            for _ in range(options["repeat"]):
+                t0 = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - t0) * 1000)
+            self.stdout.write(f"{name:<35} median {statistics.median(timings):8.2f} ms   max {max(timings):8.2f} ms")
+            if options["explain"] and queryset is not None:
+                for line in queryset.explain().splitlines():
+                    self.stdout.write(f"    {line}")
@@ -0,0 +1,34 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from defects.analytics import DATASETS, FORMATS, write_dataset
+
+
+class Command(BaseCommand):
+    help = "Writes the incident, solution and approval history as Parquet or Arrow files for analysis."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir")
+        parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+        parser.add_argument("--dataset", choices=sorted(DATASETS), action="append", help="Defaults to all datasets.")
+
+    def handle(self, *args, **options):
+        os.makedirs(options["output_dir"], exist_ok=True)
+        extension, _ = FORMATS[options["format"]]
+
+        for name in options["dataset"] or DATASETS:
+            path = os.path.join(options["output_dir"], f"{name}.{extension}")
+            # written next to the target and renamed, so readers never see a partial file
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "wb") as fp:
+                    count = write_dataset(fp, name, options["format"])
+                os.replace(tmp_path, path)
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.stdout.write(f"Wrote {count} rows to {path}.")
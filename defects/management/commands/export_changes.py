@@ -0,0 +1,47 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from defects.changes import FEEDS, Watermark, changes
+
+
+class Command(BaseCommand):
+    help = "Writes the incidents or solutions changed since a watermark as JSON lines, and the watermark for the next run."
+
+    def add_arguments(self, parser):
+        parser.add_argument("feed", choices=sorted(FEEDS))
+        parser.add_argument("output", help="JSON lines file, one change per line.")
+        parser.add_argument("--since", help="Watermark of the previous run, all rows are written without it.")
+        parser.add_argument("--state-file", help="Reads the watermark from and stores the next watermark in this file.")
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if since is None and options["state_file"] and os.path.exists(options["state_file"]):
+            with open(options["state_file"]) as fp:
+                since = fp.read().strip() or None
+        try:
+            watermark = Watermark.parse(since) if since else None
+        except ValueError:
+            raise CommandError(f"Invalid watermark: {since}")
+
+        upserts = deletes = 0
+        with open(options["output"], "w") as fp:
+            while True:
+                page = changes(options["feed"], watermark)
+                for row in page.rows:
+                    fp.write(json.dumps({"op": "upsert", "row": row}, cls=DjangoJSONEncoder) + "\n")
+                for pk in page.deleted:
+                    fp.write(json.dumps({"op": "delete", "id": pk}) + "\n")
+                upserts += len(page.rows)
+                deletes += len(page.deleted)
+                watermark = page.watermark
+                if not page.has_more:
+                    break
+
+        # only stored once all changes are written, so a failed run is repeated in full
+        if options["state_file"]:
+            with open(options["state_file"], "w") as fp:
+                fp.write(str(watermark))
+        self.stdout.write(f"Wrote {upserts} changed and {deletes} deleted rows. Next watermark: {watermark}")
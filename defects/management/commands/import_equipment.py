@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from defects.equipment_import import BATCH_SIZE, import_equipment, read_rows
+
+
+class Command(BaseCommand):
+    help = "Creates and renames equipment from a CSV extract of SAP functional locations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header row, e.g. 'Functional Location,Description'.")
+        parser.add_argument("--encoding", default="utf-8-sig")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="Only report the changes.")
+
+    def handle(self, *args, **options):
+        with open(options["path"], newline="", encoding=options["encoding"]) as fp:
+            try:
+                result = import_equipment(read_rows(fp), batch_size=options["batch_size"], dry_run=options["dry_run"])
+            except ValueError as e:
+                raise CommandError(str(e))
+        self.stdout.write(f"{'Dry run: ' if options['dry_run'] else ''}{result}")
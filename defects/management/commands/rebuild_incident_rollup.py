@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from defects.rollups import rebuild_rollup
+
+
+class Command(BaseCommand):
+    help = "Recalculates the incident rollup table used by the dashboards."
+
+    def handle(self, *args, **options):
+        count = rebuild_rollup()
+        self.stdout.write(f"Created {count} rollup rows.")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from defects.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the incident full-text search index."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(f"Indexed {count} incidents.")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from defects.statuses import refresh_statuses, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Recalculates the status of incidents whose deadlines passed since the previous run."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recalculate the status of all incidents.")
+        parser.add_argument("--interval", type=int, default=0, help="Keep running, every INTERVAL seconds.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        full = options["full"]
+        while True:
+            checked, changed = refresh_statuses(full=full, batch_size=options["batch_size"])
+            self.stdout.write(f"Checked {checked} incidents, updated {changed}.")
+
+            if not options["interval"]:
+                break
+            full = False
+            close_old_connections()
+            time.sleep(options["interval"])
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from defects.jobs import delete_old_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = "Renders the queued PDF reports."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, default=0, help="Keep running, checking for jobs every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending()
+            deleted = delete_old_jobs()
+            if count or deleted or not options["interval"]:
+                self.stdout.write(f"Rendered {count} PDFs, deleted {deleted} old jobs.")
+
+            if not options["interval"]:
+                break
+            close_old_connections()
+            time.sleep(options["interval"])
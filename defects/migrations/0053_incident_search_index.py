@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:00
+
+import django.db.models.deletion
+from django.db import migrations, models, OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    try:
+        schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS defects_incident_fts USING fts5(code, body)")
+    except OperationalError:
+        # SQLite was compiled without FTS5, the portable term table is used instead
+        pass
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS defects_incident_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0052_area_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=100)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('incident', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='defects.incident')),
+            ],
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:05
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0054_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('incident_count', models.PositiveIntegerField(default=0)),
+                ('active_count', models.PositiveIntegerField(default=0)),
+                ('rand_value_loss', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('repair_cost', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('production_value_loss', models.DecimalField(decimal_places=4, default=Decimal('0.00'), max_digits=20)),
+                ('reviewed_count', models.PositiveIntegerField(default=0, help_text='Incidents with a completed anniversary review')),
+                ('success_count', models.PositiveIntegerField(default=0, help_text='Reviewed incidents where the root cause was resolved')),
+                ('success_rand_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('failure_rand_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('last_time_end', models.DateTimeField(null=True)),
+                ('area', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='defects.area')),
+                ('operation', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='defects.operation')),
+                ('section', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='defects.section')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'section'], name='defects_inc_date_f44f51_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0055_incidentrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('time_last_run', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='incident',
+            name='notification_time_published',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='incident',
+            name='time_end',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
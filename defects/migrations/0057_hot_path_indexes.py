@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0056_incident_status_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='approval',
+            index=models.Index(fields=['user', 'type', 'outcome', 'score'], name='approval_user_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='approval',
+            index=models.Index(fields=['incident', 'type', 'role'], name='approval_incident_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['-time_start', '-id'], name='incident_register_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['status', 'time_start'], name='incident_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['operation', 'time_start'], name='incident_operation_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['area', 'time_start'], name='incident_area_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['section', 'time_start'], name='incident_section_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(condition=models.Q(('time_anniversary_reviewed__isnull', True)), fields=['time_start'], name='incident_open_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(condition=models.Q(('time_anniversary_reviewed__isnull', True)), fields=['created_by'], name='incident_open_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(condition=models.Q(('time_anniversary_reviewed__isnull', True)), fields=['section_engineer'], name='incident_open_engineer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='solution',
+            index=models.Index(fields=['incident', 'status'], name='solution_incident_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='solution',
+            index=models.Index(fields=['planned_completion_date'], name='solution_planned_date_idx'),
+        ),
+    ]
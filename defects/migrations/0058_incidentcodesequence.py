@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0057_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncidentCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('area_code', models.CharField(max_length=200)),
+                ('incident_type', models.CharField(max_length=20)),
+                ('year', models.PositiveIntegerField()),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('area_code', 'incident_type', 'year'), name='incident_code_sequence_unique')],
+            },
+        ),
+    ]
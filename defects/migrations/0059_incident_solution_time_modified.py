@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0058_incidentcodesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incident',
+            name='time_modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='solution',
+            name='time_modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
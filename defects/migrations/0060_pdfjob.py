@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0059_incident_solution_time_modified'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('notification', '48H Notification'), ('close_out', 'Close-Out Slide'), ('anniversary', 'Anniversary Review')], max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('time_created', models.DateTimeField(auto_now_add=True)),
+                ('time_started', models.DateTimeField(blank=True, null=True)),
+                ('time_finished', models.DateTimeField(blank=True, null=True)),
+                ('file', models.FileField(blank=True, upload_to='pdf-jobs/')),
+                ('file_name', models.CharField(blank=True, help_text='Name of the file when downloaded.', max_length=500)),
+                ('error', models.TextField(blank=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('incident', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='defects.incident')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'time_created'], name='pdfjob_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0060_pdfjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfjob',
+            name='filters',
+            field=models.TextField(blank=True, help_text='RI register filters (query string) of the incidents in the pack.'),
+        ),
+        migrations.AddField(
+            model_name='pdfjob',
+            name='pack',
+            field=models.CharField(blank=True, choices=[('zip', 'ZIP of PDFs'), ('pdf', 'Merged PDF')], help_text='Format of the reports of many incidents, see `defects.packs`.', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='pdfjob',
+            name='progress',
+            field=models.PositiveIntegerField(default=0, help_text='Reports rendered.'),
+        ),
+        migrations.AddField(
+            model_name='pdfjob',
+            name='total',
+            field=models.PositiveIntegerField(default=0, help_text='Reports to render.'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 04:51
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def delete_duplicate_rows(apps, schema_editor):
+    # concurrent refreshes could insert a key twice; every row holds the full aggregates, the newest is kept
+    IncidentRollup = apps.get_model("defects", "IncidentRollup")
+    keys = ("date", "operation_id", "area_id", "section_id")
+    duplicates = IncidentRollup.objects.values(*keys).annotate(count=Count("id"), last_id=Max("id")).filter(count__gt=1).order_by()
+    for row in duplicates:
+        IncidentRollup.objects.filter(**{k: row[k] for k in keys}).exclude(id=row["last_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0061_pdfjob_pack'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='incidentrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'operation', 'area', 'section'), name='incident_rollup_key_unique'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def set_keys(apps, schema_editor):
+    # keys with a NULL dimension could still be inserted twice; every row holds the full aggregates, the newest is kept
+    IncidentRollup = apps.get_model("defects", "IncidentRollup")
+    seen = set()
+    for rollup in IncidentRollup.objects.order_by("-id").iterator():
+        key = "/".join("" if x is None else str(x) for x in (rollup.date, rollup.operation_id, rollup.area_id, rollup.section_id))
+        if key in seen:
+            rollup.delete()
+        else:
+            seen.add(key)
+            rollup.key = key
+            rollup.save(update_fields=["key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defects', '0062_incidentrollup_key_unique'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='incidentrollup',
+            name='incident_rollup_key_unique',
+        ),
+        migrations.AddField(
+            model_name='incidentrollup',
+            name='key',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(set_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='incidentrollup',
+            name='key',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from decimal import Decimal
 from typing import Optional
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.utils.timezone import now
 from datetime import timedelta, datetime, time, timezone
@@ -93,10 +93,14 @@ class Incident(models.Model):
         (SHIFT_LOSS, "Loss of Full Production shift or Evacuation of shift"),
     )
 
+    # the status becomes overdue when these deadlines pass, see `defects.statuses`
+    NOTIFICATION_DEADLINE = timedelta(hours=48)  # after time_end
+    RCA_REPORT_DEADLINE = timedelta(days=14)  # after notification_time_published
 
 
     code = models.CharField(unique=True, max_length=200)  # also known as RI_Number
     time_created = models.DateTimeField(auto_now_add=True)
+    time_modified = models.DateTimeField(auto_now=True, db_index=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     status = models.CharField(max_length=100, choices=STATUS_CHOICES, default=ACTIVE)
     operation = models.ForeignKey(Operation, null=True, blank=True, on_delete=models.SET_NULL, related_name="incidents")
@@ -104,13 +108,13 @@ class Incident(models.Model):
     section = models.ForeignKey(Section, blank=True, null=True, on_delete=models.SET_NULL, related_name="incidents")
     section_engineer = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL, related_name="+")
     time_start = models.DateTimeField(blank=True, null=True)
-    time_end = models.DateTimeField(blank=True, null=True)
+    time_end = models.DateTimeField(blank=True, null=True, db_index=True)
     significant = models.BooleanField(default=True)
     equipment = models.ForeignKey(Equipment, on_delete=models.SET_NULL, null=True, blank=True, related_name="incidents")
     short_description = models.CharField(max_length=200, blank=True)
     long_description = models.TextField(blank=True)
     preliminary_findings = models.FileField(upload_to="files/", blank=True)
-    notification_time_published = models.DateTimeField(blank=True, null=True)
+    notification_time_published = models.DateTimeField(blank=True, null=True, db_index=True)
     notification_time_approved = models.DateTimeField(blank=True, null=True)
     close_out_file = models.FileField(blank=True)
     report_file = models.FileField(blank=True, upload_to="files/")  # RCA report
@@ -145,25 +149,38 @@ class Incident(models.Model):
         verbose_name = "Incident"
         verbose_name_plural = "Incidents"
         permissions = (("request_notification_approval", "Can request approval of incident notification"),)
+        indexes = [
+            # RI register (keyset pagination by time_start) and its filters
+            models.Index(fields=["-time_start", "-id"], name="incident_register_idx"),
+            models.Index(fields=["status", "time_start"], name="incident_status_idx"),
+            # register filters and rollup refreshes, by dimension and time_start
+            models.Index(fields=["operation", "time_start"], name="incident_operation_time_idx"),
+            models.Index(fields=["area", "time_start"], name="incident_area_time_idx"),
+            models.Index(fields=["section", "time_start"], name="incident_section_time_idx"),
+            # open incidents: anniversaries and user actions
+            models.Index(fields=["time_start"], condition=models.Q(time_anniversary_reviewed__isnull=True), name="incident_open_time_idx"),
+            models.Index(fields=["created_by"], condition=models.Q(time_anniversary_reviewed__isnull=True), name="incident_open_creator_idx"),
+            models.Index(fields=["section_engineer"], condition=models.Q(time_anniversary_reviewed__isnull=True), name="incident_open_engineer_idx"),
+        ]
 
     def __str__(self):
         return self.code
 
-    def calculate_status(self):
+    def calculate_status(self, current_time=None):
+        current_time = current_time or now()
 
         if self.time_anniversary_reviewed:
             return self.COMPLETE
 
         if not self.notification_time_published:
+            if self.time_end and (self.time_end + self.NOTIFICATION_DEADLINE) < current_time:
+                return self.OVERDUE
             return self.ACTIVE
 
-        if not self.notification_time_published and (self.time_end + timedelta(hours=48)) < now():
-            return self.OVERDUE
-
-        if self.significant and not self.rca_report_time_published and (self.notification_time_published + timedelta(days=14)) > now():
+        if self.significant and not self.rca_report_time_published and (self.notification_time_published + self.RCA_REPORT_DEADLINE) < current_time:
             return self.OVERDUE
 
-        solutions = list(self.solutions.all())
+        solutions = list(self.solutions.all()) if self.pk else []
         if len(solutions) > 0:
             if all([x.status == Solution.COMPLETED for x in solutions]):
                 return self.COMPLETE
@@ -172,14 +189,18 @@ class Incident(models.Model):
         return self.ACTIVE
 
     def save(self, *args, **kwargs):
+        from defects.search import index_incident
+
         self.status = self.calculate_status()
         super().save(*args, **kwargs)
+        index_incident(self)
 
     @classmethod
     def generate_incident_code(cls, code, incident_type="RI", count=None):
-        prefix = f"{code}_{incident_type}_{now().strftime("%Y")}"
+        year = int(now().strftime("%Y"))
+        prefix = f"{code}_{incident_type}_{year}"
         if count is None:
-            count = 1 + Incident.objects.filter(code__startswith=prefix).count()
+            count = IncidentCodeSequence.allocate(code, incident_type, year)
         return f"{prefix}_{count}"
 
     @property
@@ -234,7 +255,7 @@ class Incident(models.Model):
 
     @property
     def status_computed(self):
-        # todo: use a periodic background task of sorts to store the result of this property in the db column
+        # the status column is stored by `calculate_status` and kept current by `python manage.py refresh_incident_status`
 
         if any([self.notification_overdue, self.report_overdue, self.has_overdue_solutions]):
             return Incident.OVERDUE
@@ -247,10 +268,11 @@ class Incident(models.Model):
 
         return Incident.ACTIVE
 
-    @property
+    @cached_property
     def timeline(self):
         """
-        select_related: created_by
+        select_related: created_by, anniversary_reviewed_by
+        prefetch_related: approvals, solutions
         """
         entries = [
             TimelineEntry(
@@ -283,7 +305,7 @@ class Incident(models.Model):
                     ],
                 )
             )
-            for approval in self.approvals.filter(type=Approval.NOTIFICATION).order_by("time_created"):
+            for approval in self.approvals_of_type(Approval.NOTIFICATION):
                 if approval.outcome == "":
                     entries.append(
                         TimelineEntry(
@@ -329,7 +351,7 @@ class Incident(models.Model):
                     ],
                 )
             )
-            for approval in self.approvals.filter(type=Approval.RCA).order_by("time_created"):
+            for approval in self.approvals_of_type(Approval.RCA):
                 if approval.outcome == "":
                     entries.append(
                         TimelineEntry(
@@ -377,7 +399,7 @@ class Incident(models.Model):
                 )
             )
 
-            for approval in self.approvals.filter(type=Approval.CLOSE_OUT).order_by("time_created"):
+            for approval in self.approvals_of_type(Approval.CLOSE_OUT):
                 if approval.score == 0:
                     entries.append(
                         TimelineEntry(
@@ -442,8 +464,23 @@ class Incident(models.Model):
 
         return sorted(entries, key=lambda x: x.time)
 
+    @cached_property
+    def approval_history(self):
+        """
+        All approvals in the order they were requested. Uses the prefetched `approvals` when
+        available, so the workflow properties below cost at most one query together.
+        """
+        return sorted(self.approvals.all(), key=lambda x: (x.time_created, x.pk))
+
+    def approvals_of_type(self, approval_type, role=None, outcome=None):
+        return [
+            x
+            for x in self.approval_history
+            if x.type == approval_type and (role is None or x.role == role) and (outcome is None or x.outcome == outcome)
+        ]
+
     def has_pending_approval(self, approval_type, role=None):
-        for approval in self.approvals.all():
+        for approval in self.approval_history:
             if role is not None and approval.role != role:
                 continue
             if approval.type == approval_type:
@@ -469,19 +506,19 @@ class Incident(models.Model):
 
     @cached_property
     def notification_approved(self):
-        return self.approvals.filter(type=Approval.NOTIFICATION, outcome=Approval.ACCEPTED).exists()
+        return len(self.approvals_of_type(Approval.NOTIFICATION, outcome=Approval.ACCEPTED)) > 0
 
     @cached_property
     def notification_rejected(self):
         return (
             self.notification_time_published is not None
-            and self.approvals.filter(type=Approval.NOTIFICATION).exclude(outcome="").count() > 0
+            and len([x for x in self.approvals_of_type(Approval.NOTIFICATION) if x.outcome != ""]) > 0
             and not self.notification_approved
         )
 
     def most_recent_approval_outcome_for_role(self, approval_type, role):
 
-        approvals = sorted([x for x in self.approvals.all() if x.type == approval_type and x.role == role], key=lambda x: x.time_modified, reverse=True)
+        approvals = sorted(self.approvals_of_type(approval_type, role=role), key=lambda x: x.time_modified, reverse=True)
         if len(approvals) == 0:
             return None
         return approvals[0].outcome
@@ -510,7 +547,7 @@ class Incident(models.Model):
 
         return (
             self.rca_report_time_published
-            and self.approvals.filter(type=Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER, outcome=Approval.ACCEPTED).count() > 0
+            and len(self.approvals_of_type(Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER, outcome=Approval.ACCEPTED)) > 0
         )
 
 
@@ -518,7 +555,7 @@ class Incident(models.Model):
     def close_out_rejected(self):
         return (
             self.close_out_time_published
-            and self.approvals.filter(type=Approval.CLOSE_OUT).exclude(score=0).count() > 1
+            and len([x for x in self.approvals_of_type(Approval.CLOSE_OUT) if x.score != 0]) > 1
             and not self.close_out_time_approved
         )
 
@@ -554,8 +591,12 @@ class Incident(models.Model):
     def anniversary_date(self):
         return self.time_end + timedelta(days=365)
 
-    @property
+    @cached_property
     def actions(self):
+        """
+        select_related: created_by
+        prefetch_related: approvals
+        """
         actions = []
 
         # no more actions once a anniversary review has been completed
@@ -637,8 +678,8 @@ class Incident(models.Model):
             )
 
         if (self.rca_report_time_published
-            and Approval.objects.filter(incident=self, type=Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER, outcome=Approval.ACCEPTED).exists()
-            and not Approval.objects.filter(incident=self, type=Approval.RCA, role=Approval.SECTION_ENGINEERING_MANAGER).exists()
+            and self.approvals_of_type(Approval.RCA, role=Approval.SENIOR_ASSET_MANAGER, outcome=Approval.ACCEPTED)
+            and not self.approvals_of_type(Approval.RCA, role=Approval.SECTION_ENGINEERING_MANAGER)
             and not self.rca_report_time_approved):
             # RCA has been approved by SAM but not yet by SEM
             actions.append(
@@ -755,6 +796,16 @@ class IncidentImage(models.Model):
     description = models.TextField(blank=True)
 
 
+class IncidentSearchTerm(models.Model):
+    """
+    Portable search index used on databases without a native full-text index, see `defects.search`.
+    """
+
+    incident = models.ForeignKey(Incident, on_delete=models.CASCADE, related_name="+")
+    term = models.CharField(max_length=100, db_index=True)
+    weight = models.PositiveIntegerField(default=1)
+
+
 class Solution(models.Model):
     SHORT_TERM = "short_term"
     MEDIUM_TERM = "medium_term"
@@ -781,6 +832,7 @@ class Solution(models.Model):
     )
 
     time_created = models.DateTimeField(auto_now_add=True)
+    time_modified = models.DateTimeField(auto_now=True, db_index=True)
     created_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
     incident = models.ForeignKey(Incident, on_delete=models.CASCADE, null=True, blank=True, related_name="solutions")
     priority = models.CharField(max_length=200, blank=True, choices=PRIORITY_CHOICES, default="A")
@@ -795,6 +847,12 @@ class Solution(models.Model):
     date_verified = models.DateField(blank=True, null=True)
     verification_comment = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["incident", "status"], name="solution_incident_status_idx"),
+            models.Index(fields=["planned_completion_date"], name="solution_planned_date_idx"),
+        ]
+
     @property
     def status_class(self):
         _map = {self.SCHEDULED: "primary", self.COMPLETED: "success"}
@@ -848,6 +906,14 @@ class Approval(models.Model):
     comment = models.TextField(blank=True)
     score = models.PositiveIntegerField(default=0, blank=True)  # only approvals of type CLOSE_OUT will have a score (1-5 inclusive).
 
+    class Meta:
+        indexes = [
+            # pending approvals of a user
+            models.Index(fields=["user", "type", "outcome", "score"], name="approval_user_pending_idx"),
+            # approval state of an incident
+            models.Index(fields=["incident", "type", "role"], name="approval_incident_type_idx"),
+        ]
+
 
 auditlog.register(
     Incident,
@@ -877,6 +943,171 @@ class Feedback(models.Model):
     dismissed = models.BooleanField(default=False)
 
 
+class IncidentRollup(models.Model):
+    """
+    Incident aggregates per local date (of `time_start`), operation, area and section,
+    maintained by `defects.rollups` for the dashboards.
+    """
+
+    # "<date>/<operation>/<area>/<section>" with empty ids for NULL: NULLs are distinct in unique
+    # constraints on SQLite and PostgreSQL, so the dimensions alone cannot keep one row per key
+    key = models.CharField(max_length=100, unique=True)
+    date = models.DateField()
+    operation = models.ForeignKey(Operation, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    area = models.ForeignKey(Area, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    section = models.ForeignKey(Section, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    incident_count = models.PositiveIntegerField(default=0)
+    active_count = models.PositiveIntegerField(default=0)
+    rand_value_loss = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal("0.00"))
+    repair_cost = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal("0.00"))
+    production_value_loss = models.DecimalField(max_digits=20, decimal_places=4, default=Decimal("0.00"))
+    reviewed_count = models.PositiveIntegerField(default=0, help_text="Incidents with a completed anniversary review")
+    success_count = models.PositiveIntegerField(default=0, help_text="Reviewed incidents where the root cause was resolved")
+    success_rand_value = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal("0.00"))
+    failure_rand_value = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal("0.00"))
+    last_time_end = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date", "section"]),
+        ]
+
+
+class IncidentCodeSequence(models.Model):
+    """
+    The last number allocated for incident codes `<area code>_<type>_<year>_<number>`.
+    """
+
+    area_code = models.CharField(max_length=200)
+    incident_type = models.CharField(max_length=20)
+    year = models.PositiveIntegerField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["area_code", "incident_type", "year"], name="incident_code_sequence_unique"),
+        ]
+
+    @staticmethod
+    def parse_code(code: str):
+        """
+        Returns (area code, type, year, number) of an incident code, or None if it does not follow the format.
+        """
+        parts = code.rsplit("_", 3)
+        if len(parts) != 4 or not parts[2].isdigit() or not parts[3].isdigit():
+            return None
+        return parts[0], parts[1], int(parts[2]), int(parts[3])
+
+    @classmethod
+    def highest_existing_value(cls, area_code, incident_type, year) -> int:
+        prefix = f"{area_code}_{incident_type}_{year}_"
+        values = [0]
+        for code in Incident.objects.filter(code__startswith=prefix).values_list("code", flat=True):
+            parsed = cls.parse_code(code)
+            if parsed and parsed[:3] == (area_code, incident_type, year):
+                values.append(parsed[3])
+        return max(values)
+
+    @classmethod
+    def allocate(cls, area_code, incident_type, year) -> int:
+        """
+        Returns the next number of the sequence. The UPDATE locks the row until the transaction
+        ends, so concurrent allocations (in any process) are serialised and never repeat a number.
+        """
+        sequence = cls.objects.filter(area_code=area_code, incident_type=incident_type, year=year)
+        with transaction.atomic():
+            if not sequence.update(last_value=models.F("last_value") + 1):
+                # first code of the sequence, continue after codes created before the sequence existed
+                try:
+                    with transaction.atomic():
+                        initial = cls.highest_existing_value(area_code, incident_type, year) + 1
+                        cls.objects.create(area_code=area_code, incident_type=incident_type, year=year, last_value=initial)
+                        return initial
+                except IntegrityError:
+                    # created concurrently
+                    sequence.update(last_value=models.F("last_value") + 1)
+            return sequence.values_list("last_value", flat=True).get()
+
+
+class CacheVersion(models.Model):
+    """
+    Version stamps for per-process caches, see `defects.versions`.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+
+class PdfJob(models.Model):
+    """
+    A report rendered in the background by the `run_pdf_worker` command, see `defects.jobs`.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    NOTIFICATION = "notification"
+    CLOSE_OUT = "close_out"
+    ANNIVERSARY = "anniversary"
+
+    KIND_CHOICES = (
+        (NOTIFICATION, "48H Notification"),
+        (CLOSE_OUT, "Close-Out Slide"),
+        (ANNIVERSARY, "Anniversary Review"),
+    )
+
+    ZIP = "zip"
+    PDF = "pdf"
+
+    PACK_CHOICES = (
+        (ZIP, "ZIP of PDFs"),
+        (PDF, "Merged PDF"),
+    )
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    incident = models.ForeignKey(Incident, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    pack = models.CharField(max_length=10, choices=PACK_CHOICES, blank=True, help_text="Format of the reports of many incidents, see `defects.packs`.")
+    filters = models.TextField(blank=True, help_text="RI register filters (query string) of the incidents in the pack.")
+    progress = models.PositiveIntegerField(default=0, help_text="Reports rendered.")
+    total = models.PositiveIntegerField(default=0, help_text="Reports to render.")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    time_created = models.DateTimeField(auto_now_add=True)
+    time_started = models.DateTimeField(null=True, blank=True)
+    time_finished = models.DateTimeField(null=True, blank=True)
+    file = models.FileField(upload_to="pdf-jobs/", blank=True)
+    file_name = models.CharField(max_length=500, blank=True, help_text="Name of the file when downloaded.")
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker picks the oldest pending job
+            models.Index(fields=["status", "time_created"], name="pdfjob_status_idx"),
+        ]
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class TaskRun(models.Model):
+    """
+    Watermark of a periodic task: the time up to which it has processed its work.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    time_last_run = models.DateTimeField()
+
+
 class ResourcePrice(models.Model):
     """
     Tracks the ZAR market price of one ounce of PGM.
@@ -887,6 +1118,24 @@ class ResourcePrice(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
     @classmethod
-    def rand_cost(cls, ounces: Decimal) -> Decimal:
-        most_recent = cls.objects.order_by("-time_created").first()
-        return (ounces * most_recent.rate).quantize(Decimal("1.00"))
+    def current(cls) -> Optional["ResourcePrice"]:
+        """
+        The most recent price, cached in memory (select_related: created_by).
+        """
+        from defects.prices import price_history
+
+        return price_history().current()
+
+    @classmethod
+    def at(cls, when: datetime) -> Optional["ResourcePrice"]:
+        """
+        The price in effect at `when`, cached in memory.
+        """
+        from defects.prices import price_history
+
+        return price_history().at(when)
+
+    @classmethod
+    def rand_cost(cls, ounces: Decimal, when: datetime = None) -> Decimal:
+        price = cls.current() if when is None else cls.at(when)
+        return (ounces * price.rate).quantize(Decimal("1.00"))
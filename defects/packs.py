@@ -0,0 +1,160 @@
+"""
+Packs of the reports of many incidents, e.g. the close-out slides of an area and date range
+for a monthly review, as a ZIP of PDFs or as one merged PDF.
+
+The incidents are selected with the RI register filters. Their reports are built one after
+the other, as that reads the database, and rendered in parallel by the renderer pool of the
+PDF worker (see `defects.renderer`), with at most two reports per process in flight so memory
+stays bounded. Without PDF_JOBS they are rendered one at a time in the request, so those
+packs are limited to SYNC_MAX_INCIDENTS incidents.
+Reports in the PDF cache are not rendered again, and rendered reports are added to it.
+"""
+
+import os
+import zipfile
+from collections import deque
+from io import BytesIO
+from typing import Callable, Iterable, Optional, Tuple
+
+from django.db.models import QuerySet
+from django.http import QueryDict
+
+from . import renderer
+from .filters import filter_incidents
+from .reports import REPORTS, cached_pdf, store_pdf
+
+MAX_INCIDENTS = 500
+# without PDF_JOBS, renders block a web worker for the whole request
+SYNC_MAX_INCIDENTS = 20
+
+CONTENT_TYPES = {
+    "zip": "application/zip",
+    "pdf": "application/pdf",
+}
+
+
+def pack_incidents(kind, filters: str) -> QuerySet:
+    """
+    The incidents in a pack of reports `kind`, from the RI register filters as a query string.
+    Incidents that do not have the report yet, e.g. are not closed out, are left out.
+    """
+    report = REPORTS[kind]
+    incidents = filter_incidents(report.queryset().filter(report.available), QueryDict(filters))
+    return incidents.order_by("time_start", "id")
+
+
+def pack_file_name(kind, pack_format) -> str:
+    return f"{kind.replace('_', '-')}-reports.{pack_format}"
+
+
+def _finish(file_name, markup, pdf, future) -> Tuple[str, bytes]:
+    if future is not None:
+        pdf = future.result()
+        store_pdf(markup, pdf).close()
+    return file_name, pdf
+
+
+def render_reports(kind, incidents: Iterable) -> Iterable[Tuple[str, bytes]]:
+    """
+    Yields (file name, PDF) of the reports `kind` of `incidents`, in order.
+    """
+    report = REPORTS[kind]
+    in_flight = deque()
+    for incident in incidents:
+        markup, file_name = report.build(incident)
+        fp = cached_pdf(markup)
+        if fp is None:
+            in_flight.append((file_name, markup, None, renderer.submit(markup)))
+        else:
+            with fp:
+                in_flight.append((file_name, markup, fp.read(), None))
+        if len(in_flight) >= 2 * max(renderer.processes(), 1):
+            yield _finish(*in_flight.popleft())
+    while in_flight:
+        yield _finish(*in_flight.popleft())
+
+
+def _archive_name(file_name, used):
+    # file names contain descriptions, which must not create folders or overwrite another report
+    name = file_name.replace("/", "-").replace("\\", "-")
+    stem, extension = os.path.splitext(name)
+    count = 1
+    while name in used:
+        count += 1
+        name = f"{stem} ({count}){extension}"
+    used.add(name)
+    return name
+
+
+def _write_zip(fp, reports):
+    # yields after each report; PDFs are compressed already, so they are stored as they are
+    used = set()
+    with zipfile.ZipFile(fp, "w", zipfile.ZIP_STORED) as archive:
+        for file_name, pdf in reports:
+            archive.writestr(_archive_name(file_name, used), pdf)
+            yield
+
+
+def write_zip(fp, reports, progress: Optional[Callable[[int], None]] = None):
+    for count, _ in enumerate(_write_zip(fp, reports), 1):
+        if progress:
+            progress(count)
+
+
+def write_merged_pdf(fp, reports, progress: Optional[Callable[[int], None]] = None):
+    """
+    Writes the pages of all reports to the seekable binary file `fp`, with a bookmark per report.
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for count, (file_name, pdf) in enumerate(reports, 1):
+        writer.append(BytesIO(pdf), outline_item=os.path.splitext(file_name)[0])
+        if progress:
+            progress(count)
+    writer.write(fp)
+
+
+WRITERS = {
+    "zip": write_zip,
+    "pdf": write_merged_pdf,
+}
+
+
+def write_pack(fp, kind, pack_format, incidents, progress: Optional[Callable[[int], None]] = None):
+    """
+    Writes the pack of reports `kind` of `incidents` to `fp`, calling `progress` with the number
+    of reports written after each report.
+    """
+    WRITERS[pack_format](fp, render_reports(kind, incidents), progress)
+
+
+class _Buffer:
+    """
+    Write-only file for a ZipFile, whose content is taken in chunks for a streaming response.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(kind, incidents) -> Iterable[bytes]:
+    """
+    Yields the ZIP of the reports `kind` of `incidents` while it is written, one report at a time.
+    """
+    buffer = _Buffer()
+    for _ in _write_zip(buffer, render_reports(kind, incidents)):
+        yield buffer.take()
+    yield buffer.take()
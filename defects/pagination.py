@@ -0,0 +1,142 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are addressed by the sort key of the first/last row that was shown rather than by
+an offset, so fetching a deep page costs the same as fetching the first one.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from django.db.models import F, Q
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+def encode_token(value, pk: int, direction: str) -> str:
+    """
+    `value` is the sort key of the row, either a datetime or a JSON serializable scalar.
+    """
+    if isinstance(value, datetime):
+        payload = {"v": value.isoformat(), "t": "dt", "pk": pk, "d": direction}
+    else:
+        payload = {"v": value, "pk": pk, "d": direction}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_token(token: str):
+    """
+    Returns a tuple of (value, pk, direction) or None if the token is invalid.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        value = payload["v"]
+        if payload.get("t") == "dt":
+            value = datetime.fromisoformat(value)
+        direction = payload["d"]
+        if direction not in (NEXT, PREVIOUS):
+            return None
+        return value, int(payload["pk"]), direction
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+def approximate_count(queryset, limit=1000):
+    """
+    Counts at most `limit` rows so the cost stays bounded on large tables.
+    Returns a tuple of (count, exact).
+    """
+    count = queryset.order_by()[: limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
+
+
+@dataclass
+class KeysetPage:
+    items: list = field(default_factory=list)
+    next_token: Optional[str] = None
+    previous_token: Optional[str] = None
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_token is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset in descending order of (`field`, pk).
+
+    `field` may be nullable; rows with a null value are sorted after all other rows.
+    """
+
+    def __init__(self, queryset, field="time_start", per_page=50):
+        self.queryset = queryset
+        self.field = field
+        self.per_page = per_page
+
+    def _after(self, value, pk):
+        # rows that come after the cursor in descending order
+        if value is None:
+            return Q(**{f"{self.field}__isnull": True, "pk__lt": pk})
+        return Q(**{f"{self.field}__lt": value}) | Q(**{self.field: value, "pk__lt": pk}) | Q(**{f"{self.field}__isnull": True})
+
+    def _before(self, value, pk):
+        # rows that come before the cursor in descending order
+        if value is None:
+            return Q(**{f"{self.field}__isnull": False}) | Q(**{f"{self.field}__isnull": True, "pk__gt": pk})
+        return Q(**{f"{self.field}__gt": value}) | Q(**{self.field: value, "pk__gt": pk})
+
+    def _token(self, obj, direction):
+        return encode_token(getattr(obj, self.field), obj.pk, direction)
+
+    def page(self, token=None) -> KeysetPage:
+        cursor = decode_token(token) if token else None
+
+        descending = [F(self.field).desc(nulls_last=True), F("pk").desc()]
+        ascending = [F(self.field).asc(nulls_first=True), F("pk").asc()]
+
+        if cursor is None:
+            rows = list(self.queryset.order_by(*descending)[: self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            items = rows[: self.per_page]
+            has_next, has_previous = has_more, False
+
+        else:
+            value, pk, direction = cursor
+            if direction == NEXT:
+                rows = list(self.queryset.filter(self._after(value, pk)).order_by(*descending)[: self.per_page + 1])
+                has_more = len(rows) > self.per_page
+                items = rows[: self.per_page]
+                has_next, has_previous = has_more, True
+            else:
+                rows = list(self.queryset.filter(self._before(value, pk)).order_by(*ascending)[: self.per_page + 1])
+                has_more = len(rows) > self.per_page
+                items = list(reversed(rows[: self.per_page]))
+                has_next, has_previous = True, has_more
+
+        return KeysetPage(
+            items=items,
+            next_token=self._token(items[-1], NEXT) if (items and has_next) else None,
+            previous_token=self._token(items[0], PREVIOUS) if (items and has_previous) else None,
+        )
@@ -0,0 +1,42 @@
+"""
+In-memory resource price history.
+
+Prices change rarely and are read on every incident edit, so each worker keeps the full
+history (a handful of rows) in memory until a price is saved (see `defects.signals`).
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+from typing import Optional
+
+from .models import ResourcePrice
+from .versions import VersionedCache
+
+
+class PriceHistory:
+    def __init__(self, prices):
+        self.prices = sorted(prices, key=lambda x: (x.time_created, x.pk))
+        self._times = [x.time_created for x in self.prices]
+
+    def current(self) -> Optional[ResourcePrice]:
+        return self.prices[-1] if self.prices else None
+
+    def at(self, when: datetime) -> Optional[ResourcePrice]:
+        """
+        The price in effect at `when`, or the earliest known price for times before it.
+        """
+        if not self.prices:
+            return None
+        ix = bisect_right(self._times, when)
+        return self.prices[max(ix - 1, 0)]
+
+
+def _build_history():
+    return PriceHistory(ResourcePrice.objects.select_related("created_by"))
+
+
+_history = VersionedCache("resource_price", _build_history)
+
+
+def price_history() -> PriceHistory:
+    return _history.get()
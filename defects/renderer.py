@@ -0,0 +1,120 @@
+"""
+Renders PDFs with WeasyPrint, in a pool of processes that are kept warm.
+
+Starting WeasyPrint is expensive: the import, loading fontconfig and parsing its default
+stylesheets take longer than rendering a typical report. Each process of the pool does this
+once when it starts, by rendering a small document in the fonts of the reports, and keeps
+one FontConfiguration for all its renders. The report stylesheets are part of each template,
+so they are still parsed per document.
+
+Every process that renders starts its own pool, so the pool is only used with PDF_JOBS, where
+web workers queue the reports and only the `run_pdf_worker` processes render. Each of them
+has PDF_RENDER_PROCESSES processes, so a host running one PDF worker renders at most that many
+PDFs at the same time, whatever the number of web workers. Without PDF_JOBS, or with 0, PDFs
+are rendered in the calling process, as before.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+# processes are replaced after this many renders, so memory fragmented by large images is returned
+MAX_RENDERS_PER_PROCESS = 100
+
+WARM_UP_MARKUP = """
+<html>
+<style>
+  @page { size: A4; margin: 1cm; }
+  html { font-family: Arial, "Helvetica Neue", sans-serif; font-size: 8pt; }
+</style>
+<body><h1>Warm-up</h1><p>Regular <strong>bold</strong> <em>italic</em></p></body>
+</html>
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# only set in the processes of the pool, which render one document at a time
+_font_config = None
+
+
+def _init_process():
+    global _font_config
+
+    import django
+
+    # processes are spawned, so Django has to be set up for the storage and static files used by `url_fetcher`
+    django.setup()
+
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    _font_config = FontConfiguration()
+    HTML(string=WARM_UP_MARKUP).write_pdf(font_config=_font_config)
+
+
+def _render(markup: str) -> bytes:
+    from weasyprint import HTML
+    from .reports import url_fetcher
+
+    return HTML(string=markup, url_fetcher=url_fetcher).write_pdf(font_config=_font_config)
+
+
+def processes() -> int:
+    if not settings.PDF_JOBS:
+        # a pool per web worker would multiply the processes by the number of workers
+        return 0
+    return settings.PDF_RENDER_PROCESSES
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=processes(),
+                # not forked, as the web and job workers have open database connections and threads
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process,
+                max_tasks_per_child=MAX_RENDERS_PER_PROCESS,
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def submit(markup: str) -> Future:
+    """
+    Starts rendering `markup`, the result of the future is the PDF.
+    """
+    if not processes():
+        future = Future()
+        try:
+            future.set_result(_render(markup))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    try:
+        return _get_executor().submit(_render, markup)
+    except BrokenProcessPool:
+        # a process of the pool died (e.g. out of memory), start a new pool
+        _reset_executor()
+        return _get_executor().submit(_render, markup)
+
+
+def render(markup: str) -> bytes:
+    try:
+        return submit(markup).result()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
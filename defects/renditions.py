@@ -0,0 +1,86 @@
+"""
+Print renditions of incident images, used instead of the originals in PDF reports.
+
+Photos are uploaded from phones at full resolution (often 4-12 MB), which WeasyPrint would
+decode and embed as they are. A rendition is at most MAX_SIZE pixels on its longest side,
+which is more than 200 dpi at the size the reports print them, recompressed as JPEG. It is
+created on first use and stored next to the original, in a `print` folder. Originals that
+are already small enough are used as they are.
+"""
+
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = 1600
+QUALITY = 85
+
+# originals up to this size are embedded as they are, if they also fit MAX_SIZE
+MAX_ORIGINAL_BYTES = 512 * 1024
+
+
+def rendition_name(name: str) -> str:
+    # the full file name is kept, so "a.png" and "a.jpg" do not share a rendition
+    directory, file_name = os.path.split(name)
+    return f"{directory}/print/{file_name}.jpg" if directory else f"print/{file_name}.jpg"
+
+
+def _render(fp) -> bytes:
+    with Image.open(fp) as image:
+        # let the JPEG decoder scale down by a power of two, which is much faster than decoding everything
+        image.draft("RGB", (MAX_SIZE, MAX_SIZE))
+        # phones store the orientation separately from the pixels, the rendition has no EXIF data
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_SIZE, MAX_SIZE), Image.Resampling.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        out = BytesIO()
+        image.save(out, "JPEG", quality=QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+def _needs_rendition(name: str) -> bool:
+    if default_storage.size(name) > MAX_ORIGINAL_BYTES:
+        return True
+    with default_storage.open(name, "rb") as fp, Image.open(fp) as image:
+        return max(image.size) > MAX_SIZE
+
+
+def print_rendition(name: str) -> str:
+    """
+    Returns the storage name of the print rendition of image `name`, creating it if it does
+    not exist. Returns `name` if the original is small enough or is not an image Pillow can read.
+    """
+    target = rendition_name(name)
+    if default_storage.exists(target):
+        return target
+
+    try:
+        if not _needs_rendition(name):
+            return name
+        with default_storage.open(name, "rb") as fp:
+            data = _render(fp)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("No print rendition of %s", name, exc_info=True)
+        return name
+
+    saved = default_storage.save(target, ContentFile(data))
+    if saved != target:
+        # created by another render at the same time, the storage picked another name for this one
+        default_storage.delete(saved)
+    return target
+
+
+def delete_rendition(name: str):
+    default_storage.delete(rendition_name(name))
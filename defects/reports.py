@@ -1,16 +1,35 @@
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+from django.conf import settings
 from django.core.files.storage import default_storage
 from django.contrib.staticfiles.finders import find
+from django.db.models import Q, QuerySet
+from django.template.loader import render_to_string
+import hashlib
+import importlib.metadata
 import importlib.resources
+import os
+import re
+import tempfile
 from pptx import Presentation
 from django.utils.timezone import now
 
+from .models import Incident, Approval
+from . import renderer
+from .renditions import print_rendition
+
+# assets referenced by the report templates, resolved by `url_fetcher`
+_ASSET_RE = re.compile(r"""(local|static):([^"')\s]+)""")
+
+
 def url_fetcher(url, timeout=5, ssl_context=None):
     from weasyprint import default_url_fetcher
 
-    # handle local media
+    # handle local media, images are embedded as their print renditions
     if url.startswith("local:"):
         path = url[6:]
-        file_obj = default_storage.open(path, "rb")
+        file_obj = default_storage.open(print_rendition(path), "rb")
         return {
             "file_obj": file_obj,
         }
@@ -29,3 +48,166 @@ def render_pptx(target):
 
 
     prs.save(target)
+
+
+def _asset_version(scheme, path):
+    try:
+        if scheme == "local":
+            return f"{default_storage.size(path)}:{default_storage.get_modified_time(path).timestamp()}"
+        abs_path = find(path)
+        return f"{os.path.getsize(abs_path)}:{os.path.getmtime(abs_path)}" if abs_path else "missing"
+    except (OSError, NotImplementedError):
+        return "missing"
+
+
+def pdf_cache_key(markup: str) -> str:
+    """
+    Hash of the report markup and of the version of every image and static file it references.
+    The markup contains the data of the incident, so any change to it results in a new key.
+    """
+    digest = hashlib.sha256()
+    digest.update(importlib.metadata.version("weasyprint").encode())
+    digest.update(markup.encode())
+    for scheme, path in sorted(set(_ASSET_RE.findall(markup))):
+        digest.update(f"\n{scheme}:{path}={_asset_version(scheme, path)}".encode())
+    return digest.hexdigest()
+
+
+def _evict_pdfs(cache_dir, max_bytes):
+    # least recently used first, the modification time is updated on every cache hit
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".pdf"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            # removed by another worker, or open on Windows
+            pass
+
+
+def _cache_path(markup):
+    return os.path.join(settings.PDF_CACHE_DIR, f"{pdf_cache_key(markup)}.pdf")
+
+
+def cached_pdf(markup: str):
+    """
+    Returns an open binary file with the cached PDF of `markup`, or None if it has not been rendered.
+    """
+    path = _cache_path(markup)
+    try:
+        fp = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    os.utime(path)
+    return fp
+
+
+def store_pdf(markup: str, pdf: bytes):
+    """
+    Adds the PDF of `markup` to the cache in PDF_CACHE_DIR, which is kept below PDF_CACHE_MAX_BYTES,
+    and returns it as an open binary file.
+    """
+    cache_dir = settings.PDF_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(markup)
+
+    # written to a temporary file and renamed, so other workers never read a partial file
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as tmp:
+        tmp.write(pdf)
+    try:
+        os.replace(tmp.name, path)
+    except OSError:
+        # rendered by another worker at the same time
+        os.remove(tmp.name)
+    fp = open(path, "rb")
+
+    _evict_pdfs(cache_dir, settings.PDF_CACHE_MAX_BYTES)
+    return fp
+
+
+def render_pdf(markup: str):
+    """
+    Returns an open binary file with the PDF of `markup`, read from the cache or rendered by WeasyPrint.
+    """
+    fp = cached_pdf(markup)
+    if fp is not None:
+        return fp
+    return store_pdf(markup, renderer.render(markup))
+
+
+def notification_report(incident):
+    """
+    Markup and file name of the 48H notification (prefetch_related: images, select_related: section).
+    """
+    markup = render_to_string("defects/reports/notification.html", context={"incident": incident, "images": incident.images.all()})
+    file_name = f"AMB 48H RI - {incident.section.code} - {incident.short_description} - ({incident.time_start.strftime("%d.%m.%Y")}).pdf"
+    return markup, file_name
+
+
+def close_out_report(incident):
+    """
+    Markup and file name of the close-out slide.
+    """
+    approvals = Approval.objects.select_related("user").order_by("-time_modified").filter(incident=incident, type=Approval.CLOSE_OUT, score__gt=0)
+    se_approval = approvals.filter(role=Approval.SECTION_ENGINEER).first()
+    sem_approval = approvals.filter(role=Approval.SECTION_ENGINEERING_MANAGER).first()
+
+    # ["name", 1, <date>|<datetime>]
+    ratings = {
+        "re": [incident.created_by.username, incident.close_out_confidence, incident.close_out_time_published],
+        "se": ["---", 0, None] if se_approval is None else [se_approval.user.username, se_approval.score, se_approval.time_modified],
+        "sem": ["---", 0, None] if sem_approval is None else [sem_approval.user.username, sem_approval.score, sem_approval.time_modified],
+    }
+
+    markup = render_to_string("defects/reports/closeout.html", context={"incident": incident, "ratings": ratings})
+    return markup, f"close-{incident.code}.pdf"
+
+
+def anniversary_report(incident):
+    """
+    Markup and file name of the anniversary review (prefetch_related: solutions).
+    """
+    markup = render_to_string("defects/reports/anniversary.html", context={"incident": incident})
+    return markup, f"anniversary-{incident.code}.pdf"
+
+
+@dataclass
+class Report:
+    queryset: Callable[[], QuerySet]
+    build: Callable[[Incident], Tuple[str, str]]
+    # the incidents that have the report, with the fields `build` needs
+    available: Q
+
+
+REPORTS = {
+    "notification": Report(
+        lambda: Incident.objects.prefetch_related("images").select_related("section"),
+        notification_report,
+        Q(notification_time_published__isnull=False, section__isnull=False, time_start__isnull=False),
+    ),
+    "close_out": Report(
+        lambda: Incident.objects.select_related("created_by"),
+        close_out_report,
+        Q(close_out_time_published__isnull=False, created_by__isnull=False),
+    ),
+    "anniversary": Report(
+        lambda: Incident.objects.prefetch_related("solutions"),
+        anniversary_report,
+        Q(time_start__isnull=False),
+    ),
+}
+
+
+def build_report(kind, incident_id) -> Tuple[str, str]:
+    """
+    Markup and file name of the report `kind` of an incident.
+    """
+    report = REPORTS[kind]
+    return report.build(report.queryset().get(pk=incident_id))
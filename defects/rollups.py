@@ -0,0 +1,117 @@
+"""
+Maintains IncidentRollup, the per (local date, operation, area, section) aggregates of
+incidents that the dashboards read from.
+
+There is one row per key, recalculated from the incidents of the key whenever an incident
+is saved or deleted (see `defects.signals`). Bulk operations bypass the signals, so they must call
+`refresh_rollup` themselves or be followed by `python manage.py rebuild_incident_rollup`.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Incident, IncidentRollup
+from .timeseries import LOCAL_TZ
+
+
+def rollup_key(incident):
+    """
+    Returns the key of the rollup row an incident counts towards, or None.
+    """
+    if incident.time_start is None:
+        return None
+    local_date = timezone.localtime(incident.time_start, LOCAL_TZ).date()
+    return local_date, incident.operation_id, incident.area_id, incident.section_id
+
+
+def _key_string(key):
+    # the unique IncidentRollup.key
+    return "/".join("" if x is None else str(x) for x in key)
+
+
+# aggregates are aliased with a prefix because an alias may not shadow an Incident field
+PREFIX = "rollup_"
+
+
+def _aggregates():
+    reviewed = Q(time_anniversary_reviewed__isnull=False)
+    aggregates = {
+        "incident_count": Count("id"),
+        "active_count": Count("id", filter=Q(status=Incident.ACTIVE)),
+        "rand_value_loss": Sum("rand_value_loss"),
+        "repair_cost": Sum("repair_cost"),
+        "production_value_loss": Sum("production_value_loss"),
+        "reviewed_count": Count("id", filter=reviewed),
+        "success_count": Count("id", filter=reviewed & Q(anniversary_success=True)),
+        "success_rand_value": Sum("rand_value_loss", filter=reviewed & Q(anniversary_success=True)),
+        "failure_rand_value": Sum("rand_value_loss", filter=reviewed & Q(anniversary_success=False)),
+        "last_time_end": Max("time_end"),
+    }
+    return {PREFIX + name: aggregate for name, aggregate in aggregates.items()}
+
+
+def _rollup_values(row):
+    # aggregates over no incidents (e.g. a sum with a filter) are NULL, stored as the field default
+    values = {}
+    for k, v in row.items():
+        if k.startswith(PREFIX):
+            name = k.removeprefix(PREFIX)
+            values[name] = IncidentRollup._meta.get_field(name).get_default() if v is None else v
+    return values
+
+
+def _rollup_from_row(key, row):
+    local_date, operation_id, area_id, section_id = key
+    return IncidentRollup(key=_key_string(key), date=local_date, operation_id=operation_id, area_id=area_id, section_id=section_id, **_rollup_values(row))
+
+
+def refresh_rollup(keys):
+    """
+    Recalculates the rollup rows for the given keys from the incident table.
+    """
+    keys = {k for k in keys if k is not None}
+    with transaction.atomic():
+        for key in keys:
+            local_date, operation_id, area_id, section_id = key
+            start = datetime.combine(local_date, time.min, tzinfo=LOCAL_TZ)
+            dimensions = {"operation_id": operation_id, "area_id": area_id, "section_id": section_id}
+
+            row = Incident.objects.filter(time_start__gte=start, time_start__lt=start + timedelta(days=1), **dimensions).aggregate(**_aggregates())
+            if row[PREFIX + "incident_count"]:
+                # locks the row; a concurrent insert of the same key violates the unique key, and the
+                # insert of update_or_create then retries as an update
+                IncidentRollup.objects.update_or_create(key=_key_string(key), defaults={"date": local_date, **dimensions, **_rollup_values(row)})
+            else:
+                IncidentRollup.objects.filter(key=_key_string(key)).delete()
+
+
+def rebuild_rollup(batch_size=1000):
+    """
+    Recalculates all rollup rows, returns the number of rows created.
+    """
+    rows = (
+        Incident.objects.filter(time_start__isnull=False)
+        .annotate(local_date=TruncDate("time_start", tzinfo=LOCAL_TZ))
+        .values("local_date", "operation_id", "area_id", "section_id")
+        .annotate(**_aggregates())
+        .order_by()
+    )
+
+    with transaction.atomic():
+        IncidentRollup.objects.all().delete()
+        batch = []
+        count = 0
+        for row in rows.iterator(chunk_size=batch_size):
+            key = (row["local_date"], row["operation_id"], row["area_id"], row["section_id"])
+            batch.append(_rollup_from_row(key, row))
+            if len(batch) >= batch_size:
+                IncidentRollup.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        IncidentRollup.objects.bulk_create(batch)
+        count += len(batch)
+    return count
@@ -0,0 +1,148 @@
+"""
+Full-text search over incidents.
+
+On SQLite the index is an FTS5 virtual table ranked with bm25. Other databases use the
+IncidentSearchTerm table, which stores one row per distinct term of an incident and
+supports prefix lookups on an ordinary b-tree index.
+
+Both indexes are updated in `Incident.save`. Rows created with `bulk_create` are not
+indexed, use `python manage.py rebuild_search_index` after bulk loads.
+"""
+
+import re
+from collections import Counter
+
+from django.db import connections, router
+from django.db.models import Q, Count, Value, Sum, OuterRef, Subquery, FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import Incident, IncidentSearchTerm
+
+FTS_TABLE = "defects_incident_fts"
+MAX_TERM_LENGTH = 100
+CODE_WEIGHT = 5
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_fts_available = {}
+
+
+def tokenize(text: str) -> list[str]:
+    return [t[:MAX_TERM_LENGTH] for t in _TOKEN_RE.findall(text.lower())]
+
+
+def incident_document(incident) -> str:
+    """
+    All searchable text of an incident, excluding the code.
+    """
+    parts = [
+        incident.short_description,
+        incident.long_description,
+        incident.close_out_immediate_cause,
+        incident.close_out_root_cause,
+        incident.immediate_action_taken,
+        incident.equipment.name if incident.equipment_id else "",
+    ]
+    return "\n".join(p for p in parts if p)
+
+
+def fts_available(using) -> bool:
+    if using not in _fts_available:
+        conn = connections[using]
+        available = False
+        if conn.vendor == "sqlite":
+            with conn.cursor() as c:
+                c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                available = c.fetchone() is not None
+        _fts_available[using] = available
+    return _fts_available[using]
+
+
+def index_incident(incident):
+    using = router.db_for_write(Incident, instance=incident)
+    body = incident_document(incident)
+
+    if fts_available(using):
+        with connections[using].cursor() as c:
+            c.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [incident.pk])
+            c.execute(f"INSERT INTO {FTS_TABLE} (rowid, code, body) VALUES (%s, %s, %s)", [incident.pk, incident.code, body])
+        return
+
+    weights = Counter(tokenize(body))
+    for term in tokenize(incident.code):
+        weights[term] += CODE_WEIGHT
+
+    IncidentSearchTerm.objects.using(using).filter(incident_id=incident.pk).delete()
+    IncidentSearchTerm.objects.using(using).bulk_create(
+        [IncidentSearchTerm(incident_id=incident.pk, term=term, weight=weight) for term, weight in weights.items()]
+    )
+
+
+def unindex_incident(incident):
+    # rows of the portable index are deleted with the incident
+    using = router.db_for_write(Incident, instance=incident)
+    if fts_available(using):
+        with connections[using].cursor() as c:
+            c.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [incident.pk])
+
+
+def rebuild_index(using="default", chunk_size=500):
+    if fts_available(using):
+        with connections[using].cursor() as c:
+            c.execute(f"DELETE FROM {FTS_TABLE}")
+    else:
+        IncidentSearchTerm.objects.using(using).all().delete()
+
+    count = 0
+    for incident in Incident.objects.using(using).select_related("equipment").iterator(chunk_size=chunk_size):
+        index_incident(incident)
+        count += 1
+    return count
+
+
+def _fts_match_expression(terms):
+    # every term is quoted (to escape FTS5 syntax) and matched as a prefix
+    return " ".join('"{}"*'.format(t.replace('"', '""')) for t in terms)
+
+
+def search_incidents(queryset, query):
+    """
+    Filters `queryset` to incidents matching every term in `query` (as prefixes)
+    and annotates each with `search_rank`, where a higher rank is more relevant.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return queryset.none()
+
+    using = queryset.db
+
+    if fts_available(using):
+        match = _fts_match_expression(terms)
+        table = Incident._meta.db_table
+        return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])).annotate(
+            search_rank=RawSQL(
+                f"SELECT -bm25({FTS_TABLE}, {float(CODE_WEIGHT)}, 1.0) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    prefix_filter = Q()
+    for t in terms:
+        prefix_filter |= Q(term__startswith=t)
+
+    # every query term is counted on its own, as one index term can match several of them ("bear bearing")
+    matched = {f"matched_{ix}": Count("pk", filter=Q(term__startswith=t)) for ix, t in enumerate(terms)}
+    matches = (
+        IncidentSearchTerm.objects.filter(prefix_filter)
+        .values("incident_id")
+        .annotate(**matched, score=Sum("weight"))
+        .filter(**{f"{name}__gt": 0 for name in matched})
+    )
+
+    return queryset.filter(pk__in=matches.values("incident_id")).annotate(
+        search_rank=Coalesce(
+            Subquery(matches.filter(incident_id=OuterRef("pk")).values("score")[:1], output_field=FloatField()),
+            Value(0.0),
+        )
+    )
@@ -153,6 +153,15 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 MEDIA_ROOT = os.environ.get("MEDIA_ROOT") or BASE_DIR / "media/"
 MEDIA_URL = os.environ.get("MEDIA_URL", "/media/")
 
+# rendered incident reports, see `defects.reports.render_pdf`
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR") or os.path.join(MEDIA_ROOT, "pdf-cache")
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+# render PDFs in the background with `python manage.py run_pdf_worker`, instead of in the request
+PDF_JOBS = os.getenv("DJANGO_PDF_JOBS", "0") == "1"
+# processes of each `run_pdf_worker` that render PDFs when PDF_JOBS is enabled, see `defects.renderer`;
+# the renders on a host are bounded by PDF workers x PDF_RENDER_PROCESSES, 0 renders in the worker itself
+PDF_RENDER_PROCESSES = int(os.environ.get("PDF_RENDER_PROCESSES", 0))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,110 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .actions import invalidate_user_actions
+from .models import Equipment, Incident, IncidentImage, Operation, Area, Section, Approval, Solution, ResourcePrice
+from .renditions import delete_rendition
+from .rollups import rollup_key, refresh_rollup, rebuild_rollup
+from .search import unindex_incident
+from .versions import bump_version
+
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_delete, sender=Equipment)
+def equipment_changed(sender, **kwargs):
+    bump_version("equipment")
+
+
+@receiver(post_save, sender=ResourcePrice)
+@receiver(post_delete, sender=ResourcePrice)
+def resource_price_changed(sender, **kwargs):
+    bump_version("resource_price")
+
+
+@receiver(pre_save, sender=Incident)
+def incident_pre_save(sender, instance, raw=False, **kwargs):
+    # remember which rollup row the incident counted towards and who owned it before this save
+    instance._previous_rollup_key = None
+    instance._previous_user_ids = []
+    if instance.pk and not raw:
+        previous = (
+            Incident.objects.filter(pk=instance.pk)
+            .only("time_start", "operation_id", "area_id", "section_id", "created_by_id", "section_engineer_id")
+            .first()
+        )
+        if previous is not None:
+            instance._previous_rollup_key = rollup_key(previous)
+            instance._previous_user_ids = [previous.created_by_id, previous.section_engineer_id]
+
+
+@receiver(post_save, sender=Incident)
+def incident_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_rollup([getattr(instance, "_previous_rollup_key", None), rollup_key(instance)])
+    invalidate_user_actions([instance.created_by_id, instance.section_engineer_id, *getattr(instance, "_previous_user_ids", [])])
+
+
+@receiver(post_delete, sender=Incident)
+def incident_post_delete(sender, instance, **kwargs):
+    unindex_incident(instance)
+    refresh_rollup([rollup_key(instance)])
+    invalidate_user_actions([instance.created_by_id, instance.section_engineer_id])
+
+
+@receiver(post_delete, sender=IncidentImage)
+def incident_image_post_delete(sender, instance, **kwargs):
+    if instance.image:
+        delete_rendition(instance.image.name)
+
+
+def _incident_user_ids(incident_id):
+    return list(Incident.objects.filter(pk=incident_id).values_list("created_by_id", "section_engineer_id").first() or [])
+
+
+@receiver(post_save, sender=Approval)
+@receiver(post_delete, sender=Approval)
+def approval_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_user_actions([instance.user_id, *_incident_user_ids(instance.incident_id)])
+
+
+@receiver(post_save, sender=Solution)
+@receiver(post_delete, sender=Solution)
+def solution_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_user_actions(_incident_user_ids(instance.incident_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # the rule sets of a user depend on their groups
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        invalidate_user_actions([instance.pk])
+    elif action == "pre_clear":
+        invalidate_user_actions(instance.user_set.values_list("id", flat=True))
+    else:
+        invalidate_user_actions(pk_set)
+
+
+@receiver(post_save, sender=Operation)
+@receiver(post_save, sender=Area)
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Operation)
+@receiver(post_delete, sender=Area)
+@receiver(post_delete, sender=Section)
+def taxonomy_changed(sender, **kwargs):
+    bump_version("taxonomy")
+
+
+@receiver(post_delete, sender=Operation)
+@receiver(post_delete, sender=Area)
+@receiver(post_delete, sender=Section)
+def taxonomy_deleted(sender, **kwargs):
+    # incidents are detached with a bulk update which does not send signals
+    rebuild_rollup()
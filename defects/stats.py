@@ -1,106 +1,74 @@
-from django.db import connections
-from .models import Incident
+"""
+Dashboard statistics, read from the incident rollup table (see `defects.rollups`)
+so their cost depends on the number of buckets rather than the number of incidents.
+"""
+
+from django.db.models import Sum, Max
+from .models import Incident, IncidentRollup
+from .timeseries import Buckets, bucket_rows, fill_series, WEEK, MONTH
 from django.utils.timezone import now
 
 
-def _dictfetchall(cursor):
-    columns = [col[0] for col in cursor.description]
-    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+def _rollups(operation_id=None, area_id=None, section_id=None):
+    rollups = IncidentRollup.objects.all()
+    if operation_id is not None:
+        rollups = rollups.filter(operation_id=operation_id)
+    if area_id is not None:
+        rollups = rollups.filter(area_id=area_id)
+    if section_id is not None:
+        rollups = rollups.filter(section_id=section_id)
+    return rollups
 
 
-def execute_sql_query(sql, using="default", params=None):
-    with connections[using].cursor() as cursor:
-        cursor.execute(sql, params=params)
-        return _dictfetchall(cursor)
+def get_ri_series(granularity=WEEK, count=52, operation_id=None, area_id=None, section_id=None):
+    """
+    RI count and rand value loss per time bucket (by incident start, in local time).
+    """
+    buckets = Buckets.ending(granularity, count)
+    rows = bucket_rows(
+        _rollups(operation_id=operation_id, area_id=area_id, section_id=section_id),
+        "date",
+        buckets,
+        {"cnt": Sum("incident_count"), "rand_value_loss": Sum("rand_value_loss")},
+    )
+    series = fill_series(rows, buckets, ["cnt", "rand_value_loss"])
+    for row in series:
+        row["rand_value_loss"] = float(row["rand_value_loss"])
+    return series
 
 
-def get_monthly_ri_value_per_area(area_id=None, months=36):
-    params = [months]
-    area_filter = ""
-    if area_id is not None:
-        area_filter = "AND i.area_id = %s"
-        params.append(area_id)
-
-    sql = f"""
-       WITH RECURSIVE dates(date) AS (
-    SELECT DATE('now', 'start of month', '-' || %s || ' months')
-    UNION ALL
-    SELECT DATE(DATE, '+1 months')
-    FROM dates
-    WHERE DATE(DATE, '+1 months') <= DATE('now', 'start of month')
-)
-SELECT
-    strftime("%%Y-%%m", dates.date) AS label,
-    COUNT(i.id) AS cnt,
-    IFNULL(SUM(CASE WHEN i.anniversary_success THEN i.rand_value_loss ELSE i.rand_value_loss * -1 END), 0) AS rand_value
-FROM
-    dates
-LEFT JOIN
-    defects_incident i
-    ON strftime('%%Y-%%m', i.time_start) = strftime('%%Y-%%m', dates.date)
-{area_filter}
-AND i.time_anniversary_reviewed IS NOT NULL
-GROUP BY
-    dates.date;
+def get_ri_value_series(granularity=WEEK, count=52, operation_id=None, area_id=None, section_id=None):
+    """
+    Count of anniversary reviewed RIs and their rand value per time bucket, where the
+    value is positive if the root cause was resolved and negative otherwise.
     """
-    return execute_sql_query(sql, params=params)
+    buckets = Buckets.ending(granularity, count)
+    rows = bucket_rows(
+        _rollups(operation_id=operation_id, area_id=area_id, section_id=section_id),
+        "date",
+        buckets,
+        {"cnt": Sum("reviewed_count"), "success_rand_value": Sum("success_rand_value"), "failure_rand_value": Sum("failure_rand_value")},
+    )
+    series = fill_series(rows, buckets, ["cnt", "success_rand_value", "failure_rand_value"])
+    for row in series:
+        # value gained when the root cause was resolved, lost otherwise
+        row["rand_value"] = float(row.pop("success_rand_value") - row.pop("failure_rand_value"))
+    return series
+
+
+def get_monthly_ri_value_per_area(area_id=None, months=36):
+    return get_ri_value_series(MONTH, months + 1, area_id=area_id)
+
 
 def get_weekly_ri_value_per_area(area_id=None, weeks=52):
+    return get_ri_value_series(WEEK, weeks + 1, area_id=area_id)
 
-    params = [weeks]
-    area_filter = ""
-    if area_id is not None:
-        area_filter = "AND i.area_id = %s"
-        params.append(area_id)
-
-    sql = f"""
-       WITH RECURSIVE dates(date) AS (
-        SELECT DATE(julianday('now') - 7 * %s)
-        UNION ALL
-        SELECT DATE(julianday(DATE) + 7)
-        FROM dates
-        WHERE DATE < DATE(julianday('now'))
-    )
-SELECT
-    strftime("%%Y-%%W", dates.date) AS label,
-    COUNT(i.id) AS cnt,
-    IFNULL(SUM(CASE WHEN i.anniversary_success THEN i.rand_value_loss ELSE i.rand_value_loss * -1 END), 0) AS rand_value
-FROM
-    dates
-LEFT JOIN
-    defects_incident i
-    ON strftime('%%Y-%%W', i.time_start) = strftime('%%Y-%%W', dates.date)
-{area_filter}
-AND i.time_anniversary_reviewed IS NOT NULL
-GROUP BY
-    dates.date;
-    """
-    return execute_sql_query(sql, params=params)
 
 def get_weekly_ri_count_per_section(section_id, weeks=52):
-
-    sql = f"""
-    WITH RECURSIVE dates(date) AS (
-        SELECT DATE(julianday('now') - 7 * %s)
-        UNION ALL
-        SELECT DATE(julianday(DATE) + 7)
-        FROM dates
-        WHERE DATE < DATE(julianday('now'))
-    )
-    SELECT
-        dates.date AS week_start_date,
-        COUNT(i.id) AS cnt,
-        IFNULL(SUM(i.rand_value_loss), 0) AS rand_value_loss
-    FROM
-        dates
-    LEFT JOIN
-        defects_incident i
-        ON strftime('%%Y-%%W', i.time_start) = strftime('%%Y-%%W', dates.date)
-    WHERE i.section_id = %s
-    GROUP BY
-        dates.date;
-    """
-    return execute_sql_query(sql, params=[weeks, section_id])
+    return [
+        {"week_start_date": row["start"].isoformat(), "cnt": row["cnt"], "rand_value_loss": row["rand_value_loss"]}
+        for row in get_ri_series(WEEK, weeks + 1, section_id=section_id)
+    ]
 
 
 def get_section_ri_free_days(section_id):
@@ -109,3 +77,53 @@ def get_section_ri_free_days(section_id):
     if not last_ri:
         return 0
     return (now() - last_ri.time_end).days
+
+
+def get_weekly_ri_count_for_sections(area_id=None, weeks=52, section_ids=()):
+    """
+    Weekly RI count and rand value loss for all sections (optionally only those in an area)
+    together with the number of RI free days of each section, in a single query on the rollup.
+    Sections in `section_ids` are included even if they have no incidents.
+
+    Returns a dict keyed by section id:
+        {"ri_count": [{"week_start_date", "cnt", "rand_value_loss"}, ...], "ri_free_days": int}
+    """
+    buckets = Buckets.ending(WEEK, weeks + 1)
+
+    rollups = IncidentRollup.objects.filter(section__isnull=False)
+    if area_id is not None:
+        rollups = rollups.filter(section__area_id=area_id)
+
+    # rows before the window are not filtered out so that they count towards the last end time
+    rows = list(
+        bucket_rows(
+            rollups,
+            "date",
+            buckets,
+            {"cnt": Sum("incident_count"), "rand_value_loss": Sum("rand_value_loss"), "last_time_end": Max("last_time_end")},
+            group_by=["section_id"],
+            restrict=False,
+        )
+    )
+
+    last_time_end = {}
+    for row in rows:
+        if row["last_time_end"] is not None:
+            section_id = row["section_id"]
+            last_time_end[section_id] = max(row["last_time_end"], last_time_end.get(section_id, row["last_time_end"]))
+
+    series = fill_series(rows, buckets, ["cnt", "rand_value_loss"], group_by="section_id")
+
+    current_time = now()
+    stats = {}
+    for section_id in set(section_ids) | set(series) | set(last_time_end):
+        if section_id not in series:
+            series[section_id] = fill_series([], buckets, ["cnt", "rand_value_loss"])
+        stats[section_id] = {
+            "ri_count": [
+                {"week_start_date": row["start"].isoformat(), "cnt": row["cnt"], "rand_value_loss": float(row["rand_value_loss"])}
+                for row in series[section_id]
+            ],
+            "ri_free_days": (current_time - last_time_end[section_id]).days if section_id in last_time_end else 0,
+        }
+    return stats
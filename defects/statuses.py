@@ -0,0 +1,93 @@
+"""
+Keeps `Incident.status` current as deadlines pass.
+
+The status is calculated when an incident is saved, but an incident also becomes overdue
+when one of its deadlines passes without anyone touching it. Every run finds the incidents
+with a deadline between the previous run and now, using range predicates on the indexed
+`time_end` and `notification_time_published` columns, and recalculates their status.
+"""
+
+from datetime import datetime
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from .models import Incident, TaskRun
+from .rollups import rollup_key, refresh_rollup
+
+TASK_NAME = "incident_status"
+
+BATCH_SIZE = 500
+
+
+def incidents_with_deadline_between(since: datetime, until: datetime) -> set[int]:
+    """
+    Ids of open incidents with a deadline in [since, until).
+    """
+    open_incidents = Incident.objects.filter(time_anniversary_reviewed__isnull=True)
+
+    notification_due = open_incidents.filter(
+        notification_time_published__isnull=True,
+        time_end__gte=since - Incident.NOTIFICATION_DEADLINE,
+        time_end__lt=until - Incident.NOTIFICATION_DEADLINE,
+    )
+    rca_report_due = open_incidents.filter(
+        significant=True,
+        rca_report_time_published__isnull=True,
+        notification_time_published__gte=since - Incident.RCA_REPORT_DEADLINE,
+        notification_time_published__lt=until - Incident.RCA_REPORT_DEADLINE,
+    )
+
+    # two separate range scans rather than an OR, so each can use its index
+    return set(notification_due.values_list("id", flat=True)) | set(rca_report_due.values_list("id", flat=True))
+
+
+def recalculate_statuses(incident_ids, current_time: datetime = None, batch_size=BATCH_SIZE) -> int:
+    """
+    Recalculates and stores the status of the given incidents, returns the number that changed.
+    """
+    current_time = current_time or now()
+    incident_ids = sorted(incident_ids)
+    changed_count = 0
+
+    for ix in range(0, len(incident_ids), batch_size):
+        batch = Incident.objects.filter(id__in=incident_ids[ix : ix + batch_size]).prefetch_related("solutions")
+
+        changed = []
+        for incident in batch:
+            status = incident.calculate_status(current_time)
+            if status != incident.status:
+                incident.status = status
+                changed.append(incident)
+
+        if changed:
+            # bulk_update neither sends signals nor sets auto_now fields, so the rollup rows and
+            # the modification time (read by the change feed) are updated here
+            modified_time = now()
+            for incident in changed:
+                incident.time_modified = modified_time
+            with transaction.atomic():
+                Incident.objects.bulk_update(changed, ["status", "time_modified"])
+                refresh_rollup([rollup_key(incident) for incident in changed])
+            changed_count += len(changed)
+
+    return changed_count
+
+
+def refresh_statuses(until: datetime = None, full=False, batch_size=BATCH_SIZE) -> tuple[int, int]:
+    """
+    Recalculates the status of incidents with a deadline since the previous run, or of all
+    incidents on the first run or with `full`. Returns the number checked and changed.
+    """
+    until = until or now()
+    last_run = TaskRun.objects.filter(name=TASK_NAME).first()
+
+    if full or last_run is None:
+        incident_ids = set(Incident.objects.values_list("id", flat=True))
+    else:
+        incident_ids = incidents_with_deadline_between(last_run.time_last_run, until)
+
+    changed_count = recalculate_statuses(incident_ids, current_time=until, batch_size=batch_size)
+
+    TaskRun.objects.update_or_create(name=TASK_NAME, defaults={"time_last_run": until})
+    return len(incident_ids), changed_count
@@ -0,0 +1,87 @@
+"""
+In-memory Operation > Area > Section tree.
+
+The taxonomy is edited in the admin a few times a year but read by most pages, so each
+worker keeps a copy that is rebuilt when any of the three tables change (see `defects.signals`).
+Nodes are shared between requests and must not be modified.
+"""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from django.db.models import F
+
+from .models import Operation, Area, Section
+from .versions import VersionedCache
+
+
+@dataclass
+class Node:
+    id: int
+    name: str
+    code: str
+    order_index: int
+    parent_id: Optional[int]
+    children: list["Node"] = field(default_factory=list)
+
+    def __str__(self):
+        return self.name
+
+
+def _nodes(rows):
+    nodes = [Node(id=x["id"], name=x["name"], code=x.get("code", ""), order_index=x["order_index"], parent_id=x.get("parent_id")) for x in rows]
+    # same order as Meta.ordering of the models, with the id as tie break
+    return sorted(nodes, key=lambda x: (x.order_index, x.id))
+
+
+class Taxonomy:
+    def __init__(self, operations, areas, sections):
+        self.operations = _nodes(operations)
+        self.areas = _nodes(areas)
+        self.sections = _nodes(sections)
+
+        self.operation_by_id = {x.id: x for x in self.operations}
+        self.area_by_id = {x.id: x for x in self.areas}
+        self.section_by_id = {x.id: x for x in self.sections}
+
+        for area in self.areas:
+            if area.parent_id in self.operation_by_id:
+                self.operation_by_id[area.parent_id].children.append(area)
+        for section in self.sections:
+            if section.parent_id in self.area_by_id:
+                self.area_by_id[section.parent_id].children.append(section)
+
+        self.areas_by_name = sorted(self.areas, key=lambda x: x.name)
+        self.conditionals = self._conditionals()
+
+    def _conditionals(self):
+        # keys and values are strings as the payload is used in a browser HTML context
+        areas = {}
+        for area in self.areas:
+            areas.setdefault("" if area.parent_id is None else str(area.parent_id), []).append(str(area.id))
+        sections = {}
+        for section in self.sections:
+            sections.setdefault("" if section.parent_id is None else str(section.parent_id), []).append(str(section.id))
+        return {"areas": areas, "sections": sections}
+
+    def choices(self, nodes, blank=True):
+        return ([("", "---------")] if blank else []) + [(x.id, x.name) for x in nodes]
+
+    def sections_in_area(self, area_id) -> list[Node]:
+        area = self.area_by_id.get(area_id)
+        return list(area.children) if area else []
+
+
+def _build_taxonomy():
+    return Taxonomy(
+        Operation.objects.values("id", "name", "order_index"),
+        Area.objects.values("id", "name", "code", "order_index", parent_id=F("operation_id")),
+        Section.objects.values("id", "name", "code", "order_index", parent_id=F("area_id")),
+    )
+
+
+_taxonomy = VersionedCache("taxonomy", _build_taxonomy)
+
+
+def get_taxonomy() -> Taxonomy:
+    return _taxonomy.get()
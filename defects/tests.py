@@ -1,14 +1,51 @@
 from django.test import TestCase
+from django.db import IntegrityError, connection, transaction
+from django.core.cache import cache
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
 
 # Create your tests here.
-from defects.models import Incident, Approval
-from defects.actions import get_user_actions, Urgency
+import csv
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock, skipUnless
+from PIL import Image as PILImage
+from pypdf import PdfReader, PdfWriter
+
+from defects.models import Incident, Approval, Equipment, Area, Section, IncidentRollup, Solution, IncidentCodeSequence, ResourcePrice, PdfJob, IncidentImage
+from defects.versions import bump_version
+from defects.actions import get_user_actions, compute_user_actions, Urgency
+from defects.pagination import KeysetPaginator
+from defects.search import FTS_TABLE, search_incidents
+from defects.equipment_index import search_equipment
+from defects.stats import get_weekly_ri_count_for_sections, get_ri_series, get_ri_value_series
+from defects.rollups import rebuild_rollup
+from defects.taxonomy import get_taxonomy
+from defects.forms import IncidentUpdateForm, conditional_forms_payload
+from defects.analytics import write_dataset
+from defects.equipment_import import import_equipment, read_rows
+from defects.changes import Watermark, changes
+from defects.jobs import claim_next, enqueue, enqueue_pack, run_job
+from defects import renderer
+from defects.reports import render_pdf
+from defects.renditions import print_rendition, rendition_name
+from defects.statuses import refresh_statuses
+from defects.timeseries import Buckets, LOCAL_TZ, DAY, WEEK, MONTH, QUARTER
+from django.db.models import F, Sum
 from auditlog.models import LogEntry
 from django.urls import reverse
 from django.contrib.auth.models import User
-from django.utils.timezone import now
-from datetime import timedelta
+from django.utils.timezone import now, localdate
+from datetime import timedelta, datetime, date, timezone
+from decimal import Decimal
 
 
 class TestAuditLog(TestCase):
@@ -72,6 +109,10 @@ class TestUserActions(TestCase):
         "defects/fixtures/users.json",
     ]
 
+    def setUp(self):
+        # version stamps are rolled back after every test, cached actions are not
+        cache.clear()
+
     def test_notification_user_action(self):
         re_user = User.objects.get(username="reliability_engineer")
         incident = Incident.objects.create(created_by=re_user, time_start=now(), time_end=now(), code=Incident.generate_incident_code("TEST"))
@@ -99,6 +140,73 @@ class TestUserActions(TestCase):
         incident.save()
         self.assertEqual(get_user_actions(re_user)[0].urgency, Urgency.DANGER)
 
+    def _create_incidents(self, user, count):
+        start = Incident.objects.count()
+        for ix in range(start, start + count):
+            incident = Incident.objects.create(
+                created_by=user, time_start=now(), time_end=now(), notification_time_published=now(), significant=bool(ix % 2), code=f"TEST_RI_{ix}"
+            )
+            Approval.objects.create(incident=incident, created_by=user, role=Approval.SECTION_ENGINEERING_MANAGER, type=Approval.NOTIFICATION, outcome=Approval.REJECTED)
+
+    def test_query_count_is_independent_of_incident_count(self):
+        re_user = User.objects.get(username="reliability_engineer")
+        self._create_incidents(re_user, 2)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(compute_user_actions(re_user)), 2 + 1)
+
+        self._create_incidents(re_user, 10)
+        with self.assertNumQueries(2):
+            actions = compute_user_actions(re_user)
+        self.assertEqual(len(actions), 12 + 6)
+        self.assertEqual({a.message for a in actions if a.urgency == Urgency.DANGER}, {"Resubmit Rejected 48H Notification"})
+        self.assertEqual({a.message for a in actions if a.urgency != Urgency.DANGER}, {"Publish Close-Out Slide"})
+
+    def test_pending_approval_actions(self):
+        re_user = User.objects.get(username="reliability_engineer")
+        sem_user = User.objects.get(username="section_engineering_manager")
+        incident = Incident.objects.create(created_by=re_user, time_start=now(), time_end=now(), code=Incident.generate_incident_code("TEST"))
+        Approval.objects.create(incident=incident, user=sem_user, role=Approval.SECTION_ENGINEERING_MANAGER, type=Approval.NOTIFICATION)
+        Approval.objects.create(incident=incident, user=sem_user, role=Approval.SECTION_ENGINEERING_MANAGER, type=Approval.RCA, outcome=Approval.ACCEPTED)
+
+        actions = get_user_actions(sem_user)
+        self.assertEqual([(a.incident.id, a.message) for a in actions], [(incident.id, "Review 48H Notification")])
+
+    def test_cached_actions_are_invalidated_by_changes(self):
+        re_user = User.objects.get(username="reliability_engineer")
+        sem_user = User.objects.get(username="section_engineering_manager")
+        incident = Incident.objects.create(created_by=re_user, time_start=now(), time_end=now(), code=Incident.generate_incident_code("TEST"))
+        self.assertEqual([a.message for a in get_user_actions(re_user)], ["Create 48H Notification"])
+        self.assertEqual(get_user_actions(sem_user), [])
+
+        # cache hit: only the version stamp is read
+        with self.assertNumQueries(1):
+            get_user_actions(re_user)
+
+        # urgency follows the clock without recomputing the actions
+        with mock.patch("defects.actions.now", return_value=now() + timedelta(hours=30)), self.assertNumQueries(1):
+            self.assertEqual(get_user_actions(re_user)[0].urgency, Urgency.WARNING)
+
+        incident.notification_time_published = now()
+        incident.save()
+        approval = Approval.objects.create(incident=incident, user=sem_user, created_by=re_user, role=Approval.SECTION_ENGINEERING_MANAGER, type=Approval.NOTIFICATION)
+        self.assertEqual(get_user_actions(re_user), [])
+        self.assertEqual([a.message for a in get_user_actions(sem_user)], ["Review 48H Notification"])
+
+        approval.outcome = Approval.REJECTED
+        approval.save()
+        self.assertEqual(get_user_actions(sem_user), [])
+        self.assertEqual([a.message for a in get_user_actions(re_user)], ["Resubmit Rejected 48H Notification"])
+
+
+    def test_add_solutions_is_due_without_becoming_urgent(self):
+        re_user = User.objects.get(username="reliability_engineer")
+        approved = now() - timedelta(days=30)
+        incident = Incident.objects.create(created_by=re_user, time_start=approved, time_end=approved, code=Incident.generate_incident_code("TEST"))
+        Incident.objects.filter(pk=incident.pk).update(notification_time_published=approved, close_out_time_published=approved, close_out_time_approved=approved)
+
+        actions = [a for a in compute_user_actions(re_user) if a.message == "Add Solutions"]
+        self.assertEqual([(a.urgency, a.time_required) for a in actions], [(Urgency.INFO, approved + timedelta(days=14))])
+
 
 class TestIncidentCalculations(TestCase):
     def test_notification_overdue(self):
@@ -112,3 +220,816 @@ class TestIncidentCalculations(TestCase):
         incident.notification_time_published = now()
         self.assertFalse(incident.notification_overdue)
 
+
+class TestIncidentListPagination(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", password="test")
+        self.client.force_login(self.user)
+        start = now() - timedelta(days=30)
+        incidents = [
+            Incident(code=f"TEST_RI_{ix}", time_start=start + timedelta(hours=ix // 2), time_end=start + timedelta(hours=ix // 2))
+            for ix in range(25)
+        ]
+        incidents.append(Incident(code="TEST_RI_NULL"))
+        Incident.objects.bulk_create(incidents)
+
+    def test_keyset_pages_cover_all_incidents_in_order(self):
+        paginator = KeysetPaginator(Incident.objects.all(), field="time_start", per_page=10)
+
+        seen = []
+        page = paginator.page()
+        self.assertFalse(page.has_previous)
+        while True:
+            seen += [x.pk for x in page]
+            if not page.has_next:
+                break
+            page = paginator.page(page.next_token)
+
+        expected = list(Incident.objects.order_by(F("time_start").desc(nulls_last=True), "-pk").values_list("pk", flat=True))
+        self.assertEqual(seen, expected)
+
+        previous = paginator.page(page.previous_token)
+        self.assertEqual([x.pk for x in previous], expected[10:20])
+
+    def test_incident_list_view_paginates(self):
+        url = reverse("incident_list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total_count"], 26)
+        self.assertTrue(response.context["total_count_exact"])
+
+        response = self.client.get(url, {"cursor": "not-a-token"})
+        self.assertEqual(response.status_code, 200)
+
+
+class TestIncidentSearch(TestCase):
+    def setUp(self):
+        pump = Equipment.objects.create(code="PMP-001", name="Slurry Pump")
+        self.pump_incident = Incident.objects.create(
+            code="UG2_RI_2024_1", time_start=now(), time_end=now(), equipment=pump, short_description="Bearing failure"
+        )
+        self.motor_incident = Incident.objects.create(
+            code="UG2_RI_2024_2", time_start=now(), time_end=now(), short_description="Motor tripped", close_out_root_cause="Worn bearing"
+        )
+
+    def _search(self, query):
+        return list(search_incidents(Incident.objects.all(), query).order_by("-search_rank").values_list("pk", flat=True))
+
+    def test_search_matches_prefixes_across_fields(self):
+        self.assertEqual(self._search("slurry"), [self.pump_incident.pk])
+        self.assertEqual(self._search("motor trip"), [self.motor_incident.pk])
+        self.assertEqual(set(self._search("bear")), {self.pump_incident.pk, self.motor_incident.pk})
+        self.assertEqual(self._search("UG2_RI_2024_2"), [self.motor_incident.pk])
+        self.assertEqual(self._search("pump motor"), [])
+
+    def test_index_is_updated_on_save(self):
+        self.motor_incident.short_description = "Conveyor belt torn"
+        self.motor_incident.save()
+        self.assertEqual(self._search("conveyor"), [self.motor_incident.pk])
+        self.assertEqual(self._search("tripped"), [])
+
+    def test_index_is_updated_on_delete(self):
+        pk = self.motor_incident.pk
+        self.motor_incident.delete()
+        with connection.cursor() as c:
+            c.execute(f"SELECT COUNT(*) FROM {FTS_TABLE} WHERE rowid = %s", [pk])
+            self.assertEqual(c.fetchone()[0], 0)
+
+    def test_portable_index(self):
+        with mock.patch("defects.search.fts_available", return_value=False):
+            self.pump_incident.save()
+            self.motor_incident.save()
+            self.assertEqual(self._search("slurry"), [self.pump_incident.pk])
+            self.assertEqual(self._search("worn bear"), [self.motor_incident.pk])
+            self.assertEqual(set(self._search("bear")), {self.pump_incident.pk, self.motor_incident.pk})
+            # one index term matching several query terms
+            self.assertEqual(set(self._search("bear bearing")), {self.pump_incident.pk, self.motor_incident.pk})
+            self.assertEqual(self._search("worn wor"), [self.motor_incident.pk])
+
+    def test_incident_list_view_search(self):
+        self.client.force_login(User.objects.create_user(username="test", password="test"))
+        response = self.client.get(reverse("incident_list"), {"query": "slurry"})
+        self.assertEqual([x.pk for x in response.context["incidents"]], [self.pump_incident.pk])
+
+
+class TestEquipmentSearch(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", password="test")
+        self.client.force_login(self.user)
+        Equipment.objects.create(code="TUM-PMP-01", name="Slurry Pump 1")
+        Equipment.objects.create(code="TUM-PMP-010", name="Slurry Pump 10")
+        Equipment.objects.create(code="DSH-MTR-02", name="Main Pump Motor")
+
+    def _names(self, query):
+        response = self.client.get(reverse("equipment_search"), {"q": query})
+        return [x["name"] for x in response.json()["items"]]
+
+    def test_ranked_code_and_name_matches(self):
+        self.assertEqual(self._names("tum-pmp-01"), ["TUM-PMP-01 – Slurry Pump 1", "TUM-PMP-010 – Slurry Pump 10"])
+        self.assertEqual(self._names("main pump"), ["DSH-MTR-02 – Main Pump Motor"])
+        self.assertEqual(self._names("slurry pump"), ["TUM-PMP-01 – Slurry Pump 1", "TUM-PMP-010 – Slurry Pump 10"])
+        self.assertEqual(self._names("dsh"), ["DSH-MTR-02 – Main Pump Motor"])
+        # too short to search the names
+        self.assertEqual(self._names("mp"), [])
+        self.assertEqual(self._names("ds"), ["DSH-MTR-02 – Main Pump Motor"])
+        self.assertEqual(self._names(""), [])
+
+    def test_index_is_refreshed_when_equipment_changes(self):
+        self.assertEqual(self._names("winder"), [])
+        Equipment.objects.create(code="TUM-WND-01", name="Winder")
+        self.assertEqual(self._names("winder"), ["TUM-WND-01 – Winder"])
+
+        with self.assertNumQueries(0):
+            search_equipment("winder")
+
+
+class TestComplianceDashboard(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", password="test")
+        self.client.force_login(self.user)
+        area = Area.objects.create(name="UG2")
+        self.sections = [Section.objects.create(name=f"Section {ix}", area=area) for ix in range(5)]
+        self.quiet_section = Section.objects.create(name="Quiet", area=area)
+        for ix, section in enumerate(self.sections):
+            Incident.objects.create(
+                code=f"TEST_RI_{ix}",
+                section=section,
+                time_start=now() - timedelta(days=ix + 3),
+                time_end=now() - timedelta(days=ix + 2),
+                rand_value_loss=1000,
+            )
+
+    def test_section_stats(self):
+        stats = get_weekly_ri_count_for_sections(section_ids=[self.quiet_section.id])
+        self.assertEqual(sum(w["cnt"] for w in stats[self.sections[0].id]["ri_count"]), 1)
+        self.assertEqual(sum(w["rand_value_loss"] for w in stats[self.sections[0].id]["ri_count"]), 1000)
+        self.assertEqual(stats[self.sections[4].id]["ri_free_days"], 6)
+        self.assertEqual(len(stats[self.quiet_section.id]["ri_count"]), 53)
+        self.assertEqual(stats[self.quiet_section.id]["ri_free_days"], 0)
+
+    def test_query_count_is_independent_of_sections(self):
+        url = reverse("compliance_dashboard")
+        # session, user, rollup (the taxonomy is cached after the first request)
+        self.client.get(url)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Quiet")
+
+        # a new section shows up straight away
+        Section.objects.create(name="New Section", area=self.quiet_section.area)
+        self.assertContains(self.client.get(url + f"?area={self.quiet_section.area_id}"), "New Section")
+
+    def test_taxonomy_payload(self):
+        area = self.quiet_section.area
+        self.assertEqual(conditional_forms_payload()["sections"][str(area.id)], [str(s.id) for s in self.sections + [self.quiet_section]])
+        area.name = "Merensky"
+        area.save()
+        self.assertEqual(get_taxonomy().area_by_id[area.id].name, "Merensky")
+
+
+class TestTimeSeries(TestCase):
+    def test_bucket_boundaries_are_local(self):
+        end = datetime(2024, 2, 29, 23, 30, tzinfo=timezone.utc)  # 2024-03-01 01:30 in Johannesburg
+
+        buckets = Buckets.ending(MONTH, 3, end=end)
+        self.assertEqual(buckets.starts, [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)])
+        self.assertEqual(buckets.date_bounds[-1], date(2024, 4, 1))
+        self.assertEqual(buckets.datetime_bounds[0], datetime(2023, 12, 31, 22, 0, tzinfo=timezone.utc))
+
+        self.assertEqual(Buckets.ending(QUARTER, 2, end=end).labels, ["2023-Q4", "2024-Q1"])
+        self.assertEqual(Buckets.ending(WEEK, 1, end=end).starts, [date(2024, 2, 26)])
+        self.assertEqual(Buckets.ending(DAY, 1, end=end).starts, [date(2024, 3, 1)])
+
+    def test_series_buckets_by_local_time(self):
+        midnight = datetime.combine(localdate(now(), LOCAL_TZ), datetime.min.time(), tzinfo=LOCAL_TZ)
+        Incident.objects.create(code="TEST_RI_1", time_start=midnight + timedelta(minutes=1), rand_value_loss=10)
+        Incident.objects.create(code="TEST_RI_2", time_start=midnight - timedelta(minutes=1), rand_value_loss=5)
+
+        series = get_ri_series(DAY, 3)
+        self.assertEqual([row["cnt"] for row in series], [0, 1, 1])
+        self.assertEqual([row["rand_value_loss"] for row in series], [0, 5, 10])
+
+
+class TestIncidentRollup(TestCase):
+    def setUp(self):
+        self.area = Area.objects.create(name="UG2")
+        self.section = Section.objects.create(name="Tumela", area=self.area)
+        self.other_section = Section.objects.create(name="Dishaba", area=self.area)
+
+    def _rollup_values(self):
+        return sorted(IncidentRollup.objects.values_list("section_id", "incident_count", "rand_value_loss"))
+
+    def test_rollup_follows_incident_changes(self):
+        # without an operation, so the key has a NULL dimension
+        incident = Incident.objects.create(code="TEST_RI_1", section=self.section, area=self.area, time_start=now(), rand_value_loss=100)
+        rollup = IncidentRollup.objects.get()
+        Incident.objects.create(code="TEST_RI_2", section=self.section, area=self.area, time_start=now(), rand_value_loss=50)
+        self.assertEqual(self._rollup_values(), [(self.section.id, 2, 150)])
+        # the row of a key is updated in place, and a second row for it is rejected
+        self.assertEqual(IncidentRollup.objects.get().pk, rollup.pk)
+        rollup.pk = None
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            rollup.save()
+
+        incident.section = self.other_section
+        incident.save()
+        self.assertEqual(self._rollup_values(), [(self.section.id, 1, 50), (self.other_section.id, 1, 100)])
+
+        incident.delete()
+        self.assertEqual(self._rollup_values(), [(self.section.id, 1, 50)])
+
+    def test_rebuild_matches_incremental_rollup(self):
+        for ix in range(10):
+            Incident.objects.create(
+                code=f"TEST_RI_{ix}",
+                section=self.section if ix % 2 else self.other_section,
+                time_start=now() - timedelta(days=ix * 20),
+                time_anniversary_reviewed=now() if ix % 3 == 0 else None,
+                anniversary_success=ix % 2 == 0,
+                rand_value_loss=ix * 100,
+            )
+        fields = [f.name for f in IncidentRollup._meta.fields if f.name != "id"]
+        incremental = sorted(IncidentRollup.objects.values_list(*fields))
+        rebuild_rollup()
+        self.assertEqual(sorted(IncidentRollup.objects.values_list(*fields)), incremental)
+
+        value_series = get_ri_value_series(MONTH, 12)
+        self.assertEqual(sum(row["cnt"] for row in value_series), 4)
+        self.assertEqual(sum(row["rand_value"] for row in value_series), 0 - 300 + 600 - 900)
+
+
+class TestIncidentStatusRefresh(TestCase):
+    def test_incidents_become_overdue_when_deadlines_pass(self):
+        start = now()
+        notification = Incident.objects.create(code="TEST_RI_1", time_start=start - timedelta(hours=50), time_end=start - timedelta(hours=47))
+        rca_report = Incident.objects.create(
+            code="TEST_RI_2", time_start=start - timedelta(days=14), time_end=start - timedelta(days=14), notification_time_published=start - timedelta(days=13)
+        )
+        Incident.objects.create(code="TEST_RI_3", time_start=start, time_end=start)
+        self.assertEqual(set(Incident.objects.values_list("status", flat=True)), {Incident.ACTIVE})
+
+        # the first run checks everything and records the watermark
+        self.assertEqual(refresh_statuses(until=start), (3, 0))
+
+        # only incidents with a deadline since the previous run are checked
+        self.assertEqual(refresh_statuses(until=start + timedelta(hours=2)), (1, 1))
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, Incident.OVERDUE)
+
+        self.assertEqual(refresh_statuses(until=start + timedelta(days=3)), (2, 2))
+        rca_report.refresh_from_db()
+        self.assertEqual(rca_report.status, Incident.OVERDUE)
+        self.assertEqual(IncidentRollup.objects.aggregate(active=Sum("active_count"))["active"], 0)
+
+
+class TestIncidentDetail(TestCase):
+    fixtures = [
+        "defects/fixtures/groups.json",
+        "defects/fixtures/users.json",
+    ]
+
+    def setUp(self):
+        self.re_user = User.objects.get(username="reliability_engineer")
+        self.sem_user = User.objects.get(username="section_engineering_manager")
+        self.client.force_login(self.re_user)
+        self.incident = Incident.objects.create(
+            created_by=self.re_user,
+            time_start=now(),
+            time_end=now(),
+            notification_time_published=now(),
+            rca_report_time_published=now(),
+            report_file="files/rca.pdf",
+            close_out_time_published=now(),
+            code=Incident.generate_incident_code("TEST"),
+        )
+
+    def _add_approvals(self, count):
+        for ix in range(count):
+            for approval_type in (Approval.NOTIFICATION, Approval.RCA, Approval.CLOSE_OUT):
+                Approval.objects.create(
+                    incident=self.incident,
+                    user=self.sem_user,
+                    created_by=self.re_user,
+                    role=Approval.SECTION_ENGINEERING_MANAGER,
+                    type=approval_type,
+                    outcome=Approval.REJECTED,
+                    score=ix % 2,
+                )
+            Solution.objects.create(incident=self.incident, description=f"Solution {ix}")
+
+    def test_query_count_is_independent_of_approval_history(self):
+        url = reverse("incident_detail", args=[self.incident.pk])
+
+        self._add_approvals(1)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertContains(response, "48-hour notification report rejected by SEM")
+
+        self._add_approvals(10)
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertContains(response, "Resubmit RCA Report")
+
+
+class TestIncidentCodeSequence(TestCase):
+    def test_codes_are_allocated_in_sequence(self):
+        year = now().strftime("%Y")
+        Incident.objects.create(code=f"UG2_RI_{year}_7", time_start=now())
+        Incident.objects.create(code=f"UG2_RI_{year}_12_draft", time_start=now())
+
+        # continues after existing codes
+        self.assertEqual(Incident.generate_incident_code("UG2"), f"UG2_RI_{year}_8")
+        # update and select, in a savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(Incident.generate_incident_code("UG2"), f"UG2_RI_{year}_9")
+        self.assertEqual(Incident.generate_incident_code("UG2", incident_type="PI"), f"UG2_PI_{year}_1")
+        self.assertEqual(Incident.generate_incident_code("MER"), f"MER_RI_{year}_1")
+
+    def test_backfill_command(self):
+        Incident.objects.create(code="UG2_RI_2023_4", time_start=now())
+        Incident.objects.create(code="UG2_RI_2023_11", time_start=now())
+        Incident.objects.create(code="TEST_RI_2023_3", time_start=now())
+        IncidentCodeSequence.objects.create(area_code="TEST", incident_type="RI", year=2023, last_value=5)
+
+        call_command("backfill_incident_code_sequences", stdout=io.StringIO())
+
+        self.assertEqual(IncidentCodeSequence.allocate("UG2", "RI", 2023), 12)
+        self.assertEqual(IncidentCodeSequence.allocate("TEST", "RI", 2023), 6)
+
+
+class TestResourcePrice(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com")
+        for days, rate in [(30, "100.00"), (20, "200.00"), (10, "300.00")]:
+            price = ResourcePrice.objects.create(rate=Decimal(rate), created_by=self.user)
+            ResourcePrice.objects.filter(pk=price.pk).update(time_created=now() - timedelta(days=days))
+        # the updates above bypass the signals
+        bump_version("resource_price")
+
+    def test_prices_are_cached_until_a_price_is_saved(self):
+        self.assertEqual(ResourcePrice.current().rate, Decimal("300.00"))
+        with self.assertNumQueries(0):
+            self.assertEqual(ResourcePrice.current().created_by.email, "test@example.com")
+            self.assertEqual(ResourcePrice.at(now() - timedelta(days=40)).rate, Decimal("100.00"))
+            self.assertEqual(ResourcePrice.at(now() - timedelta(days=15)).rate, Decimal("200.00"))
+            self.assertEqual(ResourcePrice.rand_cost(Decimal("2.5"), when=now() - timedelta(days=25)), Decimal("250.00"))
+
+        ResourcePrice.objects.create(rate=Decimal("400.00"), created_by=self.user)
+        self.assertEqual(ResourcePrice.rand_cost(Decimal("2")), Decimal("800.00"))
+
+    def test_loss_is_valued_at_the_price_when_the_incident_started(self):
+        incident = Incident.objects.create(code="TEST_RI_1", short_description="Belt tear", time_start=now() - timedelta(days=25))
+
+        def rand_value_loss(resource_price):
+            data = {"short_description": incident.short_description, "time_start": incident.time_start, "production_value_loss": "2"}
+            form = IncidentUpdateForm({**data, "resource_price": resource_price}, instance=incident)
+            form.full_clean()
+            return form.cleaned_data["rand_value_loss"]
+
+        self.assertEqual(rand_value_loss("300.00"), Decimal("200.00"))
+        # a new price entered with the incident is used as it is
+        self.assertEqual(rand_value_loss("350.00"), Decimal("700.00"))
+
+
+class TestExports(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com", first_name="Test", last_name="User")
+        self.client.force_login(self.user)
+        self.area = Area.objects.create(name="Area 1", code="A1")
+        self.section = Section.objects.create(name="Section 1", area=self.area)
+        self.equipment = Equipment.objects.create(code="EQ-001", name="Pump")
+        for ix in range(5):
+            Incident.objects.create(
+                code=f"TEST_RI_2024_{ix}",
+                time_start=now() - timedelta(days=ix),
+                created_by=self.user,
+                area=self.area if ix % 2 else None,
+                section=self.section if ix % 2 else None,
+                equipment=self.equipment,
+            )
+
+    def test_incident_export_is_streamed(self):
+        response = self.client.get(reverse("incident_list_export"))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("TEST_RI_2024_4", content)
+
+    def test_register_export_is_filtered_and_denormalized(self):
+        incident = Incident.objects.get(code="TEST_RI_2024_1")
+        Solution.objects.create(incident=incident, description="Replace pump", timeframe=Solution.SHORT_TERM)
+        Solution.objects.create(incident=incident, description="Redesign", timeframe=Solution.LONG_TERM)
+
+        url = reverse("incident_list_export") + f"?section={self.section.pk}&columns=code,section,equipment_code,created_by"
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(
+            rows,
+            [
+                ["RI No.", "Section", "Functional Location", "Reliability Engineer"],
+                ["TEST_RI_2024_1", "Section 1", "EQ-001", "Test User"],
+                ["TEST_RI_2024_3", "Section 1", "EQ-001", "Test User"],
+            ],
+        )
+
+        response = self.client.get(reverse("solution_list_export") + f"?timeframe={Solution.LONG_TERM}&columns=incident,description,area")
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows, [["RI No.", "Solution Description", "Area"], ["TEST_RI_2024_1", "Redesign", "Area 1"]])
+
+        response = self.client.get(reverse("incident_list_export") + "?columns=code,password")
+        self.assertEqual(response.status_code, 400)
+
+    def test_register_excel_export_has_typed_cells(self):
+        Incident.objects.filter(code="TEST_RI_2024_0").update(rand_value_loss=Decimal("1234.50"))
+
+        response = self.client.get(reverse("incident_list_export") + "?format=xlsx&columns=code,time_start,rand_value_loss,significant")
+        self.assertEqual(response["Content-Type"], "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as workbook:
+            sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+
+        self.assertEqual(sheet.count("<row "), 6)
+        self.assertIn("<t>TEST_RI_2024_0</t>", sheet)
+        # the value is a number and the start time a date serial number, not text
+        self.assertIn("<v>1234.50</v>", sheet)
+        self.assertRegex(sheet, r'<c r="B2" s="\d+"><v>\d+\.\d+</v></c>')
+        self.assertIn('<c r="D2" t="b"><v>1</v></c>', sheet)
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_analytics_export_has_typed_columns(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        Incident.objects.filter(code="TEST_RI_2024_1").update(rand_value_loss=Decimal("1234.50"))
+
+        fp = io.BytesIO()
+        self.assertEqual(write_dataset(fp, "incidents", batch_size=2), 5)
+        fp.seek(0)
+        parquet = pyarrow.parquet.ParquetFile(fp)
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+
+        table = parquet.read(columns=["code", "time_start", "rand_value_loss", "section_name"])
+        self.assertEqual(table.schema.field("time_start").type, pyarrow.timestamp("us", tz="UTC"))
+        self.assertEqual(table.schema.field("rand_value_loss").type, pyarrow.decimal128(20, 2))
+        rows = {x["code"]: x for x in table.to_pylist()}
+        self.assertEqual(rows["TEST_RI_2024_1"]["rand_value_loss"], Decimal("1234.50"))
+        self.assertEqual(rows["TEST_RI_2024_1"]["section_name"], "Section 1")
+        self.assertIsNone(rows["TEST_RI_2024_0"]["section_name"])
+
+        response = self.client.get(reverse("analytics_export", args=["solutions"]) + "?format=arrow")
+        self.assertEqual(response.status_code, 200)
+        with pyarrow.ipc.open_file(io.BytesIO(b"".join(response.streaming_content))) as reader:
+            self.assertIn("incident_code", reader.schema.names)
+
+    def test_analytics_command_removes_partial_files(self):
+        def fail(fp, name, file_format):
+            fp.write(b"partial")
+            raise ImproperlyConfigured("pyarrow is missing")
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with mock.patch("defects.management.commands.export_analytics.write_dataset", side_effect=fail), self.assertRaises(CommandError):
+            call_command("export_analytics", output_dir, stdout=io.StringIO())
+        self.assertEqual(os.listdir(output_dir), [])
+
+
+class TestEquipmentImport(TestCase):
+    def setUp(self):
+        Equipment.objects.create(code="FL-001", name="Pump")
+        Equipment.objects.create(code="FL-002", name="Fan")
+        self.incident = Incident.objects.create(code="TEST_RI_2024_1", time_start=now(), equipment=Equipment.objects.get(code="FL-001"))
+
+    def test_import_creates_and_renames_equipment(self):
+        self.assertEqual([x.code for x in search_equipment("FL-")], ["FL-001", "FL-002"])
+        extract = io.StringIO("Functional Location,Description\nFL-001,Slurry Pump\nFL-002,Fan\nFL-003,Conveyor\n,Missing code\nFL-003,Conveyor Belt\n")
+
+        # load, write in batches and bump the typeahead version, regardless of the number of rows
+        with self.assertNumQueries(9):
+            result = import_equipment(read_rows(extract), batch_size=100)
+
+        self.assertEqual((result.created, result.updated, result.unchanged, result.skipped), (1, 1, 1, 1))
+        self.assertEqual(dict(Equipment.objects.values_list("code", "name")), {"FL-001": "Slurry Pump", "FL-002": "Fan", "FL-003": "Conveyor Belt"})
+        # the typeahead and the incident search see the new names
+        self.assertEqual([x.code for x in search_equipment("FL-")], ["FL-001", "FL-002", "FL-003"])
+        self.assertEqual(list(search_incidents(Incident.objects.all(), "slurry")), [self.incident])
+
+    def test_admin_bulk_import(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", email="admin@example.com"))
+        url = reverse("admin:defects_equipment_bulk_import")
+        self.assertContains(self.client.get(reverse("admin:defects_equipment_changelist")), url)
+
+        extract = SimpleUploadedFile("extract.csv", b"Functional Location,Description\nFL-004,Crusher\n")
+        response = self.client.post(url, {"file": extract, "dry_run": "on"})
+        self.assertRedirects(response, reverse("admin:defects_equipment_changelist"))
+        self.assertFalse(Equipment.objects.filter(code="FL-004").exists())
+
+        extract = SimpleUploadedFile("extract.csv", b"Functional Location,Description\nFL-004,Crusher\n")
+        self.client.post(url, {"file": extract})
+        self.assertTrue(Equipment.objects.filter(code="FL-004").exists())
+
+        response = self.client.post(url, {"file": SimpleUploadedFile("extract.csv", b"code\nFL-005\n")})
+        self.assertContains(response, "The file needs a code")
+
+
+class TestChangeFeed(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com")
+        self.client.force_login(self.user)
+        self.start = now() - timedelta(days=1)
+        for ix in range(5):
+            incident = Incident.objects.create(code=f"TEST_RI_2024_{ix}", time_start=now())
+            Incident.objects.filter(pk=incident.pk).update(time_modified=self.start + timedelta(hours=ix))
+
+    def _sync(self, since, limit):
+        codes, deleted = [], []
+        while True:
+            page = changes("incidents", since, limit=limit)
+            codes += [x["code"] for x in page.rows]
+            deleted += page.deleted
+            since = page.watermark
+            if not page.has_more:
+                return codes, deleted, since
+
+    def test_feed_returns_changes_after_watermark(self):
+        codes, deleted, watermark = self._sync(None, limit=2)
+        self.assertEqual(codes, [f"TEST_RI_2024_{ix}" for ix in range(5)])
+        self.assertEqual(Watermark.parse(str(watermark)), watermark)
+
+        # nothing changed
+        self.assertEqual(self._sync(watermark, limit=2)[:2], ([], []))
+
+        incident = Incident.objects.get(code="TEST_RI_2024_1")
+        incident.short_description = "Changed"
+        incident.save()
+        deleted_pk = Incident.objects.get(code="TEST_RI_2024_3").pk
+        Incident.objects.filter(code="TEST_RI_2024_3").delete()
+        # changes in the last minute are left for the next call
+        self.assertEqual(self._sync(watermark, limit=2)[:2], ([], []))
+
+        with mock.patch("defects.changes.now", return_value=now() + timedelta(minutes=2)):
+            codes, deleted, _ = self._sync(watermark, limit=2)
+        self.assertEqual(codes, ["TEST_RI_2024_1"])
+        self.assertEqual(deleted, [deleted_pk])
+
+    def test_feed_endpoint(self):
+        response = self.client.get(reverse("change_feed", args=["incidents"]) + "?limit=3")
+        data = response.json()
+        self.assertEqual(len(data["rows"]), 3)
+        self.assertTrue(data["has_more"])
+
+        response = self.client.get(reverse("change_feed", args=["incidents"]) + f"?since={data['watermark']}")
+        data = response.json()
+        self.assertEqual([x["code"] for x in data["rows"]], ["TEST_RI_2024_3", "TEST_RI_2024_4"])
+        self.assertFalse(data["has_more"])
+
+        self.assertEqual(self.client.get(reverse("change_feed", args=["incidents"]) + "?since=yesterday").status_code, 400)
+
+
+def _fake_pdf(markup):
+    # WeasyPrint needs system libraries that are not available everywhere, the rendering itself is not under test
+    return b"%PDF-" + hashlib.sha256(markup.encode()).hexdigest().encode()
+
+
+class TestPdfCache(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com")
+        self.client.force_login(self.user)
+        self.incident = Incident.objects.create(code="TEST_RI_2024_1", short_description="Pump failure", time_start=now())
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def _get_pdf(self):
+        response = self.client.get(reverse("incident_anniversary_pdf", args=[self.incident.pk]))
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        return b"".join(response.streaming_content)
+
+    def test_pdf_is_rendered_again_only_when_the_incident_changes(self):
+        with self.settings(PDF_CACHE_DIR=self.cache_dir), mock.patch("defects.renderer._render", side_effect=_fake_pdf) as write_pdf:
+            pdf = self._get_pdf()
+            self.assertEqual(self._get_pdf(), pdf)
+            self.assertEqual(write_pdf.call_count, 1)
+
+            Solution.objects.create(incident=self.incident, description="Replace bearings")
+            self.assertNotEqual(self._get_pdf(), pdf)
+            self.assertEqual(write_pdf.call_count, 2)
+            self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_least_recently_used_pdfs_are_evicted(self):
+        with self.settings(PDF_CACHE_DIR=self.cache_dir, PDF_CACHE_MAX_BYTES=100), mock.patch("defects.renderer._render", side_effect=_fake_pdf):
+            self._get_pdf()
+            self.incident.short_description = "Pump bearing failure"
+            self.incident.save()
+            self._get_pdf()
+            # each file is 69 bytes
+            self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_pdfs_are_rendered_in_process_without_a_pool(self):
+        with mock.patch("defects.renderer._render", side_effect=_fake_pdf) as render_in_process:
+            for settings in [{"PDF_RENDER_PROCESSES": 0, "PDF_JOBS": True}, {"PDF_RENDER_PROCESSES": 2, "PDF_JOBS": False}]:
+                with self.settings(**settings):
+                    self.assertEqual(renderer.render("<html></html>"), _fake_pdf("<html></html>"))
+                    self.assertTrue(renderer.submit("<html></html>").done())
+            self.assertEqual(render_in_process.call_count, 4)
+        self.assertIsNone(renderer._executor)
+
+    def test_render_errors_are_raised(self):
+        with self.settings(PDF_CACHE_DIR=self.cache_dir, PDF_RENDER_PROCESSES=0), mock.patch("defects.renderer._render", side_effect=ValueError("bad markup")):
+            with self.assertRaisesMessage(ValueError, "bad markup"):
+                render_pdf("<html></html>")
+            # no partial file is left in the cache
+            self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class TestPrintRenditions(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.incident = Incident.objects.create(code="TEST_RI_2024_1", time_start=now())
+
+    def _image(self, size, file_format):
+        out = io.BytesIO()
+        PILImage.new("RGB", size, "red").save(out, file_format)
+        return IncidentImage.objects.create(incident=self.incident, image=SimpleUploadedFile(f"photo.{file_format.lower()}", out.getvalue()))
+
+    def test_large_images_are_scaled_down_once(self):
+        image = self._image((4000, 3000), "JPEG")
+        name = print_rendition(image.image.name)
+        self.assertEqual(name, rendition_name(image.image.name))
+        with default_storage.open(name) as fp, PILImage.open(fp) as rendition:
+            self.assertEqual(rendition.size, (1600, 1200))
+        with mock.patch("defects.renditions._render") as render:
+            self.assertEqual(print_rendition(image.image.name), name)
+            self.assertFalse(render.called)
+
+        image.delete()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_small_images_are_used_as_they_are(self):
+        image = self._image((800, 600), "PNG")
+        self.assertEqual(print_rendition(image.image.name), image.image.name)
+
+
+class TestPdfJobs(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com")
+        self.client.force_login(self.user)
+        self.incident = Incident.objects.create(code="TEST_RI_2024_1", created_by=self.user, time_start=now())
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, PDF_CACHE_DIR=os.path.join(media_root, "pdf-cache"), PDF_JOBS=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch("defects.renderer._render", side_effect=_fake_pdf)
+        self.write_pdf = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pdf_is_rendered_by_the_worker(self):
+        url = reverse("incident_close_pdf", args=[self.incident.pk])
+        response = self.client.get(url)
+        job = PdfJob.objects.get()
+        self.assertRedirects(response, reverse("pdf_job_detail", args=[job.pk]), fetch_redirect_response=False)
+        self.assertContains(self.client.get(reverse("pdf_job_detail", args=[job.pk])), "being created")
+        self.assertEqual(self.client.get(reverse("pdf_job_status", args=[job.pk])).json()["status"], PdfJob.PENDING)
+        # the same report is not queued twice
+        self.client.get(url)
+        self.assertEqual(PdfJob.objects.count(), 1)
+        self.assertFalse(self.write_pdf.called)
+
+        call_command("run_pdf_worker", stdout=io.StringIO())
+
+        status = self.client.get(reverse("pdf_job_status", args=[job.pk])).json()
+        self.assertEqual(status["status"], PdfJob.DONE)
+        response = self.client.get(status["download_url"])
+        self.assertEqual(response["Content-Disposition"], f'inline; filename="close-{self.incident.code}.pdf"')
+        pdf = b"".join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b"%PDF-"))
+
+        # rendered reports are served from the cache without a job
+        response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), pdf)
+        self.assertEqual(PdfJob.objects.count(), 1)
+        self.assertEqual(self.write_pdf.call_count, 1)
+
+    def test_failed_job_is_shown(self):
+        job = enqueue(PdfJob.CLOSE_OUT, self.incident, self.user)
+        self.write_pdf.side_effect = ValueError("Broken image")
+        call_command("run_pdf_worker", stdout=io.StringIO())
+        self.assertEqual(PdfJob.objects.get().status, PdfJob.FAILED)
+        self.assertContains(self.client.get(reverse("pdf_job_detail", args=[job.pk])), "could not be created")
+
+    def test_jobs_are_claimed_once(self):
+        job = enqueue(PdfJob.ANNIVERSARY, self.incident, self.user)
+        self.assertEqual(claim_next(), job)
+        self.assertIsNone(claim_next())
+
+        # a job of a worker that stopped is claimed again
+        PdfJob.objects.filter(pk=job.pk).update(time_started=now() - timedelta(hours=1))
+        self.assertEqual(claim_next(), job)
+
+
+def _blank_pdf(markup):
+    writer = PdfWriter()
+    writer.add_blank_page(width=200, height=100)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class TestIncidentPacks(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="test@example.com")
+        self.client.force_login(self.user)
+        area = Area.objects.create(name="UG2")
+        start = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        closed = start + timedelta(days=10)
+        for ix in range(3):
+            Incident.objects.create(
+                code=f"TEST_RI_2024_{ix}", area=area, created_by=self.user, time_start=start + timedelta(days=ix), close_out_time_published=closed
+            )
+        # outside of the date range and in another area
+        Incident.objects.create(code="TEST_RI_2024_3", area=area, created_by=self.user, time_start=start + timedelta(days=40), close_out_time_published=closed)
+        Incident.objects.create(code="TEST_RI_2024_4", created_by=self.user, time_start=start, close_out_time_published=closed)
+        # not closed out, and closed out by a deleted user
+        Incident.objects.create(code="TEST_RI_2024_5", area=area, created_by=self.user, time_start=start)
+        Incident.objects.create(code="TEST_RI_2024_6", area=area, time_start=start, close_out_time_published=closed)
+        self.filters = f"area={area.pk}&start=2024-03-01&end=2024-03-31"
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root, PDF_CACHE_DIR=os.path.join(media_root, "pdf-cache"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch("defects.renderer._render", side_effect=_blank_pdf)
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_zip_is_streamed(self):
+        response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=close_out&pack=zip")
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), [f"close-TEST_RI_2024_{ix}.pdf" for ix in range(3)])
+        self.assertEqual(self.render.call_count, 3)
+
+    def test_merged_pdf_has_a_bookmark_per_incident(self):
+        response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=close_out&pack=pdf")
+        reader = PdfReader(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(len(reader.pages), 3)
+        self.assertEqual([x.title for x in reader.outline], [f"close-TEST_RI_2024_{ix}" for ix in range(3)])
+
+    def test_incidents_without_the_report_are_left_out(self):
+        area = Area.objects.get()
+        section = Section.objects.create(name="Section", area=area)
+        published = datetime(2024, 3, 5, tzinfo=timezone.utc)
+        Incident.objects.create(code="TEST_RI_2024_7", short_description="Belt tear", area=area, section=section, time_start=published, notification_time_published=published)
+        # published before sections were required
+        Incident.objects.create(code="TEST_RI_2024_8", area=area, time_start=published, notification_time_published=published)
+        response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=notification&pack=zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), [f"AMB 48H RI - {section.code} - Belt tear - (05.03.2024).pdf"])
+
+    def test_large_packs_need_pdf_jobs(self):
+        with mock.patch("defects.views.PACK_SYNC_MAX_INCIDENTS", 2):
+            response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=close_out&pack=zip")
+            self.assertEqual(response.status_code, 400)
+            with self.settings(PDF_JOBS=True):
+                response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=close_out&pack=zip")
+            self.assertEqual(response.status_code, 302)
+        self.render.assert_not_called()
+
+    def test_pack_job_reports_progress(self):
+        with self.settings(PDF_JOBS=True):
+            response = self.client.get(reverse("incident_pack") + f"?{self.filters}&kind=close_out&pack=zip")
+        job = PdfJob.objects.get()
+        self.assertRedirects(response, reverse("pdf_job_detail", args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual((job.pack, job.total), (PdfJob.ZIP, 3))
+
+        call_command("run_pdf_worker", stdout=io.StringIO())
+        status = self.client.get(reverse("pdf_job_status", args=[job.pk])).json()
+        self.assertEqual((status["status"], status["progress"], status["total"]), (PdfJob.DONE, 3, 3))
+        self.assertEqual(self.client.get(status["download_url"])["Content-Type"], "application/zip")
+
+        self.assertEqual(self.client.get(reverse("incident_pack") + "?kind=close_out&pack=docx").status_code, 400)
+
+    def test_pack_job_taken_over_by_another_worker_is_not_overwritten(self):
+        enqueue_pack(PdfJob.CLOSE_OUT, PdfJob.ZIP, self.filters, 3, self.user)
+        first = claim_next()
+        # the first worker looks stale, e.g. it was paused, and a second worker claims the job
+        first.time_started = now() - timedelta(hours=1)
+        PdfJob.objects.filter(pk=first.pk).update(time_started=first.time_started)
+        second = claim_next()
+        self.assertEqual(second.pk, first.pk)
+
+        # the first worker finds out at its next update and leaves the job to the second
+        run_job(first)
+        self.assertEqual(PdfJob.objects.get().status, PdfJob.RUNNING)
+        run_job(second)
+        job = PdfJob.objects.get()
+        self.assertEqual((job.status, job.progress), (PdfJob.DONE, 3))
+        run_job(first)
+        self.assertEqual(PdfJob.objects.get().file.name, job.file.name)
+        self.assertEqual(os.listdir(os.path.dirname(job.file.path)), [os.path.basename(job.file.name)])
+
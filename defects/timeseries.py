@@ -0,0 +1,137 @@
+"""
+Database independent time bucketing.
+
+Bucket boundaries are calculated in Python in local time and every bucket is matched with
+plain range predicates on the time column (`field >= start AND field < end`). This avoids
+applying date functions to the column, so indexes on it can be used, and it produces the
+same SQL on SQLite, PostgreSQL and MS SQL Server.
+"""
+
+import zoneinfo
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Case, When, Value, IntegerField
+from django.utils.timezone import now
+
+LOCAL_TZ = zoneinfo.ZoneInfo("Africa/Johannesburg")
+
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+QUARTER = "quarter"
+
+GRANULARITY_CHOICES = (DAY, WEEK, MONTH, QUARTER)
+
+
+def _bucket_start(d: date, granularity: str) -> date:
+    if granularity == DAY:
+        return d
+    if granularity == WEEK:
+        return d - timedelta(days=d.weekday())
+    if granularity == MONTH:
+        return d.replace(day=1)
+    if granularity == QUARTER:
+        return d.replace(month=3 * ((d.month - 1) // 3) + 1, day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def _add(d: date, granularity: str, n: int) -> date:
+    if granularity == DAY:
+        return d + timedelta(days=n)
+    if granularity == WEEK:
+        return d + timedelta(weeks=n)
+    months = n if granularity == MONTH else 3 * n
+    month_index = d.year * 12 + d.month - 1 + months
+    return d.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def _label(d: date, granularity: str) -> str:
+    if granularity == DAY:
+        return d.strftime("%Y-%m-%d")
+    if granularity == WEEK:
+        return d.strftime("%Y-%W")
+    if granularity == MONTH:
+        return d.strftime("%Y-%m")
+    return f"{d.year}-Q{(d.month - 1) // 3 + 1}"
+
+
+@dataclass
+class Buckets:
+    """
+    `count` consecutive buckets, the last one containing `end`.
+    """
+
+    granularity: str
+    starts: list[date]
+    tz: zoneinfo.ZoneInfo = LOCAL_TZ
+
+    @classmethod
+    def ending(cls, granularity: str, count: int, end: datetime = None, tz=LOCAL_TZ):
+        end = end or now()
+        last = _bucket_start(end.astimezone(tz).date(), granularity)
+        starts = [_add(last, granularity, -n) for n in range(count - 1, -1, -1)]
+        return cls(granularity=granularity, starts=starts, tz=tz)
+
+    @property
+    def date_bounds(self) -> list[date]:
+        # one more boundary than there are buckets
+        return self.starts + [_add(self.starts[-1], self.granularity, 1)]
+
+    @property
+    def datetime_bounds(self) -> list[datetime]:
+        return [datetime.combine(d, time.min, tzinfo=self.tz) for d in self.date_bounds]
+
+    @property
+    def labels(self) -> list[str]:
+        return [_label(d, self.granularity) for d in self.starts]
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def bucket_rows(queryset, field: str, buckets: Buckets, aggregates: dict, group_by=(), restrict=True):
+    """
+    Aggregates `queryset` per bucket of `field` (and per `group_by` fields) in one query.
+
+    Each returned row has a `bucket` index into `buckets.starts`. With `restrict=False` rows
+    outside the buckets are not filtered out but aggregated with `bucket=None`, which is
+    useful when "all time" aggregates are needed in the same pass.
+    """
+    is_date = queryset.model._meta.get_field(field).get_internal_type() == "DateField"
+    bounds = buckets.date_bounds if is_date else buckets.datetime_bounds
+
+    whens = [When(**{f"{field}__gte": bounds[ix], f"{field}__lt": bounds[ix + 1]}, then=Value(ix)) for ix in range(len(buckets))]
+    bucket = Case(*whens, default=None, output_field=IntegerField())
+
+    if restrict:
+        queryset = queryset.filter(**{f"{field}__gte": bounds[0], f"{field}__lt": bounds[-1]})
+
+    return queryset.annotate(bucket=bucket).values("bucket", *group_by).annotate(**aggregates).order_by()
+
+
+def fill_series(rows, buckets: Buckets, names, group_by=None):
+    """
+    Turns rows from `bucket_rows` into complete series with a zero for every empty bucket.
+
+    Returns a list of dicts (one per bucket, with `label` and `start`) or, when `group_by`
+    is given, a dict of such lists keyed by the value of the `group_by` field.
+    """
+
+    def empty_series():
+        return [{"label": label, "start": start, **{n: 0 for n in names}} for label, start in zip(buckets.labels, buckets.starts)]
+
+    series = {}
+    for row in rows:
+        if row["bucket"] is None:
+            continue
+        key = row[group_by] if group_by else None
+        if key not in series:
+            series[key] = empty_series()
+        target = series[key][row["bucket"]]
+        for n in names:
+            target[n] = row[n] or 0
+
+    if group_by is None:
+        return series.get(None) or empty_series()
+    return series
@@ -28,6 +28,7 @@ urlpatterns = [
     path("incidents/filter/", views.incident_list_filter, name="incident_list_filter"),
     path("incidents/create/", views.incident_create, name="incident_create"),
     path("incidents/export/", views.incident_list_export, name="incident_list_export"),
+    path("incidents/pack/", views.incident_pack, name="incident_pack"),
     path("incidents/<int:pk>/", views.incident_detail, name="incident_detail"),
     path("incidents/<int:pk>/edit/", views.incident_update, name="incident_update"),
     path("incidents/<int:pk>/images/", views.incident_images, name="incident_images"),
@@ -52,6 +53,11 @@ urlpatterns = [
     path("solutions/schedule/", views.solution_schedule, name="solution_schedule"),
     path("solutions/completion/", views.solution_completion, name="solution_completion"),
     path("solutions/export/", views.solution_list_export, name="solution_list_export"),
+    path("analytics/<str:dataset>/", views.analytics_export, name="analytics_export"),
+    path("changes/<str:feed>/", views.change_feed, name="change_feed"),
+    path("pdf-jobs/<int:pk>/", views.pdf_job_detail, name="pdf_job_detail"),
+    path("pdf-jobs/<int:pk>/status/", views.pdf_job_status, name="pdf_job_status"),
+    path("pdf-jobs/<int:pk>/download/", views.pdf_job_download, name="pdf_job_download"),
     path("images/<int:pk>/delete/", views.image_delete, name="image_delete"),
     path("images/<int:pk>/edit/", views.image_update, name="image_update"),
     path("about/", views.about, name="about"),
@@ -0,0 +1,74 @@
+"""
+Version stamps for per-process caches.
+
+Every gunicorn worker keeps its own in-memory copy of slow-changing data. When the
+underlying rows change, the version stamp in the database is bumped (see `defects.signals`)
+and each worker rebuilds its copy the next time it checks the stamp.
+"""
+
+import threading
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import CacheVersion
+
+# seconds between version checks, so cache hits do not query the database on every call
+CHECK_INTERVAL = 5
+
+_caches = []
+
+
+def get_version(name: str) -> int:
+    version = CacheVersion.objects.filter(name=name).values_list("version", flat=True).first()
+    return version or 0
+
+
+def bump_version(name: str):
+    updated = CacheVersion.objects.filter(name=name).update(version=F("version") + 1)
+    if not updated:
+        try:
+            with transaction.atomic():
+                CacheVersion.objects.create(name=name, version=1)
+        except IntegrityError:
+            CacheVersion.objects.filter(name=name).update(version=F("version") + 1)
+
+    # caches in this process are rebuilt straight away
+    for cache in _caches:
+        if cache.name == name:
+            cache.clear()
+
+
+class VersionedCache:
+    """
+    Lazily builds a value with `builder` and rebuilds it when the version stamp `name` changes.
+    """
+
+    def __init__(self, name: str, builder, check_interval=CHECK_INTERVAL):
+        self.name = name
+        self.builder = builder
+        self.check_interval = check_interval
+        self._value = None
+        self._version = None
+        self._time_checked = 0.0
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._time_checked = 0.0
+
+    def get(self):
+        if self._version is not None and time.monotonic() - self._time_checked < self.check_interval:
+            return self._value
+
+        with self._lock:
+            version = get_version(self.name)
+            if self._version != version:
+                self._value = self.builder()
+                self._version = version
+            self._time_checked = time.monotonic()
+            return self._value
@@ -1,27 +1,32 @@
 import json
 import random
+import tempfile
 from datetime import timedelta
 
 from auditlog.models import LogEntry
 from auditlog.signals import accessed
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.views import LoginView as BaseLoginView, LogoutView as BaseLogoutView
 from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
-from django.db.models import Q, Prefetch, OuterRef, Subquery, Value
-from django.db.models.aggregates import Count
+from django.db.models import Prefetch, Value
+from django.db.models.aggregates import Count, Sum
 from django.forms import modelformset_factory, modelform_factory, Textarea, Select
-from django.http import HttpResponseRedirect, JsonResponse, HttpResponse, HttpResponseForbidden, HttpResponseBadRequest
+from django.http import Http404, HttpResponseRedirect, JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse, HttpResponseForbidden, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.lorem_ipsum import words
 from django.utils.timezone import now
 from django.views.decorators.http import require_POST, require_GET
 
-from .exports import export_table_csv
-from .stats import get_weekly_ri_count_per_section, get_monthly_ri_value_per_area, get_weekly_ri_value_per_area
+from .analytics import DATASETS, FORMATS as ANALYTICS_FORMATS, write_dataset
+from .changes import FEEDS, PAGE_SIZE as CHANGE_FEED_PAGE_SIZE, Watermark, changes
+from .filters import filter_incidents, filter_solutions
+from .exports import INCIDENT_COLUMNS, SOLUTION_COLUMNS, select_columns, stream_rows_csv, write_rows_xlsx
+from .stats import get_weekly_ri_count_for_sections, get_monthly_ri_value_per_area, get_weekly_ri_value_per_area
 from .forms import (
     IncidentCreateForm,
     IncidentNotificationApprovalSendForm,
@@ -35,9 +40,16 @@ from .forms import (
     IncidentRCAApprovalSendForm,
     conditional_forms_payload,
 )
-from .models import Solution, Incident, Section, Equipment, IncidentImage, Approval, Area, Feedback, Operation, ResourcePrice
-from .actions import get_user_actions
-from .reports import render_pptx
+from .models import Solution, Incident, Equipment, IncidentImage, Approval, Feedback, ResourcePrice, IncidentRollup, PdfJob
+from .actions import get_user_actions, pending_approval_condition
+from .taxonomy import get_taxonomy
+from .reports import REPORTS, cached_pdf, render_pdf, render_pptx
+from .jobs import enqueue, enqueue_pack
+from .packs import CONTENT_TYPES as PACK_CONTENT_TYPES, MAX_INCIDENTS as PACK_MAX_INCIDENTS, SYNC_MAX_INCIDENTS as PACK_SYNC_MAX_INCIDENTS, pack_file_name, pack_incidents, stream_zip, write_pack
+from .pagination import KeysetPaginator, approximate_count
+from .equipment_index import search_equipment
+
+INCIDENT_LIST_PAGE_SIZE = 100
 
 
 def index(request):
@@ -51,10 +63,17 @@ def apps(request):
 
 @login_required()
 def home(request):
-    def _subquery(q_kwarg):
-        filters = {q_kwarg: OuterRef("pk")}
+    taxonomy = get_taxonomy()
+
+    # active incident counts per operation, area and section from a single rollup query
+    active_counts = {"operation": {}, "area": {}, "section": {}}
+    rows = IncidentRollup.objects.values_list("operation_id", "area_id", "section_id").annotate(count=Sum("active_count")).order_by()
+    for operation_id, area_id, section_id, count in rows:
+        for level, node_id in [("operation", operation_id), ("area", area_id), ("section", section_id)]:
+            active_counts[level][node_id] = active_counts[level].get(node_id, 0) + count
 
-        return Subquery(Incident.objects.filter(**filters, status=Incident.ACTIVE).values(q_kwarg).annotate(count=Count("*")).values("count"))
+    def _counts(level, nodes):
+        return [{"name": node.name, "count": active_counts[level].get(node.id)} for node in nodes]
 
     overdue_anniversaries = (
         Incident.objects.prefetch_related("solutions")
@@ -75,9 +94,9 @@ def home(request):
     anniversaries = list(overdue_anniversaries) + list(upcoming_anniversaries)
 
     context = {
-        "sections": (Section.objects.annotate(count=_subquery("section_id")).values_list("name", "count", named=True)),
-        "areas": (Area.objects.annotate(count=_subquery("area_id")).values_list("name", "count", named=True)),
-        "operations": (Operation.objects.annotate(count=_subquery("operation_id")).values_list("name", "count", named=True)),
+        "sections": _counts("section", taxonomy.sections),
+        "areas": _counts("area", taxonomy.areas),
+        "operations": _counts("operation", taxonomy.operations),
         "equipment": (
             Equipment.objects.filter(incidents__time_start__gte=now() - timedelta(days=365))
             .annotate(count=Count("incidents"))
@@ -89,7 +108,7 @@ def home(request):
             Approval.objects
                 .select_related("incident", "created_by")
                 .filter(user=request.user)
-                .filter(Q(outcome="", type__in=[Approval.RCA, Approval.NOTIFICATION]) | Q(score=0, type=Approval.CLOSE_OUT))
+                .filter(pending_approval_condition())
         ),
         "anniversaries": anniversaries
     }
@@ -104,33 +123,23 @@ def about(request):
 
 @login_required()
 def incident_list(request):
-    incidents = Incident.objects.select_related("created_by", "equipment", "section", "section_engineer").order_by("-time_start")
-
-    query = request.GET.get("query", "")
-
-    if query:
-        search_filters = (
-            Q(short_description__icontains=query) | Q(long_description__icontains=query) | Q(code__exact=query) | Q(equipment__name__icontains=query)
-        )
-        incidents = incidents.filter(search_filters)
+    incidents = Incident.objects.select_related("created_by", "equipment", "section", "section_engineer")
+    incidents = filter_incidents(incidents, request.GET)
 
-    area_id = request.GET.get("area")
-    if area_id:
-        incidents = incidents.filter(area_id=area_id)
+    # search results are ordered by relevance, everything else by date
+    order_field = "search_rank" if request.GET.get("query") else "time_start"
+    paginator = KeysetPaginator(incidents, field=order_field, per_page=INCIDENT_LIST_PAGE_SIZE)
+    page = paginator.page(request.GET.get("cursor"))
 
-    section_id = request.GET.get("section")
-    if section_id:
-        incidents = incidents.filter(section_id=section_id)
-
-    operation_id = request.GET.get("operation")
-    if operation_id:
-        incidents = incidents.filter(operation_id=operation_id)
-
-    status = request.GET.get("status")
-    if status:
-        incidents = incidents.filter(status=status)
+    context = {
+        "incidents": page,
+        "page": page,
+        "query": request.GET.get("query", ""),
+    }
 
-    context = {"incidents": incidents, "query": query}
+    # the total is optional as it requires an additional (bounded) count query
+    if request.GET.get("count") != "0":
+        context["total_count"], context["total_count_exact"] = approximate_count(incidents)
 
     return render(request, "defects/incident_list.html", context)
 
@@ -138,7 +147,7 @@ def incident_list(request):
 @login_required
 def incident_detail(request, pk):
     incident = (
-        Incident.objects.select_related("section", "created_by", "section_engineer", "equipment")
+        Incident.objects.select_related("section", "created_by", "section_engineer", "equipment", "anniversary_reviewed_by")
         .prefetch_related("images", "approvals", "solutions")
         .get(pk=pk)
     )
@@ -222,14 +231,10 @@ def incident_create(request):
             return render(request, template_name, context=context, status=422)
         obj = form.save(commit=False)
 
-        area_id = obj.area_id
         code = "XXX"
-        if area_id is not None:
-            try:
-                area = Area.objects.get(id=area_id)
-                code = area.code or area.name
-            except Area.DoesNotExist:
-                pass
+        area = get_taxonomy().area_by_id.get(obj.area_id)
+        if area is not None:
+            code = area.code or area.name
 
         obj.code = Incident.generate_incident_code(code=code, incident_type="RI")
         obj.created_by = request.user
@@ -263,7 +268,8 @@ def incident_update(request, pk):
             return render(request, template_name, context)
         obj = form.save()
 
-        most_recent_resource_price = ResourcePrice.objects.order_by("-time_created").select_related("created_by").first()
+        # not the cached price, which may not have seen a price saved by another worker yet
+        most_recent_resource_price = ResourcePrice.objects.order_by("-time_created", "-pk").first()
         submitted_resource_price = form.cleaned_data["resource_price"]
         if submitted_resource_price != most_recent_resource_price.rate:
             ResourcePrice.objects.create(rate=submitted_resource_price, created_by=request.user)
@@ -329,56 +335,32 @@ def incident_images(request, pk):
         return HttpResponseRedirect(reverse("incident_images", args=[pk]))
 
 
-@login_required
-def incident_notification_pdf(request, pk):
-    from weasyprint import HTML
-    from .reports import url_fetcher
-
-    qs = Incident.objects.prefetch_related("images").select_related("section")
-
-    incident = get_object_or_404(qs, pk=pk)
-
-    context = {"incident": incident, "images": incident.images.all()}
+def _pdf_response(request, kind, incident_id):
+    """
+    Serves the report from the cache, renders it, or with PDF_JOBS queues it and redirects to the job.
+    """
+    report = REPORTS[kind]
+    incident = get_object_or_404(report.queryset(), pk=incident_id)
+    markup, file_name = report.build(incident)
 
-    markup = render_to_string("defects/reports/notification.html", context=context, request=request)
+    fp = cached_pdf(markup)
+    if fp is None:
+        if settings.PDF_JOBS:
+            job = enqueue(kind, incident, request.user)
+            return HttpResponseRedirect(reverse("pdf_job_detail", args=[job.pk]))
+        fp = render_pdf(markup)
 
-    file_name = f"AMB 48H RI - {incident.section.code} - {incident.short_description} - ({incident.time_start.strftime("%d.%m.%Y")}).pdf"
+    return FileResponse(fp, filename=file_name, content_type="application/pdf")
 
-    response = HttpResponse(
-        headers={
-            "Content-Type": "application/pdf",
-            "Content-Disposition": f'filename="{file_name}"',
-        }
-    )
 
-    doc = HTML(string=markup, url_fetcher=url_fetcher)
-    doc.write_pdf(target=response)
-    return response
+@login_required
+def incident_notification_pdf(request, pk):
+    return _pdf_response(request, PdfJob.NOTIFICATION, pk)
 
 
 @login_required
 def incident_anniversary_pdf(request, pk):
-    from weasyprint import HTML
-    from .reports import url_fetcher
-
-    qs = Incident.objects.prefetch_related("solutions")
-
-    incident = get_object_or_404(qs, pk=pk)
-
-    context = {"incident": incident}
-
-    markup = render_to_string("defects/reports/anniversary.html", context=context, request=request)
-
-    response = HttpResponse(
-        headers={
-            "Content-Type": "application/pdf",
-            "Content-Disposition": f'filename="anniversary-{incident.code}.pdf"',
-        }
-    )
-
-    doc = HTML(string=markup, url_fetcher=url_fetcher)
-    doc.write_pdf(target=response)
-    return response
+    return _pdf_response(request, PdfJob.ANNIVERSARY, pk)
 
 
 @login_required
@@ -402,41 +384,81 @@ def incident_anniversary_detail(request, pk):
 
 @login_required
 def incident_close_pdf(request, pk):
-    from weasyprint import HTML
-    from .reports import url_fetcher
+    if request.GET.get("html") == "1":
+        report = REPORTS[PdfJob.CLOSE_OUT]
+        markup, _ = report.build(get_object_or_404(report.queryset(), pk=pk))
+        markup = markup.replace("static:", "/static/")
+        return HttpResponse(markup, headers={"content-type": "text/html"})
 
-    incident = get_object_or_404(Incident, pk=pk)
+    return _pdf_response(request, PdfJob.CLOSE_OUT, pk)
 
-    se_approval = Approval.objects.select_related("user").order_by("-time_modified").filter(incident=incident, role=Approval.SECTION_ENGINEER, type=Approval.CLOSE_OUT,
-                                                                                            score__gt=0).first()
-    sem_approval = Approval.objects.select_related("user").order_by("-time_modified").filter(incident=incident, role=Approval.SECTION_ENGINEERING_MANAGER, type=Approval.CLOSE_OUT,
-                                                                                             score__gt=0).first()
 
-    # ["name", 1, <date>|<datetime>]
-    ratings = {
-        "re": [incident.created_by.username, incident.close_out_confidence, incident.close_out_time_published],
-        "se": ["---", 0, None] if se_approval is None else [se_approval.user.username, se_approval.score, se_approval.time_modified],
-        "sem": ["---", 0, None] if sem_approval is None else [sem_approval.user.username, sem_approval.score, sem_approval.time_modified],
-    }
+@require_GET
+@login_required
+def incident_pack(request):
+    """
+    The reports of all incidents matching the RI register filters, as `?kind=<report>&pack=zip|pdf`.
+    """
+    kind = request.GET.get("kind", PdfJob.CLOSE_OUT)
+    pack_format = request.GET.get("pack", PdfJob.ZIP)
+    if kind not in REPORTS or pack_format not in PACK_CONTENT_TYPES:
+        return HttpResponseBadRequest("Unknown report or pack format.")
+
+    filters = request.GET.copy()
+    filters.pop("kind", None)
+    filters.pop("pack", None)
+    filters = filters.urlencode()
+
+    incidents = pack_incidents(kind, filters)
+    total = incidents.count()
+    if total > PACK_MAX_INCIDENTS:
+        return HttpResponseBadRequest(f"{total} incidents match the filters, a pack can have at most {PACK_MAX_INCIDENTS}.")
+
+    if settings.PDF_JOBS:
+        job = enqueue_pack(kind, pack_format, filters, total, request.user)
+        return HttpResponseRedirect(reverse("pdf_job_detail", args=[job.pk]))
+
+    if total > PACK_SYNC_MAX_INCIDENTS:
+        return HttpResponseBadRequest(f"{total} incidents match the filters, a pack can have at most {PACK_SYNC_MAX_INCIDENTS}.")
+
+    file_name = pack_file_name(kind, pack_format)
+    if pack_format == PdfJob.ZIP:
+        return StreamingHttpResponse(
+            stream_zip(kind, incidents),
+            headers={"Content-Type": PACK_CONTENT_TYPES[pack_format], "Content-Disposition": f'attachment; filename="{file_name}"'},
+        )
 
-    context = {"incident": incident, "ratings": ratings}
+    # deleted when the response is closed
+    fp = tempfile.TemporaryFile()
+    write_pack(fp, kind, pack_format, incidents)
+    fp.seek(0)
+    return FileResponse(fp, as_attachment=True, filename=file_name, content_type=PACK_CONTENT_TYPES[pack_format])
 
-    markup = render_to_string("defects/reports/closeout.html", context=context, request=request)
 
-    if request.GET.get("html") == "1":
-        markup = markup.replace("static:", "/static/")
-        return HttpResponse(markup, headers={"content-type": "text/html"})
+@login_required
+def pdf_job_detail(request, pk):
+    """
+    Waits for a queued report and then downloads it.
+    """
+    job = get_object_or_404(PdfJob.objects.select_related("incident"), pk=pk)
+    if job.status == PdfJob.DONE:
+        return HttpResponseRedirect(reverse("pdf_job_download", args=[job.pk]))
+    return render(request, "defects/pdf_job.html", context={"job": job})
 
-    response = HttpResponse(
-        headers={
-            "Content-Type": "application/pdf",
-            "Content-Disposition": f'filename="close-{incident.code}.pdf"',
-        }
-    )
 
-    doc = HTML(string=markup, url_fetcher=url_fetcher)
-    doc.write_pdf(target=response)
-    return response
+@login_required
+def pdf_job_status(request, pk):
+    job = get_object_or_404(PdfJob, pk=pk)
+    data = {"id": job.pk, "status": job.status, "error": job.error, "progress": job.progress, "total": job.total}
+    if job.status == PdfJob.DONE:
+        data["download_url"] = reverse("pdf_job_download", args=[job.pk])
+    return JsonResponse(data)
+
+
+@login_required
+def pdf_job_download(request, pk):
+    job = get_object_or_404(PdfJob, pk=pk, status=PdfJob.DONE)
+    return FileResponse(job.file.open("rb"), filename=job.file_name, content_type=PACK_CONTENT_TYPES[job.pack or PdfJob.PDF])
 
 
 @login_required
@@ -521,9 +543,7 @@ def solution_completion(request):
 def value_dashboard(request):
     area_filter_id = request.GET.get("area")
 
-    areas = Area.objects.all().order_by("name").order_by("name")
-
-    incidents = Incident.objects.all()
+    areas = get_taxonomy().areas_by_name
 
     area_id = None if (not area_filter_id or area_filter_id == "all") else area_filter_id
 
@@ -562,22 +582,28 @@ def value_dashboard(request):
 def compliance_dashboard(request):
     area_filter_id = request.GET.get("area")
 
-    areas = Area.objects.all().order_by("name")
+    taxonomy = get_taxonomy()
 
-    sections = Section.objects.all()
+    section_nodes = taxonomy.sections
+    area_id = None
     if area_filter_id and area_filter_id != "all":
-        sections = sections.filter(area_id=area_filter_id)
+        area_id = int(area_filter_id) if area_filter_id.isdigit() else None
+        section_nodes = taxonomy.sections_in_area(area_id)
 
+    section_stats = get_weekly_ri_count_for_sections(area_id=area_id, section_ids=[s.id for s in section_nodes])
+
+    # taxonomy nodes are shared between requests, so the free days are added to copies
+    sections = []
     stats = {}
-    for section in sections:
+    for section in section_nodes:
+        sections.append({"id": section.id, "name": section.name, "ri_free_days": section_stats[section.id]["ri_free_days"]})
         stats[str(section.id)] = {
             "name": section.name,
-            "ri_count": get_weekly_ri_count_per_section(section_id=section.id),
-            "ri_free_days": 0
+            **section_stats[section.id],
         }
 
     context = {
-        "areas": areas,
+        "areas": taxonomy.areas_by_name,
         "sections": sections,
         "stats": stats,
     }
@@ -599,25 +625,11 @@ def solution_list(request):
     solutions = Solution.objects.select_related("incident").exclude(incident=None)
     context = {}
 
-    query = request.GET.get("query", "")
-
-    if query:
-        search_filters = Q(description__icontains=query) | Q(remarks__icontains=query) | Q(person_responsible__icontains=query)
-        solutions = solutions.filter(search_filters)
-
-    # todo: this filter needs to be fixed since the db column was removed
-    # status = request.GET.get("status")
-    # if status:
-    #     solutions = solutions.filter(status=status)
-
-    timeframe = request.GET.get("timeframe")
-    if timeframe:
-        solutions = solutions.filter(timeframe=timeframe)
+    solutions = filter_solutions(solutions, request.GET)
 
     incident_id = request.GET.get("incident_id")
     if incident_id:
         context["incident"] = Incident.objects.get(id=incident_id)
-        solutions = solutions.filter(incident_id=incident_id)
 
     context["solutions"] = solutions
 
@@ -642,13 +654,11 @@ def login(request):
 
 @login_required
 def equipment_search(request):
-    query = request.GET.get("q")
-
-    qs = Equipment.objects.filter(Q(code=query) | Q(name__icontains=query))[:50]
+    query = request.GET.get("q", "")
 
     return JsonResponse(
         {
-            "items": [{"id": x.id, "name": str(x)} for x in qs],
+            "items": [{"id": x.id, "name": x.label} for x in search_equipment(query)],
         }
     )
 
@@ -915,22 +925,89 @@ def incident_findings_upload(request, pk):
         return HttpResponseRedirect(reverse("incident_detail", args=[incident.pk]))
 
 
+def _export_response(request, queryset, columns, name):
+    """
+    Response with the export of `queryset` in the format requested with `?format=csv|xlsx`.
+    """
+    filename = f"{name}-{now().strftime('%Y-%m-%d')}"
+
+    if request.GET.get("format") == "xlsx":
+        # deleted when the response is closed
+        fp = tempfile.TemporaryFile()
+        write_rows_xlsx(fp, queryset, columns, sheet_name=name.title())
+        fp.seek(0)
+        return FileResponse(
+            fp,
+            as_attachment=True,
+            filename=f"{filename}.xlsx",
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+    return StreamingHttpResponse(
+        stream_rows_csv(queryset, columns),
+        headers={"Content-Type": "text/csv", "Content-Disposition": f'attachment; filename="{filename}.csv"'},
+    )
+
+
 @login_required
 def incident_list_export(request):
-    response = HttpResponse(
-        headers={"Content-Type": "text/csv", "Content-Disposition": f"attachment; filename=\"incidents-{now().strftime('%Y-%m-%d')}.csv\""}
-    )
+    try:
+        columns = select_columns(INCIDENT_COLUMNS, request.GET.get("columns"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    incidents = filter_incidents(Incident.objects.all(), request.GET).order_by("-time_start", "-id")
 
-    return export_table_csv(response, Incident._meta.db_table)
+    return _export_response(request, incidents, columns, "incidents")
 
 
 @login_required
 def solution_list_export(request):
-    response = HttpResponse(
-        headers={"Content-Type": "text/csv", "Content-Disposition": f"attachment; filename=\"solutions-{now().strftime('%Y-%m-%d')}.csv\""}
-    )
+    try:
+        columns = select_columns(SOLUTION_COLUMNS, request.GET.get("columns"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    solutions = filter_solutions(Solution.objects.exclude(incident=None), request.GET).order_by("planned_completion_date", "id")
+
+    return _export_response(request, solutions, columns, "solutions")
+
+
+@login_required
+def analytics_export(request, dataset):
+    if dataset not in DATASETS:
+        raise Http404()
+    file_format = request.GET.get("format", "parquet")
+    if file_format not in ANALYTICS_FORMATS:
+        return HttpResponseBadRequest(f"Unknown format: {file_format}")
+    extension, content_type = ANALYTICS_FORMATS[file_format]
+
+    # deleted when the response is closed
+    fp = tempfile.TemporaryFile()
+    try:
+        write_dataset(fp, dataset, file_format)
+    except ImproperlyConfigured as e:
+        fp.close()
+        return HttpResponse(str(e), status=501)
+    fp.seek(0)
+    return FileResponse(fp, as_attachment=True, filename=f"{dataset}-{now().strftime('%Y-%m-%d')}.{extension}", content_type=content_type)
+
 
-    return export_table_csv(response, Solution._meta.db_table)
+@login_required
+def change_feed(request, feed):
+    """
+    Rows of `feed` changed after the `since` watermark of the previous call, see `defects.changes`.
+    """
+    if feed not in FEEDS:
+        raise Http404()
+    try:
+        since = Watermark.parse(request.GET["since"]) if request.GET.get("since") else None
+        limit = min(max(int(request.GET.get("limit", CHANGE_FEED_PAGE_SIZE)), 1), CHANGE_FEED_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid since or limit parameter.")
+
+    page = changes(feed, since, limit=limit)
+    return JsonResponse({"rows": page.rows, "deleted": page.deleted, "watermark": str(page.watermark), "has_more": page.has_more})
 
 
 @require_GET